@@ -1,12 +1,13 @@
 # Add these additional routes to the existing app.py file
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 import os
 import uuid
+import upload_store
 
 # Import your database models and app instance
 # Assuming these are defined in your main app.py or models.py
@@ -30,7 +31,11 @@ def get_appointments():
         date = request.args.get('date')
         status = request.args.get('status')
         
-        query = Appointment.query
+        # Load patient and doctor in the same query instead of one lookup per row
+        query = Appointment.query.options(
+            db.joinedload(Appointment.patient),
+            db.joinedload(Appointment.doctor)
+        )
         
         # Filter by user type
         if user.user_type == 'patient':
@@ -54,8 +59,8 @@ def get_appointments():
         
         result = []
         for appointment in appointments:
-            patient = Patient.query.get(appointment.patient_id)
-            doctor = Doctor.query.get(appointment.doctor_id)
+            patient = appointment.patient
+            doctor = appointment.doctor
             
             result.append({
                 'id': appointment.id,
@@ -204,7 +209,10 @@ def get_prescriptions():
         user_id = get_jwt_identity()
         user = User.query.get(user_id)
         
-        query = Prescription.query
+        query = Prescription.query.options(
+            db.joinedload(Prescription.patient),
+            db.joinedload(Prescription.doctor)
+        )
         
         if user.user_type == 'patient':
             patient = Patient.query.filter_by(user_id=user_id).first()
@@ -219,8 +227,8 @@ def get_prescriptions():
         
         result = []
         for prescription in prescriptions:
-            patient = Patient.query.get(prescription.patient_id)
-            doctor = Doctor.query.get(prescription.doctor_id)
+            patient = prescription.patient
+            doctor = prescription.doctor
             
             result.append({
                 'id': prescription.id,
@@ -270,7 +278,7 @@ def upload_file():
 
 @app.route('/api/files/<filename>')
 def serve_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return upload_store.send_upload(filename)
 
 # Add sample data creation function
 def create_sample_data():
@@ -1,13 +1,23 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 import os
+import threading
 from dotenv import load_dotenv
 import uuid
+from pagination import get_page_args, split_page
+import medicine_search
+import slot_engine
+import upload_store
+import upload_routes
+import response_cache
+import thumbnails
 
 # Load environment variables
 load_dotenv()
@@ -22,6 +32,11 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-string')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
+# '' serves uploads from Python, 'x-sendfile' or 'x-accel-redirect' hands them to the web server
+app.config['UPLOAD_SEND_MODE'] = upload_store.check_send_mode(os.getenv('UPLOAD_SEND_MODE', ''))
+app.config['UPLOAD_ACCEL_PREFIX'] = os.getenv('UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+app.config['UPLOAD_MAX_AGE'] = int(os.getenv('UPLOAD_MAX_AGE', '3600'))
+app.config['USE_X_SENDFILE'] = app.config['UPLOAD_SEND_MODE'] == 'x-sendfile'
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', '16777216'))
 
 # Initialize extensions
@@ -94,6 +109,29 @@ class Appointment(db.Model):
     prescription_id = db.Column(db.String(36), db.ForeignKey('prescription.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    patient = db.relationship('Patient', foreign_keys=[patient_id])
+    doctor = db.relationship('Doctor', foreign_keys=[doctor_id])
+
+    __table_args__ = (
+        db.Index('ix_appointment_doctor_date', 'doctor_id', 'appointment_date'),
+        # Last line of defence against double booking: one live appointment per doctor and start time
+        db.Index('uq_appointment_doctor_start', 'doctor_id', 'appointment_date', unique=True,
+                 sqlite_where=db.text("status != 'cancelled'"),
+                 postgresql_where=db.text("status != 'cancelled'")),
+    )
+
+class SlotHold(db.Model):
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    doctor_id = db.Column(db.String(36), db.ForeignKey('doctor.id'), nullable=False)
+    patient_id = db.Column(db.String(36), db.ForeignKey('patient.id'), nullable=False)
+    start_at = db.Column(db.DateTime, nullable=False)
+    duration_minutes = db.Column(db.Integer, default=30)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_slot_hold_doctor_start', 'doctor_id', 'start_at'),
+    )
+
 class Prescription(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     patient_id = db.Column(db.String(36), db.ForeignKey('patient.id'), nullable=False)
@@ -105,6 +143,9 @@ class Prescription(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_dispensed = db.Column(db.Boolean, default=False)
 
+    patient = db.relationship('Patient', foreign_keys=[patient_id])
+    doctor = db.relationship('Doctor', foreign_keys=[doctor_id])
+
 class DoctorSchedule(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     doctor_id = db.Column(db.String(36), db.ForeignKey('doctor.id'), nullable=False)
@@ -122,19 +163,202 @@ class PrescriptionRequest(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     processed_at = db.Column(db.DateTime)
     processed_by = db.Column(db.String(100))  # Pharmacist name or ID
+    claimed_by = db.Column(db.String(36))  # User id of the pharmacist working on it
+    claim_expires_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # Only pending rows are indexed, so claiming stays cheap however much history piles up
+        db.Index('ix_prescription_request_pending', 'created_at', 'id',
+                 sqlite_where=db.text("status = 'pending'"),
+                 postgresql_where=db.text("status = 'pending'")),
+    )
+
+class StoredFile(db.Model):
+    # One row per stored file, i.e. per upload_store.content_relative_path(): the
+    # same bytes uploaded as .jpg and as .jpeg are two files on disk
+    sha256 = db.Column(db.String(64), primary_key=True)
+    extension = db.Column(db.String(10), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    upload_count = db.Column(db.Integer, default=1, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Doctor directory responses, dropped whenever a Doctor (or a doctor's User row) is written
+doctor_cache = response_cache.ResponseCache(
+    'doctors',
+    maxsize=int(os.getenv('DOCTOR_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('DOCTOR_CACHE_TTL_SECONDS', '60')),
+    version=response_cache.version_from_env('doctors')
+)
+
+def touches_doctor_directory(obj):
+    return isinstance(obj, Doctor) or (isinstance(obj, User) and obj.user_type == 'doctor')
+
+@event.listens_for(Session, 'after_flush')
+def note_doctor_changes(session, flush_context):
+    if any(touches_doctor_directory(obj) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info['doctor_directory_changed'] = True
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def note_doctor_bulk_changes(context):
+    if context.mapper.class_ in (Doctor, User):
+        context.session.info['doctor_directory_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_doctor_cache(session):
+    # Only after commit, so no other request can refill the cache from the old rows
+    if session.info.pop('doctor_directory_changed', False):
+        doctor_cache.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def forget_doctor_changes(session):
+    session.info.pop('doctor_directory_changed', None)
+
+MAX_SLOT_RANGE_DAYS = 31
+MAX_APPOINTMENT_MINUTES = 240
+SLOT_HOLD_SECONDS = int(os.getenv('SLOT_HOLD_SECONDS', 300))
+CONSULTATION_TYPES = ('video', 'phone', 'chat')
+PRESCRIPTION_CLAIM_LEASE_SECONDS = int(os.getenv('PRESCRIPTION_CLAIM_LEASE_SECONDS', 600))
+MAX_PRESCRIPTION_CLAIMS = 20
+# Oldest pending requests an unpaginated listing returns; work is handed out by the claim endpoint
+MAX_PRESCRIPTION_LISTING = int(os.getenv('MAX_PRESCRIPTION_LISTING', 200))
 
 # Helper functions
 def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def apply_keyset(query, columns, page):
+    """Order by `columns` and, for paginated requests, seek past the cursor row"""
+    query = query.order_by(*columns)
+    if not page:
+        return query
+    if page.after:
+        # (c1, c2, ...) > (v1, v2, ...) spelled out so SQLite and PostgreSQL both accept it
+        clauses = []
+        for i, column in enumerate(columns):
+            equal = [columns[j] == page.after[j] for j in range(i)]
+            clauses.append(db.and_(*equal, column > page.after[i]))
+        query = query.filter(db.or_(*clauses))
+    return query.limit(page.limit + 1)
+
+def search_medicine_ids(search):
+    """Ids of medicines matching `search`, most relevant first (typo tolerant on SQLite)"""
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite' and medicine_search.sqlite_fts_ready(connection):
+        rows = medicine_search.sqlite_candidates(connection, search)
+    else:
+        rows = db.session.query(
+            Medicine.id, Medicine.name, Medicine.generic_name, Medicine.manufacturer, Medicine.category
+        ).filter(
+            db.or_(
+                Medicine.name.ilike(f'%{search}%'),
+                Medicine.generic_name.ilike(f'%{search}%')
+            )
+        ).limit(medicine_search.CANDIDATE_LIMIT).all()
+    return [medicine_id for medicine_id, _ in medicine_search.rank(search, rows)]
+
+def parse_slot_range(args, start_key='start_date'):
+    """(first_day, last_day, slot_minutes) from query args; ValueError with a user-facing message"""
+    start_date = args.get(start_key)
+    if not start_date:
+        raise ValueError(f'{start_key} is required')
+    try:
+        first_day = datetime.strptime(start_date, '%Y-%m-%d').date()
+        last_day = datetime.strptime(args.get('end_date', start_date), '%Y-%m-%d').date()
+        slot_minutes = int(args.get('duration', 30))
+    except ValueError:
+        raise ValueError('Dates must be YYYY-MM-DD and duration a number of minutes')
+    if last_day < first_day or (last_day - first_day).days >= MAX_SLOT_RANGE_DAYS:
+        raise ValueError(f'Date range must cover 1 to {MAX_SLOT_RANGE_DAYS} days')
+    if not 5 <= slot_minutes <= MAX_APPOINTMENT_MINUTES:
+        raise ValueError(f'duration must be between 5 and {MAX_APPOINTMENT_MINUTES} minutes')
+    return first_day, last_day, slot_minutes
+
+def load_slot_inputs(doctor_ids, first_day, last_day):
+    """Schedules and booked appointments for many doctors in two queries.
+
+    Returns {doctor_id: (schedules, appointments)} as slot_engine expects;
+    schedules is None for doctors who never set one (default hours apply).
+    """
+    schedule_rows = db.session.query(
+        DoctorSchedule.doctor_id, DoctorSchedule.day_of_week, DoctorSchedule.start_time,
+        DoctorSchedule.end_time, DoctorSchedule.is_available
+    ).filter(DoctorSchedule.doctor_id.in_(doctor_ids)).all()
+
+    # One range query (served by ix_appointment_doctor_date) for every day requested
+    range_start = datetime.combine(first_day, datetime.min.time())
+    range_end = datetime.combine(last_day + timedelta(days=1), datetime.min.time())
+    appointment_rows = db.session.query(
+        Appointment.doctor_id, Appointment.appointment_date, Appointment.duration_minutes
+    ).filter(
+        Appointment.doctor_id.in_(doctor_ids),
+        Appointment.appointment_date >= range_start,
+        Appointment.appointment_date < range_end,
+        Appointment.status != 'cancelled'
+    ).all()
+    # Slots another patient is part-way through booking count as taken
+    hold_rows = db.session.query(
+        SlotHold.doctor_id, SlotHold.start_at, SlotHold.duration_minutes
+    ).filter(
+        SlotHold.doctor_id.in_(doctor_ids),
+        SlotHold.start_at >= range_start,
+        SlotHold.start_at < range_end,
+        SlotHold.expires_at > datetime.utcnow()
+    ).all()
+
+    inputs = {doctor_id: (None, []) for doctor_id in doctor_ids}
+    for doctor_id, day_of_week, start_time, end_time, is_available in schedule_rows:
+        schedules, appointments = inputs[doctor_id]
+        if schedules is None:
+            schedules = []
+            inputs[doctor_id] = (schedules, appointments)
+        if is_available:
+            schedules.append((day_of_week, start_time, end_time))
+    for doctor_id, start, duration_minutes in appointment_rows + hold_rows:
+        inputs[doctor_id][1].append((start, duration_minutes))
+    return inputs
+
+def lock_doctor_bookings(doctor_id):
+    """Serialise bookings for one doctor until commit (row lock on PostgreSQL; SQLite locks on write)"""
+    return db.session.query(Doctor.id).filter(Doctor.id == doctor_id).with_for_update().first()
+
+def find_booking_conflict(doctor_id, start, duration_minutes, patient_id):
+    """'appointment' or 'hold' if [start, start + duration) is taken, else None.
+
+    The caller's own holds never conflict. Appointments can last at most
+    MAX_APPOINTMENT_MINUTES, which bounds how far back an overlap can start.
+    """
+    end = start + timedelta(minutes=duration_minutes)
+    earliest = start - timedelta(minutes=MAX_APPOINTMENT_MINUTES)
+    appointments = db.session.query(Appointment.appointment_date, Appointment.duration_minutes).filter(
+        Appointment.doctor_id == doctor_id,
+        Appointment.appointment_date > earliest,
+        Appointment.appointment_date < end,
+        Appointment.status != 'cancelled'
+    ).all()
+    if slot_engine.overlaps(slot_engine.booked_intervals(appointments), start, end):
+        return 'appointment'
+    holds = db.session.query(SlotHold.start_at, SlotHold.duration_minutes).filter(
+        SlotHold.doctor_id == doctor_id,
+        SlotHold.patient_id != patient_id,
+        SlotHold.start_at > earliest,
+        SlotHold.start_at < end,
+        SlotHold.expires_at > datetime.utcnow()
+    ).all()
+    if slot_engine.overlaps(slot_engine.booked_intervals(holds), start, end):
+        return 'hold'
+    return None
+
 # Health check endpoint for Railway
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({
         'status': 'healthy',
         'message': 'Helio backend is running',
-        'timestamp': datetime.utcnow().isoformat()
+        'timestamp': datetime.utcnow().isoformat(),
+        'doctor_cache': doctor_cache.stats()
     }), 200
 
 # Authentication Routes
@@ -205,6 +429,18 @@ def get_doctors():
     try:
         search = request.args.get('search', '')
         specialty = request.args.get('specialty', '')
+        try:
+            page = get_page_args(request.args, (str, str))
+        except ValueError as e:
+            return jsonify({'message': 'Invalid pagination parameters', 'error': str(e)}), 400
+        
+        cache_key = (search.lower(), specialty.lower(), page.limit if page else None,
+                     tuple(page.after) if page and page.after else None)
+        body = doctor_cache.get(cache_key)
+        if body is not None:
+            return app.response_class(body, mimetype='application/json', headers={'X-Cache': 'HIT'}), 200
+        # Read before querying, so an invalidation during the query is not papered over
+        version = doctor_cache.current_version()
         
         query = db.session.query(Doctor, User).join(User).filter(User.is_active == True)
         
@@ -213,7 +449,9 @@ def get_doctors():
         if specialty:
             query = query.filter(Doctor.specialty.ilike(f'%{specialty}%'))
         
-        doctors = query.all()
+        doctors = apply_keyset(query, (Doctor.name, Doctor.id), page).all()
+        if page:
+            doctors, next_cursor = split_page(doctors, page.limit, lambda row: (row[0].name, row[0].id))
         
         result = []
         for doctor, user in doctors:
@@ -231,7 +469,9 @@ def get_doctors():
                 'profile_image': doctor.profile_image
             })
         
-        return jsonify(result), 200
+        body = app.json.dumps({'doctors': result, 'next_cursor': next_cursor} if page else result)
+        doctor_cache.set(cache_key, body, version)
+        return app.response_class(body, mimetype='application/json', headers={'X-Cache': 'MISS'}), 200
         
     except Exception as e:
         return jsonify({'message': 'Failed to fetch doctors', 'error': str(e)}), 500
@@ -266,22 +506,31 @@ def get_medicines():
         search = request.args.get('search', '')
         category = request.args.get('category', '')
         low_stock = request.args.get('low_stock', 'false').lower() == 'true'
+        try:
+            page = get_page_args(request.args, (str, str))
+        except ValueError as e:
+            return jsonify({'message': 'Invalid pagination parameters', 'error': str(e)}), 400
         
         query = Medicine.query
         
         if search:
-            query = query.filter(
-                db.or_(
-                    Medicine.name.ilike(f'%{search}%'),
-                    Medicine.generic_name.ilike(f'%{search}%')
-                )
-            )
+            ranked_ids = search_medicine_ids(search)
+            query = query.filter(Medicine.id.in_(ranked_ids))
         if category:
             query = query.filter(Medicine.category == category)
         if low_stock:
             query = query.filter(Medicine.stock_quantity < 10)
         
-        medicines = query.all()
+        if search:
+            # Relevance order; search results are capped rather than paged
+            position = {medicine_id: i for i, medicine_id in enumerate(ranked_ids)}
+            medicines = sorted(query.all(), key=lambda m: position[m.id])
+            medicines = medicines[:page.limit if page else medicine_search.SEARCH_RESULT_LIMIT]
+            next_cursor = None
+        else:
+            medicines = apply_keyset(query, (Medicine.name, Medicine.id), page).all()
+            if page:
+                medicines, next_cursor = split_page(medicines, page.limit, lambda m: (m.name, m.id))
         
         result = []
         for medicine in medicines:
@@ -303,6 +552,8 @@ def get_medicines():
                 'requires_prescription': medicine.requires_prescription
             })
         
+        if page:
+            return jsonify({'medicines': result, 'next_cursor': next_cursor}), 200
         return jsonify(result), 200
         
     except Exception as e:
@@ -320,8 +571,16 @@ def get_appointments():
         doctor_id = request.args.get('doctor_id')
         date = request.args.get('date')
         status = request.args.get('status')
-        
-        query = Appointment.query
+        try:
+            page = get_page_args(request.args, (datetime.fromisoformat, str))
+        except ValueError as e:
+            return jsonify({'message': 'Invalid pagination parameters', 'error': str(e)}), 400
+        
+        # Load patient and doctor in the same query instead of one lookup per row
+        query = Appointment.query.options(
+            db.joinedload(Appointment.patient),
+            db.joinedload(Appointment.doctor)
+        )
         
         # Filter by user type
         if user.user_type == 'patient':
@@ -341,12 +600,16 @@ def get_appointments():
         if status:
             query = query.filter(Appointment.status == status)
         
-        appointments = query.all()
+        appointments = apply_keyset(query, (Appointment.appointment_date, Appointment.id), page).all()
+        if page:
+            appointments, next_cursor = split_page(
+                appointments, page.limit, lambda a: (a.appointment_date.isoformat(), a.id)
+            )
         
         result = []
         for appointment in appointments:
-            patient = Patient.query.get(appointment.patient_id)
-            doctor = Doctor.query.get(appointment.doctor_id)
+            patient = appointment.patient
+            doctor = appointment.doctor
             
             result.append({
                 'id': appointment.id,
@@ -361,6 +624,8 @@ def get_appointments():
                 'notes': appointment.notes
             })
         
+        if page:
+            return jsonify({'appointments': result, 'next_cursor': next_cursor}), 200
         return jsonify(result), 200
         
     except Exception as e:
@@ -378,18 +643,39 @@ def create_appointment():
         if not patient:
             return jsonify({'message': 'Patient profile not found'}), 404
         
+        try:
+            appointment_date = datetime.strptime(data['appointment_date'], '%Y-%m-%dT%H:%M:%S')
+            duration_minutes = int(data.get('duration_minutes', 30))
+        except (KeyError, ValueError):
+            return jsonify({'message': 'appointment_date must be YYYY-MM-DDTHH:MM:SS'}), 400
+        if not 5 <= duration_minutes <= MAX_APPOINTMENT_MINUTES:
+            return jsonify({'message': f'duration_minutes must be between 5 and {MAX_APPOINTMENT_MINUTES}'}), 400
+        
+        lock_doctor_bookings(data['doctor_id'])
+        conflict = find_booking_conflict(data['doctor_id'], appointment_date, duration_minutes, patient.id)
+        if conflict:
+            db.session.rollback()
+            return jsonify({'message': 'This slot is no longer available', 'conflict': conflict}), 409
+        
         appointment = Appointment(
             patient_id=patient.id,
             doctor_id=data['doctor_id'],
-            appointment_date=datetime.strptime(data['appointment_date'], '%Y-%m-%dT%H:%M:%S'),
-            duration_minutes=data.get('duration_minutes', 30),
+            appointment_date=appointment_date,
+            duration_minutes=duration_minutes,
             consultation_type=data.get('consultation_type', 'video'),
             symptoms=data.get('symptoms', ''),
             notes=data.get('notes', '')
         )
         
-        db.session.add(appointment)
-        db.session.commit()
+        try:
+            db.session.add(appointment)
+            # The patient's own hold has served its purpose
+            SlotHold.query.filter_by(doctor_id=data['doctor_id'], patient_id=patient.id).delete()
+            db.session.commit()
+        except IntegrityError:
+            # Lost the race for this exact start time to a concurrent booking
+            db.session.rollback()
+            return jsonify({'message': 'This slot is no longer available', 'conflict': 'appointment'}), 409
         
         return jsonify({
             'message': 'Appointment created successfully',
@@ -400,88 +686,215 @@ def create_appointment():
         db.session.rollback()
         return jsonify({'message': 'Failed to create appointment', 'error': str(e)}), 500
 
+@app.route('/api/appointments/holds', methods=['POST'])
+@jwt_required()
+def create_slot_hold():
+    """Hold a slot for SLOT_HOLD_SECONDS while the patient finishes booking"""
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json() or {}
+        
+        patient = Patient.query.filter_by(user_id=user_id).first()
+        if not patient:
+            return jsonify({'message': 'Patient profile not found'}), 404
+        
+        try:
+            start_at = datetime.strptime(data['appointment_date'], '%Y-%m-%dT%H:%M:%S')
+            duration_minutes = int(data.get('duration_minutes', 30))
+            doctor_id = data['doctor_id']
+        except (KeyError, ValueError):
+            return jsonify({'message': 'doctor_id and appointment_date (YYYY-MM-DDTHH:MM:SS) are required'}), 400
+        if not 5 <= duration_minutes <= MAX_APPOINTMENT_MINUTES:
+            return jsonify({'message': f'duration_minutes must be between 5 and {MAX_APPOINTMENT_MINUTES}'}), 400
+        
+        lock_doctor_bookings(doctor_id)
+        conflict = find_booking_conflict(doctor_id, start_at, duration_minutes, patient.id)
+        if conflict:
+            db.session.rollback()
+            return jsonify({'message': 'This slot is no longer available', 'conflict': conflict}), 409
+        
+        # One hold per patient and doctor; expired holds are cleared as new ones arrive
+        now = datetime.utcnow()
+        SlotHold.query.filter(db.or_(
+            SlotHold.expires_at <= now,
+            db.and_(SlotHold.doctor_id == doctor_id, SlotHold.patient_id == patient.id)
+        )).delete(synchronize_session=False)
+        hold = SlotHold(
+            doctor_id=doctor_id,
+            patient_id=patient.id,
+            start_at=start_at,
+            duration_minutes=duration_minutes,
+            expires_at=now + timedelta(seconds=SLOT_HOLD_SECONDS)
+        )
+        db.session.add(hold)
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Slot held',
+            'hold_id': hold.id,
+            'expires_at': hold.expires_at.isoformat()
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Failed to hold slot', 'error': str(e)}), 500
+
+@app.route('/api/appointments/holds/<hold_id>', methods=['DELETE'])
+@jwt_required()
+def release_slot_hold(hold_id):
+    """Release a hold the patient no longer needs"""
+    try:
+        user_id = get_jwt_identity()
+        patient = Patient.query.filter_by(user_id=user_id).first()
+        if not patient:
+            return jsonify({'message': 'Patient profile not found'}), 404
+        
+        SlotHold.query.filter_by(id=hold_id, patient_id=patient.id).delete()
+        db.session.commit()
+        return jsonify({'message': 'Hold released'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Failed to release hold', 'error': str(e)}), 500
+
 @app.route('/api/appointments/slots', methods=['GET'])
 def get_available_slots():
+    """Slots for one date (legacy list) or for start_date..end_date (per-day breakdown)"""
     try:
         doctor_id = request.args.get('doctor_id')
-        date = request.args.get('date')
+        start_key = 'start_date' if 'start_date' in request.args else 'date'
         
-        if not doctor_id or not date:
-            return jsonify({'message': 'doctor_id and date are required'}), 400
-        
-        # Get existing appointments for the date
-        appointments = Appointment.query.filter(
-            Appointment.doctor_id == doctor_id,
-            db.func.date(Appointment.appointment_date) == date,
-            Appointment.status != 'cancelled'
-        ).all()
-        
-        # Generate available slots (9 AM to 5 PM, 30-minute slots)
-        slots = []
-        start_hour = 9
-        end_hour = 17
-        
-        for hour in range(start_hour, end_hour):
-            for minute in [0, 30]:
-                slot_time = f"{hour:02d}:{minute:02d}"
-                
-                # Check if slot is booked
-                is_booked = any(
-                    apt.appointment_date.time().replace(second=0, microsecond=0) == 
-                    datetime.strptime(slot_time, '%H:%M').time()
-                    for apt in appointments
-                )
-                
-                slots.append({
-                    'time': slot_time,
-                    'available': not is_booked
-                })
+        if not doctor_id or not request.args.get(start_key):
+            return jsonify({'message': 'doctor_id and date (or start_date) are required'}), 400
+        
+        try:
+            first_day, last_day, slot_minutes = parse_slot_range(request.args, start_key)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        
+        schedules, appointments = load_slot_inputs([doctor_id], first_day, last_day)[doctor_id]
+        days = slot_engine.compute_slots(first_day, last_day, schedules, appointments, slot_minutes)
         
-        return jsonify(slots), 200
+        if 'start_date' not in request.args and 'end_date' not in request.args:
+            _, slots = days[0]
+            return jsonify([
+                {'time': start.strftime('%H:%M'), 'available': available}
+                for start, available in slots
+            ]), 200
+        
+        busy = slot_engine.booked_intervals(appointments)
+        result = []
+        for day, slots in days:
+            free = slot_engine.free_intervals(slot_engine.working_intervals(schedules, day), busy)
+            result.append({
+                'date': day.isoformat(),
+                'slots': [
+                    {'time': start.strftime('%H:%M'), 'available': available}
+                    for start, available in slots
+                ],
+                'free_intervals': [
+                    {'start': start.strftime('%H:%M'), 'end': end.strftime('%H:%M')}
+                    for start, end in free
+                ]
+            })
+        
+        return jsonify({'doctor_id': doctor_id, 'days': result}), 200
         
     except Exception as e:
         return jsonify({'message': 'Failed to fetch available slots', 'error': str(e)}), 500
 
-# File Upload Route
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
+@app.route('/api/appointments/first-available', methods=['GET'])
+def get_first_available_slots():
+    """Earliest free slots across every available doctor in a specialty"""
     try:
-        if 'file' not in request.files:
-            return jsonify({'message': 'No file provided'}), 400
-        
-        file = request.files['file']
-        file_type = request.form.get('type', 'document')
+        specialty = (request.args.get('specialty') or '').strip()
+        consultation_type = request.args.get('consultation_type', 'video')
+        
+        if not specialty:
+            return jsonify({'message': 'specialty is required'}), 400
+        if consultation_type not in CONSULTATION_TYPES:
+            return jsonify({'message': f'consultation_type must be one of {", ".join(CONSULTATION_TYPES)}'}), 400
+        
+        args = request.args.to_dict()
+        args.setdefault('start_date', datetime.now().date().isoformat())
+        try:
+            first_day, last_day, slot_minutes = parse_slot_range(args)
+            limit = int(request.args.get('limit', 10))
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        if not 1 <= limit <= 50:
+            return jsonify({'message': 'limit must be between 1 and 50'}), 400
+        
+        doctors = Doctor.query.filter(
+            db.func.lower(Doctor.specialty) == specialty.lower(),
+            Doctor.is_available == True
+        ).order_by(Doctor.rating.desc(), Doctor.name).all()
+        doctors_by_id = {doctor.id: doctor for doctor in doctors}
+        
+        # Keep the rating order so equally early slots go to the better rated doctor
+        inputs = load_slot_inputs(list(doctors_by_id), first_day, last_day) if doctors else {}
+        inputs = {doctor.id: inputs[doctor.id] for doctor in doctors}
+        earliest = slot_engine.earliest_free_slots(
+            first_day, last_day, inputs, slot_minutes, limit, not_before=datetime.now()
+        )
         
-        if file.filename == '':
-            return jsonify({'message': 'No file selected'}), 400
+        return jsonify({
+            'specialty': specialty,
+            'consultation_type': consultation_type,
+            'duration': slot_minutes,
+            'slots': [{
+                'doctor_id': doctor_id,
+                'doctor_name': doctors_by_id[doctor_id].name,
+                'consultation_fee': doctors_by_id[doctor_id].consultation_fee,
+                'rating': doctors_by_id[doctor_id].rating,
+                'date': slot_start.date().isoformat(),
+                'time': slot_start.strftime('%H:%M')
+            } for slot_start, doctor_id in earliest]
+        }), 200
         
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            # Add timestamp to prevent filename conflicts
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-            filename = timestamp + filename
-            
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            
-            # Return the file URL
-            file_url = f'/uploads/{filename}'
-            
-            return jsonify({
-                'message': 'File uploaded successfully',
-                'fileUrl': file_url,
-                'filename': filename
-            }), 200
-        else:
-            return jsonify({'message': 'Invalid file type'}), 400
-            
     except Exception as e:
-        return jsonify({'message': 'Upload failed', 'error': str(e)}), 500
+        return jsonify({'message': 'Failed to search available slots', 'error': str(e)}), 500
 
-# Serve uploaded files
-@app.route('/uploads/<filename>')
-def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+# File Upload Routes (see upload_routes.py)
+def stored_upload_response(stored):
+    record_stored_file(stored)
+    thumbnails.enqueue_thumbnails(app.config['UPLOAD_FOLDER'], stored)
+    
+    # Return the file URL
+    file_url = f'/uploads/{stored.name}'
+    
+    return jsonify({
+        'message': 'File uploaded successfully',
+        'fileUrl': file_url,
+        'filename': stored.name,
+        'sha256': stored.sha256,
+        'size': stored.size,
+        'deduplicated': not stored.created
+    }), 200
+
+def record_stored_file(stored):
+    """Insert or bump the metadata row of an upload; safe against concurrent identical uploads"""
+    now = datetime.utcnow()
+    bumped = StoredFile.query.filter_by(sha256=stored.sha256, extension=stored.extension).update(
+        {'upload_count': StoredFile.upload_count + 1, 'last_uploaded_at': now},
+        synchronize_session=False
+    )
+    if not bumped:
+        try:
+            with db.session.begin_nested():
+                db.session.add(StoredFile(sha256=stored.sha256, extension=stored.extension,
+                                          size=stored.size, created_at=now, last_uploaded_at=now))
+        except IntegrityError:
+            # Someone stored the same bytes between our UPDATE and INSERT
+            StoredFile.query.filter_by(sha256=stored.sha256, extension=stored.extension).update(
+                {'upload_count': StoredFile.upload_count + 1, 'last_uploaded_at': now},
+                synchronize_session=False
+            )
+    db.session.commit()
+
+upload_session_store = upload_routes.register_upload_routes(
+    app, allowed_file, stored_upload_response, on_error=db.session.rollback
+)
 
 # Prescription Request Routes
 @app.route('/api/prescription-requests', methods=['POST'])
@@ -519,31 +932,60 @@ def create_prescription_request():
         db.session.rollback()
         return jsonify({'message': 'Failed to create prescription request', 'error': str(e)}), 500
 
+def serialize_prescription_request(req, patient):
+    return {
+        'id': req.id,
+        'patient': {
+            'id': patient.id,
+            'name': patient.name,
+            'age': patient.age,
+            'gender': patient.gender,
+            'phone': patient.phone
+        },
+        'prescriptionImageUrl': req.prescription_image_url,
+        'thumbnailUrls': thumbnails.thumbnail_urls(app.config['UPLOAD_FOLDER'], req.prescription_image_url),
+        'notes': req.notes,
+        'status': req.status,
+        'createdAt': req.created_at.isoformat(),
+        'claimedBy': req.claimed_by,
+        'claimExpiresAt': req.claim_expires_at.isoformat() if req.claim_expires_at else None
+    }
+
+def claim_is_active(req, now):
+    return req.claimed_by is not None and req.claim_expires_at is not None and req.claim_expires_at > now
+
 @app.route('/api/prescription-requests', methods=['GET'])
 def get_prescription_requests():
+    """Pending requests, oldest first; a read-only overview.
+
+    Pharmacist dashboards should take their work from
+    /api/prescription-requests/claim, so two pharmacists never pick up the
+    same request. Without `limit`/`cursor` only the oldest
+    MAX_PRESCRIPTION_LISTING requests are returned.
+    """
     try:
-        # Get all pending prescription requests with patient info
-        requests = db.session.query(PrescriptionRequest, Patient).join(
+        try:
+            page = get_page_args(request.args, (datetime.fromisoformat, str))
+        except ValueError as e:
+            return jsonify({'message': 'Invalid pagination parameters', 'error': str(e)}), 400
+        
+        # Get pending prescription requests with patient info, oldest first
+        query = db.session.query(PrescriptionRequest, Patient).join(
             Patient, PrescriptionRequest.patient_id == Patient.id
-        ).filter(PrescriptionRequest.status == 'pending').all()
+        ).filter(PrescriptionRequest.status == 'pending')
+        query = apply_keyset(query, (PrescriptionRequest.created_at, PrescriptionRequest.id), page)
+        if not page:
+            query = query.limit(MAX_PRESCRIPTION_LISTING)
+        requests = query.all()
+        if page:
+            requests, next_cursor = split_page(
+                requests, page.limit, lambda row: (row[0].created_at.isoformat(), row[0].id)
+            )
         
-        result = []
-        for req, patient in requests:
-            result.append({
-                'id': req.id,
-                'patient': {
-                    'id': patient.id,
-                    'name': patient.name,
-                    'age': patient.age,
-                    'gender': patient.gender,
-                    'phone': patient.phone
-                },
-                'prescriptionImageUrl': req.prescription_image_url,
-                'notes': req.notes,
-                'status': req.status,
-                'createdAt': req.created_at.isoformat()
-            })
+        result = [serialize_prescription_request(req, patient) for req, patient in requests]
         
+        if page:
+            return jsonify({'requests': result, 'next_cursor': next_cursor}), 200
         return jsonify(result), 200
         
     except Exception as e:
@@ -563,9 +1005,20 @@ def update_prescription_request_status(request_id):
         if not prescription_request:
             return jsonify({'message': 'Prescription request not found'}), 404
         
+        verify_jwt_in_request(optional=True)
+        claimant = get_jwt_identity()
+        now = datetime.utcnow()
+        if prescription_request.status != 'pending':
+            return jsonify({'message': f'Prescription request already {prescription_request.status}'}), 409
+        if claim_is_active(prescription_request, now) and prescription_request.claimed_by != claimant:
+            return jsonify({'message': 'Prescription request is claimed by another pharmacist'}), 409
+        
+        # Leaving 'pending' also takes the row out of the claim index
         prescription_request.status = new_status
-        prescription_request.processed_at = datetime.utcnow()
+        prescription_request.processed_at = now
         prescription_request.processed_by = processed_by
+        prescription_request.claimed_by = None
+        prescription_request.claim_expires_at = None
         
         db.session.commit()
         
@@ -575,6 +1028,100 @@ def update_prescription_request_status(request_id):
         db.session.rollback()
         return jsonify({'message': 'Failed to update prescription request status', 'error': str(e)}), 500
 
+@app.route('/api/prescription-requests/claim', methods=['POST'])
+@jwt_required()
+def claim_prescription_requests():
+    """Claim up to `count` pending requests for PRESCRIPTION_CLAIM_LEASE_SECONDS.
+
+    Claims the caller already holds are returned (and renewed) first, so
+    refreshing a dashboard does not grab more work. Rows other pharmacists
+    are claiming right now are skipped rather than waited on.
+    """
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or {}
+        try:
+            count = int(data.get('count', 1))
+        except (TypeError, ValueError):
+            return jsonify({'message': 'count must be an integer'}), 400
+        if not 1 <= count <= MAX_PRESCRIPTION_CLAIMS:
+            return jsonify({'message': f'count must be between 1 and {MAX_PRESCRIPTION_CLAIMS}'}), 400
+        
+        user = User.query.get(user_id)
+        if not user or user.user_type != 'pharmacist':
+            return jsonify({'message': 'Only pharmacists can claim prescription requests'}), 403
+        
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=PRESCRIPTION_CLAIM_LEASE_SECONDS)
+        
+        held = PrescriptionRequest.query.filter(
+            PrescriptionRequest.status == 'pending',
+            PrescriptionRequest.claimed_by == user_id,
+            PrescriptionRequest.claim_expires_at > now
+        ).order_by(PrescriptionRequest.created_at, PrescriptionRequest.id).limit(count).all()
+        claimed_ids = [req.id for req in held]
+        for req in held:
+            req.claim_expires_at = expires_at
+        
+        lost = []
+        while len(claimed_ids) < count:
+            # FOR UPDATE SKIP LOCKED on PostgreSQL; other databases ignore it and rely on the
+            # conditional UPDATE below, which only one of several racing claimants can win
+            candidates = db.session.query(PrescriptionRequest.id).filter(
+                PrescriptionRequest.status == 'pending',
+                db.or_(PrescriptionRequest.claimed_by.is_(None), PrescriptionRequest.claim_expires_at <= now),
+                PrescriptionRequest.id.notin_(lost)
+            ).order_by(
+                PrescriptionRequest.created_at, PrescriptionRequest.id
+            ).limit(count - len(claimed_ids)).with_for_update(skip_locked=True).all()
+            if not candidates:
+                break
+            for (request_id,) in candidates:
+                won = PrescriptionRequest.query.filter(
+                    PrescriptionRequest.id == request_id,
+                    PrescriptionRequest.status == 'pending',
+                    db.or_(PrescriptionRequest.claimed_by.is_(None), PrescriptionRequest.claim_expires_at <= now)
+                ).update({'claimed_by': user_id, 'claim_expires_at': expires_at}, synchronize_session=False)
+                if won:
+                    claimed_ids.append(request_id)
+                else:
+                    lost.append(request_id)
+        db.session.commit()
+        
+        rows = db.session.query(PrescriptionRequest, Patient).join(
+            Patient, PrescriptionRequest.patient_id == Patient.id
+        ).filter(PrescriptionRequest.id.in_(claimed_ids)).order_by(
+            PrescriptionRequest.created_at, PrescriptionRequest.id
+        ).all() if claimed_ids else []
+        
+        return jsonify({
+            'requests': [serialize_prescription_request(req, patient) for req, patient in rows],
+            'lease_seconds': PRESCRIPTION_CLAIM_LEASE_SECONDS
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Failed to claim prescription requests', 'error': str(e)}), 500
+
+@app.route('/api/prescription-requests/<request_id>/release', methods=['POST'])
+@jwt_required()
+def release_prescription_request(request_id):
+    """Give a claimed request back to the queue before its lease runs out"""
+    try:
+        user_id = get_jwt_identity()
+        released = PrescriptionRequest.query.filter_by(
+            id=request_id, claimed_by=user_id, status='pending'
+        ).update({'claimed_by': None, 'claim_expires_at': None}, synchronize_session=False)
+        db.session.commit()
+        
+        if not released:
+            return jsonify({'message': 'No claim on this prescription request'}), 404
+        return jsonify({'message': 'Prescription request released'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Failed to release prescription request', 'error': str(e)}), 500
+
 # Sample data creation function
 def create_sample_data():
     """Create sample data for demonstration"""
@@ -680,8 +1227,52 @@ def create_sample_data():
         db.session.rollback()
         print(f"Error creating sample data: {e}")
 
+def add_missing_columns(connection, table, columns):
+    """ALTER TABLE `table` ADD COLUMN for each of `columns` it does not have yet"""
+    existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    for column in columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+
+def migrate_db():
+    """Bring tables made by an older create_all(), which never alters them, up to date"""
+    with db.engine.begin() as connection:
+        table = PrescriptionRequest.__table__
+        add_missing_columns(connection, table, (table.c.claimed_by, table.c.claim_expires_at))
+    indexes = [index for model in (PrescriptionRequest, Appointment) for index in model.__table__.indexes]
+    for index in indexes:
+        try:
+            with db.engine.begin() as connection:
+                index.create(connection, checkfirst=True)
+        except Exception as e:
+            # e.g. existing double bookings block the unique index; the booking checks still apply
+            print(f"Create index {index.name} error: {e}")
+
+def init_db():
+    """Create and migrate the tables and, on SQLite, the medicine search index"""
+    db.create_all()
+    migrate_db()
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.begin() as connection:
+            medicine_search.ensure_sqlite_fts(connection)
+
+db_init_lock = threading.Lock()
+db_initialised = False
+
+@app.before_request
+def ensure_db_initialised():
+    """Run init_db() once per process, so servers importing `app` (gunicorn app:app) get it too"""
+    global db_initialised
+    if db_initialised:
+        return
+    with db_init_lock:
+        if not db_initialised:
+            init_db()
+            db_initialised = True
+
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        init_db()
         create_sample_data()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
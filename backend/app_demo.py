@@ -1,13 +1,18 @@
-from flask import Flask, request, jsonify, send_from_directory, url_for
+from flask import Flask, request, jsonify, url_for
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from werkzeug.utils import secure_filename
 import bcrypt
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 import json
 import uuid
+import atexit
+from pagination import get_page_args, encode_cursor
+from prescription_request_store import PrescriptionRequestStore, SnapshotWriter
+import upload_store
+import upload_routes
+import thumbnails
 
 # Load environment variables
 load_dotenv()
@@ -20,12 +25,17 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-string')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
+# '' serves uploads from Python, 'x-sendfile' or 'x-accel-redirect' hands them to the web server
+app.config['UPLOAD_SEND_MODE'] = upload_store.check_send_mode(os.getenv('UPLOAD_SEND_MODE', ''))
+app.config['UPLOAD_ACCEL_PREFIX'] = os.getenv('UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+app.config['UPLOAD_MAX_AGE'] = int(os.getenv('UPLOAD_MAX_AGE', '3600'))
+app.config['USE_X_SENDFILE'] = app.config['UPLOAD_SEND_MODE'] == 'x-sendfile'
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', '16777216'))
 
 # Initialize extensions
 cors = CORS(app, 
     origins=['http://localhost:3000', 'http://localhost:3001', 'http://localhost:3002', 'http://localhost:3003'],
-    allow_headers=['Content-Type', 'Authorization'],
+    allow_headers=['Content-Type', 'Authorization', 'Upload-Offset'],
     methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS']
 )
 jwt = JWTManager(app)
@@ -39,14 +49,34 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # In-memory storage for prescription requests (in a real app, this would be in a database)
-PRESCRIPTION_REQUESTS = []
+PRESCRIPTION_REQUESTS = PrescriptionRequestStore()
+PRESCRIPTION_REQUEST_STATUSES = ('pending', 'approved', 'rejected')
+
+# Optional: keep requests across restarts by snapshotting them to a JSON file
+# (single worker only; a second process fails to start with SnapshotLocked)
+PRESCRIPTION_REQUESTS_SNAPSHOT = os.getenv('PRESCRIPTION_REQUESTS_SNAPSHOT')
+if PRESCRIPTION_REQUESTS_SNAPSHOT:
+    _snapshot_writer = SnapshotWriter(
+        PRESCRIPTION_REQUESTS, PRESCRIPTION_REQUESTS_SNAPSHOT,
+        interval=float(os.getenv('PRESCRIPTION_REQUESTS_SNAPSHOT_SECONDS', '10'))
+    )
+    _snapshot_writer.load()
+    _snapshot_writer.start()
+    atexit.register(_snapshot_writer.save_if_changed)
+
+# Precomputed bcrypt hashes (cost 12) of the demo passwords, the same ones
+# update_passwords.sql installs. Hashing them here at import cost about half
+# a second each on every worker boot.
+DEMO_PATIENT_HASH = '$2b$12$9ybnBYQ3Srux2FTd9jSyl.1zbCn7YrefU64Atp4PCk8XemozaOhK2'      # patient123
+DEMO_DOCTOR_HASH = '$2b$12$6TJxdw7VyTFb4sdx19Ju5.jrS/ml0Yzg3EJDODjE9Tir0B6LXeMSi'       # doctor123
+DEMO_PHARMACIST_HASH = '$2b$12$mDNDxV29HFI7481OKsWBWuq.oxS5.LPBb6XGy4jW29iM06tqYpKu.'   # pharmacy123
 
 # Demo users data (for testing without database)
 DEMO_USERS = {
     'p001': {
         'id': 1,
         'username': 'p001',
-        'password_hash': bcrypt.hashpw('patient123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+        'password_hash': DEMO_PATIENT_HASH,
         'role': 'patient',
         'profile': {
             'first_name': 'John',
@@ -59,7 +89,7 @@ DEMO_USERS = {
     'p002': {
         'id': 2,
         'username': 'p002',
-        'password_hash': bcrypt.hashpw('patient123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+        'password_hash': DEMO_PATIENT_HASH,
         'role': 'patient',
         'profile': {
             'first_name': 'Sarah',
@@ -72,7 +102,7 @@ DEMO_USERS = {
     'd001': {
         'id': 3,
         'username': 'd001',
-        'password_hash': bcrypt.hashpw('doctor123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+        'password_hash': DEMO_DOCTOR_HASH,
         'role': 'doctor',
         'profile': {
             'first_name': 'Dr. Rajesh',
@@ -85,7 +115,7 @@ DEMO_USERS = {
     'd002': {
         'id': 4,
         'username': 'd002',
-        'password_hash': bcrypt.hashpw('doctor123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+        'password_hash': DEMO_DOCTOR_HASH,
         'role': 'doctor',
         'profile': {
             'first_name': 'Dr. Priya',
@@ -98,7 +128,7 @@ DEMO_USERS = {
     'pm001': {
         'id': 5,
         'username': 'pm001',
-        'password_hash': bcrypt.hashpw('pharmacy123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+        'password_hash': DEMO_PHARMACIST_HASH,
         'role': 'pharmacist',
         'profile': {
             'pharmacy_name': 'MedPlus Pharmacy',
@@ -110,7 +140,7 @@ DEMO_USERS = {
     'pm002': {
         'id': 6,
         'username': 'pm002',
-        'password_hash': bcrypt.hashpw('pharmacy123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+        'password_hash': DEMO_PHARMACIST_HASH,
         'role': 'pharmacist',
         'profile': {
             'pharmacy_name': 'Apollo Pharmacy',
@@ -121,6 +151,81 @@ DEMO_USERS = {
     }
 }
 
+# Secondary indexes over DEMO_USERS; add users through index_demo_user() to keep them in step
+DEMO_USERS_BY_ID = {}    # str(id) -> user
+DEMO_USERS_BY_ROLE = {}  # role -> {username: user}
+
+SYNTHETIC_FIRST_NAMES = ['Aarav', 'Diya', 'Vihaan', 'Ananya', 'Arjun', 'Isha', 'Kabir', 'Meera', 'Rohan', 'Sneha']
+SYNTHETIC_LAST_NAMES = ['Sharma', 'Patel', 'Reddy', 'Iyer', 'Singh', 'Nair', 'Gupta', 'Das', 'Khan', 'Menon']
+SYNTHETIC_SPECIALIZATIONS = ['Cardiology', 'Pediatrics', 'Dermatology', 'Orthopedics', 'General Medicine']
+
+def index_demo_user(user):
+    """Add or replace a demo user in DEMO_USERS and its id and role indexes.
+
+    Raises ValueError if another username already has the user's id.
+    """
+    owner = DEMO_USERS_BY_ID.get(str(user['id']))
+    if owner and owner['username'] != user['username']:
+        raise ValueError(f"Demo user id {user['id']} already belongs to {owner['username']}")
+    previous = DEMO_USERS.get(user['username'])
+    if previous:
+        DEMO_USERS_BY_ID.pop(str(previous['id']), None)
+        same_role = DEMO_USERS_BY_ROLE.get(previous['role'], {})
+        same_role.pop(previous['username'], None)
+        if not same_role:
+            DEMO_USERS_BY_ROLE.pop(previous['role'], None)
+    DEMO_USERS[user['username']] = user
+    DEMO_USERS_BY_ID[str(user['id'])] = user
+    DEMO_USERS_BY_ROLE.setdefault(user['role'], {})[user['username']] = user
+
+def find_demo_user(user_id, role=None):
+    """User with this JWT id (and role, if given), or None"""
+    user = DEMO_USERS_BY_ID.get(str(user_id))
+    if user and role and user['role'] != role:
+        return None
+    return user
+
+def synthetic_demo_user(n):
+    """Deterministic synthetic user number n: patients, doctors and pharmacists in turn.
+
+    Passwords are the same as the built-in demo users of the same role.
+    """
+    role = ('patient', 'doctor', 'pharmacist')[n % 3]
+    first = SYNTHETIC_FIRST_NAMES[n % len(SYNTHETIC_FIRST_NAMES)]
+    last = SYNTHETIC_LAST_NAMES[(n // len(SYNTHETIC_FIRST_NAMES)) % len(SYNTHETIC_LAST_NAMES)]
+    if role == 'patient':
+        username = f'sp{n:06d}'
+        password_hash = DEMO_PATIENT_HASH
+        profile = {'first_name': first, 'last_name': last, 'patient_id': username,
+                   'phone': f'9{n:09d}', 'email': f'{username}@demo.helio'}
+    elif role == 'doctor':
+        username = f'sd{n:06d}'
+        password_hash = DEMO_DOCTOR_HASH
+        profile = {'first_name': f'Dr. {first}', 'last_name': last, 'doctor_id': username,
+                   'specialization': SYNTHETIC_SPECIALIZATIONS[n % len(SYNTHETIC_SPECIALIZATIONS)],
+                   'clinic_name': f'{last} Clinic'}
+    else:
+        username = f'spm{n:06d}'
+        password_hash = DEMO_PHARMACIST_HASH
+        profile = {'pharmacy_name': f'{last} Pharmacy', 'owner_name': f'{first} {last}',
+                   'pharmacy_id': username, 'phone': f'8{n:09d}'}
+    return {
+        'id': 1000 + n,
+        'username': username,
+        'password_hash': password_hash,
+        'role': role,
+        'profile': profile
+    }
+
+def add_synthetic_demo_users(count):
+    """Register `count` synthetic users for load tests (DEMO_SYNTHETIC_USERS at startup)"""
+    for n in range(count):
+        index_demo_user(synthetic_demo_user(n))
+
+for _demo_user in list(DEMO_USERS.values()):
+    index_demo_user(_demo_user)
+add_synthetic_demo_users(int(os.getenv('DEMO_SYNTHETIC_USERS', '0')))
+
 # Helper functions
 def check_password(password, hashed):
     """Check if password matches the hash"""
@@ -190,16 +295,15 @@ def get_current_user():
     try:
         user_id = get_jwt_identity()
         
-        # Find user by ID
-        for username, user_data in DEMO_USERS.items():
-            if user_data['id'] == user_id:
-                return jsonify({
-                    'user': {
-                        'id': user_data['id'],
-                        'username': user_data['username'],
-                        'role': user_data['role']
-                    }
-                }), 200
+        user_data = find_demo_user(user_id)
+        if user_data:
+            return jsonify({
+                'user': {
+                    'id': user_data['id'],
+                    'username': user_data['username'],
+                    'role': user_data['role']
+                }
+            }), 200
         
         return jsonify({'message': 'User not found'}), 404
         
@@ -215,10 +319,9 @@ def get_patient_profile():
     try:
         user_id = get_jwt_identity()
         
-        # Find user by ID
-        for username, user_data in DEMO_USERS.items():
-            if user_data['id'] == user_id and user_data['role'] == 'patient':
-                return jsonify({'patient': user_data['profile']}), 200
+        user_data = find_demo_user(user_id, 'patient')
+        if user_data:
+            return jsonify({'patient': user_data['profile']}), 200
         
         return jsonify({'message': 'Patient profile not found'}), 404
         
@@ -271,12 +374,8 @@ def get_appointments():
     try:
         user_id = get_jwt_identity()
         
-        # Find user role
-        user_role = None
-        for username, user_data in DEMO_USERS.items():
-            if user_data['id'] == user_id:
-                user_role = user_data['role']
-                break
+        user = find_demo_user(user_id)
+        user_role = user['role'] if user else None
         
         # Return demo appointments based on role
         if user_role == 'patient':
@@ -340,10 +439,9 @@ def get_doctor_profile():
     try:
         user_id = get_jwt_identity()
         
-        # Find user by ID
-        for username, user_data in DEMO_USERS.items():
-            if user_data['id'] == user_id and user_data['role'] == 'doctor':
-                return jsonify({'doctor': user_data['profile']}), 200
+        user_data = find_demo_user(user_id, 'doctor')
+        if user_data:
+            return jsonify({'doctor': user_data['profile']}), 200
         
         return jsonify({'message': 'Doctor profile not found'}), 404
         
@@ -358,10 +456,9 @@ def get_pharmacy_profile():
     try:
         user_id = get_jwt_identity()
         
-        # Find user by ID
-        for username, user_data in DEMO_USERS.items():
-            if user_data['id'] == user_id and user_data['role'] == 'pharmacist':
-                return jsonify({'pharmacy': user_data['profile']}), 200
+        user_data = find_demo_user(user_id, 'pharmacist')
+        if user_data:
+            return jsonify({'pharmacy': user_data['profile']}), 200
         
         return jsonify({'message': 'Pharmacy profile not found'}), 404
         
@@ -369,53 +466,28 @@ def get_pharmacy_profile():
         print(f"Get pharmacy profile error: {e}")
         return jsonify({'message': 'Internal server error'}), 500
 
-# File Upload Route
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
-    """Upload prescription image files"""
+# File Upload Routes (see upload_routes.py)
+def stored_upload_response(stored):
+    """Upload response for a file now in content-addressed storage"""
+    thumbnails.enqueue_thumbnails(app.config['UPLOAD_FOLDER'], stored)
+    
+    # Return the absolute file URL (ensures frontend can load image regardless of origin)
     try:
-        if 'file' not in request.files:
-            return jsonify({'message': 'No file provided'}), 400
-        
-        file = request.files['file']
-        file_type = request.form.get('type', 'document')
-        
-        if file.filename == '':
-            return jsonify({'message': 'No file selected'}), 400
-        
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            # Add timestamp to prevent filename conflicts
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-            filename = timestamp + filename
-            
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            
-            # Return the absolute file URL (ensures frontend can load image regardless of origin)
-            try:
-                file_url = url_for('uploaded_file', filename=filename, _external=True)
-            except Exception:
-                # Fallback to relative path if building absolute URL fails
-                file_url = f'/uploads/{filename}'
-            
-            return jsonify({
-                'message': 'File uploaded successfully',
-                'fileUrl': file_url,
-                'filename': filename
-            }), 200
-        else:
-            return jsonify({'message': 'Invalid file type'}), 400
-            
-    except Exception as e:
-        print(f"Upload error: {e}")
-        return jsonify({'message': 'Upload failed', 'error': str(e)}), 500
+        file_url = url_for('uploaded_file', filename=stored.name, _external=True)
+    except Exception:
+        # Fallback to relative path if building absolute URL fails
+        file_url = f'/uploads/{stored.name}'
+    
+    return jsonify({
+        'message': 'File uploaded successfully',
+        'fileUrl': file_url,
+        'filename': stored.name,
+        'sha256': stored.sha256,
+        'size': stored.size,
+        'deduplicated': not stored.created
+    }), 200
 
-# Serve uploaded files
-@app.route('/uploads/<filename>')
-def uploaded_file(filename):
-    """Serve uploaded files"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+upload_session_store = upload_routes.register_upload_routes(app, allowed_file, stored_upload_response)
 
 # Prescription Request Routes
 @app.route('/api/prescription-requests', methods=['POST'])
@@ -426,12 +498,7 @@ def create_prescription_request():
         data = request.get_json()
         user_id = get_jwt_identity()
         
-        # Find user
-        user = None
-        for username, user_data in DEMO_USERS.items():
-            if user_data['id'] == user_id:
-                user = user_data
-                break
+        user = find_demo_user(user_id)
         
         if not user or user['role'] != 'patient':
             return jsonify({'message': 'Only patients can create prescription requests'}), 403
@@ -449,7 +516,7 @@ def create_prescription_request():
             'processedBy': None
         }
         
-        PRESCRIPTION_REQUESTS.append(prescription_request)
+        PRESCRIPTION_REQUESTS.add(prescription_request)
         
         return jsonify({
             'message': 'Prescription request created successfully',
@@ -460,14 +527,39 @@ def create_prescription_request():
         print(f"Create prescription request error: {e}")
         return jsonify({'message': 'Failed to create prescription request', 'error': str(e)}), 500
 
+def with_thumbnail_urls(prescription_requests):
+    """Add thumbnailUrls to listed requests (they are copies, so the store is untouched)"""
+    for prescription_request in prescription_requests:
+        prescription_request['thumbnailUrls'] = thumbnails.thumbnail_urls(
+            app.config['UPLOAD_FOLDER'], prescription_request.get('prescriptionImageUrl')
+        )
+    return prescription_requests
+
 @app.route('/api/prescription-requests', methods=['GET'])
 def get_prescription_requests():
-    """Get all prescription requests"""
+    """Get prescription requests, oldest first (pending only unless ?status= says otherwise)"""
     try:
-        # Filter pending requests
-        pending_requests = [req for req in PRESCRIPTION_REQUESTS if req['status'] == 'pending']
-        
-        return jsonify(pending_requests), 200
+        status = request.args.get('status', 'pending')
+        if status != 'all' and status not in PRESCRIPTION_REQUEST_STATUSES:
+            return jsonify({'message': 'Invalid status'}), 400
+        try:
+            page = get_page_args(request.args, (int,))
+        except ValueError as e:
+            return jsonify({'message': 'Invalid pagination parameters', 'error': str(e)}), 400
+        
+        status = None if status == 'all' else status
+        if not page:
+            prescription_requests, _ = PRESCRIPTION_REQUESTS.page(status)
+            return jsonify(with_thumbnail_urls(prescription_requests)), 200
+        
+        prescription_requests, last_seq = PRESCRIPTION_REQUESTS.page(
+            status, limit=page.limit, after=page.after[0] if page.after else None
+        )
+        with_thumbnail_urls(prescription_requests)
+        return jsonify({
+            'requests': prescription_requests,
+            'next_cursor': encode_cursor([last_seq]) if last_seq is not None else None
+        }), 200
         
     except Exception as e:
         print(f"Get prescription requests error: {e}")
@@ -484,14 +576,14 @@ def update_prescription_request_status(request_id):
         if new_status not in ['approved', 'rejected']:
             return jsonify({'message': 'Invalid status'}), 400
         
-        # Find and update the request
-        for req in PRESCRIPTION_REQUESTS:
-            if req['id'] == request_id:
-                req['status'] = new_status
-                req['processedAt'] = datetime.now().isoformat()
-                req['processedBy'] = processed_by
-                
-                return jsonify({'message': 'Prescription request status updated successfully'}), 200
+        updated = PRESCRIPTION_REQUESTS.update(
+            request_id,
+            status=new_status,
+            processedAt=datetime.now().isoformat(),
+            processedBy=processed_by
+        )
+        if updated:
+            return jsonify({'message': 'Prescription request status updated successfully'}), 200
         
         return jsonify({'message': 'Prescription request not found'}), 404
         
@@ -503,7 +595,11 @@ def update_prescription_request_status(request_id):
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'database': 'demo_mode'}), 200
+    return jsonify({
+        'status': 'healthy',
+        'database': 'demo_mode',
+        'prescription_requests': {status: PRESCRIPTION_REQUESTS.count(status) for status in PRESCRIPTION_REQUEST_STATUSES}
+    }), 200
 
 # Error handlers
 @app.errorhandler(404)
@@ -521,4 +617,5 @@ if __name__ == '__main__':
     print("Doctors: d001, d002 (password: doctor123)")
     print("Pharmacists: pm001, pm002 (password: pharmacy123)")
     print("🔧 Note: Running in demo mode without database")
+    print("👥 Users: " + ", ".join(f"{len(users)} {role}s" for role, users in DEMO_USERS_BY_ROLE.items()))
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -1,14 +1,29 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, g, has_app_context, Response
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.errors
+from psycopg2.extras import RealDictCursor, execute_values
 import bcrypt
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 import uuid
 import json
+import threading
+import time
+from db_pool import ConnectionPool, PoolTimeout
+from auth_offload import BoundedExecutor, ExecutorSaturated, LastLoginBatcher
+from pagination import get_page_args, split_page
+from medicine_suggest import MedicineSuggestIndex
+from response_cache import ResponseCache, version_from_env
+from notification_stream import (NotificationBroker, PgNotificationListener, StreamLimitReached,
+                                 stream_events, NOTIFY_CHANNEL, CHAT_CHANNEL, STOCK_CHANNEL)
+from stock_index import StockIndex
+from pincode_geo import DEFAULT_PINCODE_FILE, PincodeLocator, parse_coordinates
+from expiry_report import EXPIRY_WINDOWS, ExpiryReportRefresher, summarize
+from reservations import InsufficientStock, ReservationSweeper, allocate_fefo
+from rare_matcher import FANOUT_LIMIT, pincode_from_address, rank_offers, select_candidates
 
 # Load environment variables
 load_dotenv()
@@ -32,6 +47,34 @@ DB_CONFIG = {
     'port': os.getenv('DB_PORT', '5432')
 }
 
+# Connection pool shared by all request threads in this worker
+db_pool = ConnectionPool(
+    minconn=int(os.getenv('DB_POOL_MIN', '1')),
+    maxconn=int(os.getenv('DB_POOL_MAX', '10')),
+    timeout=float(os.getenv('DB_POOL_TIMEOUT', '5')),
+    check_interval=float(os.getenv('DB_POOL_CHECK_INTERVAL', '30')),
+    **DB_CONFIG
+)
+
+def prewarm_db_pool():
+    """Open DB_POOL_MIN connections so the worker's first requests don't pay for the handshakes"""
+    try:
+        db_pool.prewarm()
+    except (psycopg2.Error, PoolTimeout) as e:
+        print(f"Database pool prewarm error: {e}")
+
+# gunicorn imports the app once per worker, so this runs at worker startup; in the
+# background, so a slow or unreachable database doesn't hold up booting
+threading.Thread(target=prewarm_db_pool, name='db-pool-prewarm', daemon=True).start()
+
+# Doctor directory responses; update_doctor_availability() invalidates them
+doctor_cache = ResponseCache(
+    'doctors',
+    maxsize=int(os.getenv('DOCTOR_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('DOCTOR_CACHE_TTL_SECONDS', '60')),
+    version=version_from_env('doctors')
+)
+
 # Initialize extensions
 cors = CORS(app, 
     origins=['http://localhost:3000', 'http://localhost:3001', 'http://localhost:3002', 'http://localhost:3003'],
@@ -45,13 +88,356 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # Database connection helper
 def get_db_connection():
-    """Create and return a database connection"""
+    """Borrow a pooled database connection; conn.close() returns it to the pool"""
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
-    except psycopg2.Error as e:
+        conn = db_pool.borrow()
+    except (psycopg2.Error, PoolTimeout) as e:
         print(f"Database connection error: {e}")
         return None
+    if has_app_context():
+        g.setdefault('db_connections', []).append(conn)
+    return conn
+
+@app.teardown_appcontext
+def release_db_connections(error):
+    """Return any connection a route did not close (early returns, exceptions)"""
+    for conn in g.pop('db_connections', []):
+        conn.close()
+
+# Medicine autocomplete index, served from memory and refreshed in the background
+medicine_suggestions = MedicineSuggestIndex()
+MEDICINE_SUGGEST_REFRESH_SECONDS = float(os.getenv('MEDICINE_SUGGEST_REFRESH_SECONDS', '30'))
+MEDICINE_SUGGEST_REBUILD_SECONDS = float(os.getenv('MEDICINE_SUGGEST_REBUILD_SECONDS', '3600'))
+_suggest_refresher = None
+_suggest_refresher_lock = threading.Lock()
+
+MEDICINE_SUGGEST_SQL = """
+    SELECT m.id, m.medicine_name, m.generic_name, m.brand_name, m.updated_at,
+           (SELECT COUNT(*) FROM prescription_items_table pi WHERE pi.medicine_id = m.id) AS popularity
+    FROM medicines_table m
+"""
+
+def load_medicine_suggestions(since=None):
+    """Load every medicine into the suggestion index, or only those changed since `since`"""
+    with db_pool.connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        if since is None:
+            cursor.execute(MEDICINE_SUGGEST_SQL)
+            medicine_suggestions.load(cursor.fetchall())
+        else:
+            # >= rather than > so rows committed within the same timestamp are not missed
+            cursor.execute(MEDICINE_SUGGEST_SQL + " WHERE m.updated_at >= %s", (since,))
+            for row in cursor.fetchall():
+                medicine_suggestions.upsert(row)
+
+def refresh_medicine_suggestions_forever():
+    """Keep the suggestion index close to medicines_table.
+
+    New and edited medicines (by updated_at) show up within
+    MEDICINE_SUGGEST_REFRESH_SECONDS. Popularity, counted from prescription
+    items, and deleted medicines only change at the full rebuild every
+    MEDICINE_SUGGEST_REBUILD_SECONDS (an hour by default).
+    """
+    last_rebuild = time.monotonic()
+    while True:
+        time.sleep(MEDICINE_SUGGEST_REFRESH_SECONDS)
+        try:
+            since = medicine_suggestions.last_updated_at
+            if since is None or time.monotonic() - last_rebuild >= MEDICINE_SUGGEST_REBUILD_SECONDS:
+                load_medicine_suggestions()
+                last_rebuild = time.monotonic()
+            else:
+                load_medicine_suggestions(since)
+        except Exception as e:
+            print(f"Medicine suggestion refresh error: {e}")
+
+def ensure_medicine_suggestions():
+    """Load the index on first use and start its refresher (once per worker process)"""
+    global _suggest_refresher
+    if _suggest_refresher is not None:
+        return
+    with _suggest_refresher_lock:
+        if _suggest_refresher is None:
+            load_medicine_suggestions()
+            refresher = threading.Thread(
+                target=refresh_medicine_suggestions_forever, name='medicine-suggest-refresh', daemon=True
+            )
+            refresher.start()
+            _suggest_refresher = refresher
+
+# Notification and chat streams: one broker each per worker, woken by PostgreSQL NOTIFY
+notification_broker = NotificationBroker(max_streams=int(os.getenv('SSE_MAX_STREAMS', '500')))
+chat_broker = NotificationBroker(max_streams=int(os.getenv('CHAT_MAX_STREAMS', '2000')))
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_MAX_STREAM_SECONDS = float(os.getenv('SSE_MAX_STREAM_SECONDS', '3600'))
+_notification_listener = None
+_notification_listener_lock = threading.Lock()
+
+def load_stock_index():
+    """Pharmacies and their in-stock medicines, for the in-memory availability index"""
+    with db_pool.connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            SELECT id, pharmacy_id AS pharmacy_code, pharmacy_name, address, pincode, city, state,
+                   phone, delivery_available
+            FROM pharmacies_table
+        """)
+        pharmacies = cursor.fetchall()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT pharmacy_id, medicine_id, quantity_available FROM pharmacy_availability_table "
+            "WHERE quantity_available > 0"
+        )
+        availability = cursor.fetchall()
+        conn.rollback()
+        return pharmacies, availability
+
+# PIN code -> coordinates, from the bundled table or the full India Post directory
+pincode_locator = PincodeLocator(os.getenv('PINCODE_GEO_FILE', DEFAULT_PINCODE_FILE))
+
+# Which pharmacies stock what; patched from the helio_stock channel by the notification listener
+stock_index = StockIndex(load_stock_index, max_age=float(os.getenv('STOCK_INDEX_MAX_AGE_SECONDS', '900')),
+                         locator=pincode_locator)
+
+# Medicine reservations hold stock for this long; the sweeper hands expired holds back
+RESERVATION_HOLD_HOURS = float(os.getenv('RESERVATION_HOLD_HOURS', '24'))
+MAX_RESERVATION_QUANTITY = 1000
+
+def release_reservation_stock(cursor, reservation_ids):
+    """Move the stock held by these (already locked) reservations back to quantity_available"""
+    cursor.execute("""
+        SELECT stock_id, SUM(quantity_confirmed) AS quantity
+        FROM reservation_items_table
+        WHERE reservation_id = ANY(%s) AND stock_id IS NOT NULL AND quantity_confirmed > 0
+        GROUP BY stock_id
+    """, (list(reservation_ids),))
+    held = dict(cursor.fetchall())
+    if not held:
+        return
+    # Same lock order as reserve_medicine(), so a sweep never deadlocks with a reservation
+    cursor.execute(
+        "SELECT id FROM pharmacy_stock_table WHERE id = ANY(%s) ORDER BY expiry_date, id FOR UPDATE",
+        (list(held),)
+    )
+    execute_values(cursor, """
+        UPDATE pharmacy_stock_table s
+        SET quantity_available = s.quantity_available + v.quantity,
+            quantity_reserved = GREATEST(s.quantity_reserved - v.quantity, 0)
+        FROM (VALUES %s) AS v(id, quantity)
+        WHERE s.id = v.id
+    """, [(row[0], held[row[0]]) for row in cursor.fetchall()])
+
+def sweep_expired_reservations(batch_size):
+    """Expire one batch of overdue reservations and release their stock; returns how many"""
+    with db_pool.connection() as conn:
+        try:
+            cursor = conn.cursor()
+            # SKIP LOCKED: sweepers in other workers take other rows, and a reservation being
+            # cancelled right now is left to the cancel
+            cursor.execute("""
+                UPDATE reservations_table SET status = 'expired'
+                WHERE id IN (
+                    SELECT id FROM reservations_table
+                    WHERE status IN ('pending', 'confirmed') AND expiry_datetime < NOW()
+                    ORDER BY expiry_datetime
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id
+            """, (batch_size,))
+            expired = [row[0] for row in cursor.fetchall()]
+            if expired:
+                release_reservation_stock(cursor, expired)
+            conn.commit()
+            return len(expired)
+        except Exception:
+            conn.rollback()
+            raise
+
+reservation_sweeper = ReservationSweeper(
+    sweep_expired_reservations,
+    interval=float(os.getenv('RESERVATION_SWEEP_SECONDS', '60')),
+    batch_size=int(os.getenv('RESERVATION_SWEEP_BATCH', '500'))
+)
+
+def refresh_expiry_summary(full=False):
+    """Bring stock_expiry_summary_table up to date; returns pharmacies recomputed, -1 if already running"""
+    with db_pool.connection() as conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT refresh_stock_expiry_summary(%s)", (full,))
+            refreshed = cursor.fetchone()[0]
+            conn.commit()
+            return refreshed
+        except Exception:
+            conn.rollback()
+            raise
+
+expiry_refresher = ExpiryReportRefresher(
+    refresh_expiry_summary,
+    interval=float(os.getenv('EXPIRY_REPORT_REFRESH_SECONDS', '300'))
+)
+_background_jobs_lock = threading.Lock()
+
+@app.before_request
+def ensure_background_jobs():
+    """Start the sweeper and report threads on the first request of each worker process (after any fork)"""
+    if reservation_sweeper.ident is not None and expiry_refresher.ident is not None:
+        return
+    with _background_jobs_lock:
+        for job in (reservation_sweeper, expiry_refresher):
+            if job.ident is None:
+                job.start()
+
+# Rare-medicine requests go to at most this many pharmacies each
+RARE_FANOUT_LIMIT = int(os.getenv('RARE_FANOUT_LIMIT', str(FANOUT_LIMIT)))
+RARE_URGENCY_LEVELS = ('low', 'normal', 'high', 'critical')
+RARE_RESPONSE_STATUSES = ('interested', 'can_source', 'declined')
+
+NOTIFICATION_COLUMNS = """
+    id, title, message, notification_type, is_read, priority, action_url, metadata, created_at, read_at
+"""
+
+def ensure_notification_listener():
+    """Start the LISTEN thread on first use (once per worker process)"""
+    global _notification_listener
+    if _notification_listener is not None:
+        return
+    with _notification_listener_lock:
+        if _notification_listener is None:
+            listener = PgNotificationListener(DB_CONFIG, {
+                NOTIFY_CHANNEL: (notification_broker, 'user_id'),
+                CHAT_CHANNEL: (chat_broker, 'appointment_id'),
+                STOCK_CHANNEL: (stock_index, None)
+            })
+            listener.start()
+            _notification_listener = listener
+
+def fetch_notifications_after(user_id, after_id, limit=100):
+    """The user's notifications with id > after_id, oldest first"""
+    with db_pool.connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(
+            f"SELECT {NOTIFICATION_COLUMNS} FROM notifications_table "
+            "WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s",
+            (user_id, after_id, limit)
+        )
+        rows = cursor.fetchall()
+        conn.rollback()
+        return rows
+
+def latest_notification_id(user_id):
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM notifications_table WHERE user_id = %s", (user_id,))
+        latest = cursor.fetchone()[0]
+        conn.rollback()
+        return latest
+
+CHAT_COLUMNS = """
+    id, message_id, appointment_id, sender_id, sender_role, message_type, message_content,
+    file_url, file_name, file_size, is_prescription_item, prescription_data, is_read,
+    reply_to_message_id, created_at
+"""
+
+def fetch_chat_after(appointment_id, after_id, limit=100):
+    """Messages of one appointment with id > after_id, oldest first"""
+    with db_pool.connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(
+            f"SELECT {CHAT_COLUMNS} FROM chat_messages_table "
+            "WHERE appointment_id = %s AND id > %s ORDER BY id LIMIT %s",
+            (appointment_id, after_id, limit)
+        )
+        rows = cursor.fetchall()
+        conn.rollback()
+        return rows
+
+def chat_role(cursor, appointment_id, user_id):
+    """'patient' or 'doctor' if the user takes part in the appointment, else None"""
+    cursor.execute(
+        """
+        SELECT CASE WHEN p.login_id = %s THEN 'patient' ELSE 'doctor' END AS role
+        FROM appointments_table a
+        JOIN patients_table p ON p.id = a.patient_id
+        JOIN doctors_table d ON d.id = a.doctor_id
+        WHERE a.id = %s AND (p.login_id = %s OR d.login_id = %s)
+        """,
+        (user_id, appointment_id, user_id, user_id)
+    )
+    row = cursor.fetchone()
+    return row['role'] if row else None
+
+def open_event_stream(broker, key, fetch_after, event, latest_id):
+    """SSE response for `key`, resuming after Last-Event-ID or starting at latest_id()"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'message': 'Invalid Last-Event-ID'}), 400
+    
+    try:
+        subscription = broker.subscribe(key)
+    except StreamLimitReached:
+        response = jsonify({'message': 'Too many open streams, retry shortly'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    try:
+        ensure_notification_listener()
+        if last_id is None:
+            last_id = latest_id()
+    except (psycopg2.Error, PoolTimeout) as e:
+        subscription.close()
+        print(f"Event stream error: {e}")
+        return jsonify({'message': 'Database connection error'}), 500
+    
+    return Response(
+        stream_events(subscription, fetch_after, last_id, SSE_HEARTBEAT_SECONDS, SSE_MAX_STREAM_SECONDS, event),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Login: bcrypt runs in a bounded pool, last_login is written in batches
+LOGIN_BCRYPT_WORKERS = int(os.getenv('LOGIN_BCRYPT_WORKERS', str(os.cpu_count() or 2)))
+bcrypt_executor = BoundedExecutor(
+    max_workers=LOGIN_BCRYPT_WORKERS,
+    max_pending=int(os.getenv('LOGIN_BCRYPT_QUEUE', str(LOGIN_BCRYPT_WORKERS * 4))),
+    name='bcrypt'
+)
+
+def write_last_logins(batch):
+    """One UPDATE for every login since the last flush"""
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        execute_values(
+            cursor,
+            "UPDATE login_table AS l SET last_login = v.last_login "
+            "FROM (VALUES %s) AS v(id, last_login) WHERE l.id = v.id",
+            batch
+        )
+        conn.commit()
+
+last_logins = LastLoginBatcher(
+    write_last_logins,
+    interval=float(os.getenv('LAST_LOGIN_FLUSH_SECONDS', '5')),
+    max_batch=int(os.getenv('LAST_LOGIN_MAX_BATCH', '500'))
+)
+
+# Credentials and the role's profile row in one round trip
+LOGIN_SQL = """
+    SELECT l.id, l.username, l.password_hash, l.role, l.is_active,
+           CASE l.role
+               WHEN 'patient' THEN row_to_json(p)
+               WHEN 'doctor' THEN row_to_json(d)
+               WHEN 'pharmacist' THEN row_to_json(ph)
+           END AS profile
+    FROM login_table l
+    LEFT JOIN patients_table p ON l.role = 'patient' AND p.login_id = l.id
+    LEFT JOIN doctors_table d ON l.role = 'doctor' AND d.login_id = l.id
+    LEFT JOIN pharmacies_table ph ON l.role = 'pharmacist' AND ph.login_id = l.id
+    WHERE l.username = %s
+"""
 
 # Helper functions
 def hash_password(password):
@@ -83,55 +469,25 @@ def login():
             return jsonify({'message': 'Database connection error'}), 500
         
         cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Get user credentials
-        cursor.execute(
-            "SELECT id, username, password_hash, role, is_active FROM login_table WHERE username = %s",
-            (username,)
-        )
+        cursor.execute(LOGIN_SQL, (username,))
         user = cursor.fetchone()
+        # Hand the connection back before the slow part
+        conn.close()
         
         if not user or not user['is_active']:
             return jsonify({'message': 'Invalid credentials'}), 401
         
-        if not check_password(password, user['password_hash']):
+        try:
+            valid = bcrypt_executor.run(check_password, password, user['password_hash'])
+        except ExecutorSaturated:
+            response = jsonify({'message': 'Too many login attempts in progress, please retry'})
+            response.headers['Retry-After'] = '1'
+            return response, 429
+        if not valid:
             return jsonify({'message': 'Invalid credentials'}), 401
         
-        # Update last login
-        cursor.execute(
-            "UPDATE login_table SET last_login = CURRENT_TIMESTAMP WHERE id = %s",
-            (user['id'],)
-        )
-        
-        # Get user profile based on role
-        profile_data = {}
-        if user['role'] == 'patient':
-            cursor.execute(
-                "SELECT * FROM patients_table WHERE login_id = %s",
-                (user['id'],)
-            )
-            profile = cursor.fetchone()
-            if profile:
-                profile_data = dict(profile)
-        elif user['role'] == 'doctor':
-            cursor.execute(
-                "SELECT * FROM doctors_table WHERE login_id = %s",
-                (user['id'],)
-            )
-            profile = cursor.fetchone()
-            if profile:
-                profile_data = dict(profile)
-        elif user['role'] == 'pharmacist':
-            cursor.execute(
-                "SELECT * FROM pharmacies_table WHERE login_id = %s",
-                (user['id'],)
-            )
-            profile = cursor.fetchone()
-            if profile:
-                profile_data = dict(profile)
-        
-        conn.commit()
-        conn.close()
+        last_logins.record(user['id'], datetime.now())
+        profile_data = user['profile'] or {}
         
         # Create JWT token
         token = create_access_token(
@@ -314,15 +670,21 @@ def create_appointment_compat():
         appt_date = dt.date().isoformat()  # YYYY-MM-DD
         appt_time = dt.time().strftime('%H:%M:%S')  # HH:MM:SS
 
-        cursor.execute(
-            """
-            INSERT INTO appointments_table 
-                (patient_id, doctor_id, appointment_date, appointment_time, symptoms, notes, status, consultation_type, duration_minutes, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, 'upcoming', %s, %s, NOW())
-            RETURNING id
-            """,
-            (patient_id, doctor_id, appt_date, appt_time, symptoms, notes, consultation_type, duration_minutes)
-        )
+        try:
+            cursor.execute(
+                """
+                INSERT INTO appointments_table 
+                    (patient_id, doctor_id, appointment_date, appointment_time, symptoms, notes, status, consultation_type, duration_minutes, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, 'upcoming', %s, %s, NOW())
+                RETURNING id
+                """,
+                (patient_id, doctor_id, appt_date, appt_time, symptoms, notes, consultation_type, duration_minutes)
+            )
+        except (psycopg2.errors.ExclusionViolation, psycopg2.errors.UniqueViolation):
+            # appointments_no_overlap: another booking already covers part of this slot
+            conn.rollback()
+            conn.close()
+            return jsonify({'message': 'This slot is no longer available', 'conflict': 'appointment'}), 409
         new_id = cursor.fetchone()['id']
         conn.commit()
         conn.close()
@@ -342,6 +704,11 @@ def list_appointments_compat():
     """List appointments for the logged in user (patient or doctor)."""
     try:
         user_id = get_jwt_identity()
+        try:
+            page = get_page_args(request.args, (str, str, int))
+        except ValueError as e:
+            return jsonify({'message': 'Invalid pagination parameters', 'error': str(e)}), 400
+
         conn = get_db_connection()
         if not conn:
             return jsonify({'message': 'Database connection error'}), 500
@@ -392,16 +759,29 @@ def list_appointments_compat():
         if status_filter:
             conditions.append('a.status = %s')
             params.append(status_filter)
+        if page and page.after:
+            # Newest first, so the next page continues below the cursor row
+            conditions.append('(a.appointment_date, a.appointment_time, a.id) < (%s, %s, %s)')
+            params.extend(page.after)
 
         if conditions:
             base_query.append(' WHERE ' + ' AND '.join(conditions))
-        base_query.append(' ORDER BY a.appointment_date DESC, a.appointment_time DESC')
+        base_query.append(' ORDER BY a.appointment_date DESC, a.appointment_time DESC, a.id DESC')
+        if page:
+            base_query.append(' LIMIT %s')
+            params.append(page.limit + 1)
 
         final_sql = ''.join(base_query)
         cursor.execute(final_sql, tuple(params))
         rows = cursor.fetchall()
         conn.close()
 
+        next_cursor = None
+        if page:
+            rows, next_cursor = split_page(
+                rows, page.limit, lambda r: (r['appointment_date'], r['appointment_time'], r['id'])
+            )
+
         # Normalize output similar to previous backend format
         result = []
         for r in rows:
@@ -418,6 +798,8 @@ def list_appointments_compat():
                 'notes': r.get('notes')
             })
 
+        if page:
+            return jsonify({'appointments': result, 'next_cursor': next_cursor}), 200
         return jsonify(result), 200
     except Exception as e:
         print(f"List appointments compat error: {e}")
@@ -526,6 +908,7 @@ def update_doctor_availability():
         
         conn.commit()
         conn.close()
+        doctor_cache.invalidate()
         
         return jsonify({'message': 'Availability updated successfully'}), 200
         
@@ -636,11 +1019,14 @@ def get_pharmacy_stock():
         if not pharmacy:
             return jsonify({'message': 'Pharmacy not found'}), 404
         
+        # is_low_stock is the medicine's level over all batches, maintained by the availability trigger
         cursor.execute("""
             SELECT s.*, m.medicine_name, m.generic_name, m.category,
-                   CASE WHEN s.quantity_available <= s.threshold_quantity THEN true ELSE false END as is_low_stock
+                   COALESCE(a.stock_level > 0, false) as is_low_stock
             FROM pharmacy_stock_table s
             JOIN medicines_table m ON s.medicine_id = m.id
+            LEFT JOIN pharmacy_availability_table a
+                   ON a.pharmacy_id = s.pharmacy_id AND a.medicine_id = s.medicine_id
             WHERE s.pharmacy_id = %s
             ORDER BY s.quantity_available ASC, m.medicine_name ASC
         """, (pharmacy['id'],))
@@ -664,37 +1050,715 @@ def get_pharmacy_stock():
         print(f"Get pharmacy stock error: {e}")
         return jsonify({'message': 'Internal server error'}), 500
 
+@app.route('/api/pharmacy/stock/alerts', methods=['GET'])
+@jwt_required()
+def get_pharmacy_stock_alerts():
+    """Medicines at or below their threshold, summed over batches, out of stock first"""
+    try:
+        user_id = get_jwt_identity()
+        
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            SELECT a.medicine_id, m.medicine_name, m.generic_name, a.quantity_available,
+                   a.quantity_reserved, a.threshold_quantity, a.batch_count, a.next_expiry,
+                   CASE a.stock_level WHEN 2 THEN 'out_of_stock' ELSE 'low_stock' END AS stock_status,
+                   a.updated_at
+            FROM pharmacies_table p
+            JOIN pharmacy_availability_table a ON a.pharmacy_id = p.id AND a.stock_level > 0
+            JOIN medicines_table m ON m.id = a.medicine_id
+            WHERE p.login_id = %s
+            ORDER BY a.stock_level DESC, a.quantity_available, m.medicine_name
+        """, (user_id,))
+        alerts = cursor.fetchall()
+        conn.close()
+        
+        return jsonify({'alerts': [dict(alert) for alert in alerts]}), 200
+        
+    except Exception as e:
+        print(f"Get stock alerts error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/pharmacy/expiry-report', methods=['GET'])
+@jwt_required()
+def get_pharmacy_expiry_report():
+    """Expired stock and stock expiring within 30/60/90 days, with value at risk, from the summary table"""
+    try:
+        user_id = get_jwt_identity()
+        try:
+            window = int(request.args.get('window', 30))
+            limit = max(1, min(int(request.args.get('limit', 50)), 200))
+        except ValueError:
+            return jsonify({'message': 'window and limit must be integers'}), 400
+        if window not in EXPIRY_WINDOWS:
+            return jsonify({'message': f'window must be one of {", ".join(map(str, EXPIRY_WINDOWS))}'}), 400
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cursor.execute("SELECT id FROM pharmacies_table WHERE login_id = %s", (user_id,))
+        pharmacy = cursor.fetchone()
+        if not pharmacy:
+            conn.close()
+            return jsonify({'message': 'Pharmacy not found'}), 404
+        
+        cursor.execute("""
+            SELECT window_days, medicine_count, batch_count, quantity, value_at_risk, earliest_expiry,
+                   as_of, refreshed_at
+            FROM stock_expiry_summary_table
+            WHERE pharmacy_id = %s
+        """, (pharmacy['id'],))
+        report = summarize(cursor.fetchall())
+        
+        # The batches behind the chosen window, soonest first, read straight off idx_stock_pharmacy_expiry
+        cursor.execute("""
+            SELECT s.id AS stock_id, s.medicine_id, m.medicine_name, m.strength, s.batch_number,
+                   s.expiry_date, s.quantity_available, s.price,
+                   s.price * s.quantity_available AS value_at_risk
+            FROM pharmacy_stock_table s
+            JOIN medicines_table m ON m.id = s.medicine_id
+            WHERE s.pharmacy_id = %s AND s.quantity_available > 0 AND s.expiry_date < CURRENT_DATE + %s
+            ORDER BY s.expiry_date, s.id
+            LIMIT %s
+        """, (pharmacy['id'], window, limit))
+        batches = cursor.fetchall()
+        conn.close()
+        
+        report['window'] = window
+        report['batches'] = [dict(batch, expiry_date=batch['expiry_date'].isoformat()) for batch in batches]
+        return jsonify(report), 200
+        
+    except Exception as e:
+        print(f"Get expiry report error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/medicines/<int:medicine_id>/pharmacies', methods=['GET'])
+def get_medicine_pharmacies(medicine_id):
+    """Pharmacies with a medicine in stock, nearest PIN code first (served from memory)"""
+    try:
+        try:
+            limit = max(1, min(int(request.args.get('limit', 20)), 100))
+            min_quantity = max(1, int(request.args.get('min_quantity', 1)))
+        except ValueError:
+            return jsonify({'message': 'limit and min_quantity must be integers'}), 400
+        
+        ensure_notification_listener()
+        pharmacies = stock_index.pharmacies_with(
+            medicine_id,
+            pincode=request.args.get('pincode'),
+            min_quantity=min_quantity,
+            limit=limit,
+            delivery_only=request.args.get('delivery') == 'true'
+        )
+        return jsonify({'medicine_id': medicine_id, 'pharmacies': [
+            dict(pharmacy, pharmacy_id=pharmacy.pop('id')) for pharmacy in pharmacies
+        ]}), 200
+        
+    except Exception as e:
+        print(f"Get medicine pharmacies error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/medicines/<int:medicine_id>/pharmacies/nearest', methods=['GET'])
+def get_nearest_medicine_pharmacies(medicine_id):
+    """The k pharmacies nearest a PIN code (or lat/lng) with a medicine in stock, by distance.
+
+    The bundled PIN code table only covers Punjab, Haryana and Delhi; point
+    PINCODE_GEO_FILE at the full India Post directory for national coverage.
+    Pharmacies it cannot place are left out.
+    """
+    try:
+        try:
+            k = max(1, min(int(request.args.get('k', 10)), 50))
+            min_quantity = max(1, int(request.args.get('min_quantity', 1)))
+            max_km = float(request.args['max_km']) if request.args.get('max_km') else None
+            if request.args.get('lat') and request.args.get('lng'):
+                origin = parse_coordinates(request.args['lat'], request.args['lng']) + (None,)
+            else:
+                origin = None
+        except ValueError:
+            return jsonify({'message': 'k, min_quantity, max_km, lat and lng must be numbers, '
+                                       'with lat and lng a point on the globe'}), 400
+        
+        if origin is None:
+            pincode = request.args.get('pincode')
+            if not pincode:
+                return jsonify({'message': 'pincode or lat and lng is required'}), 400
+            origin = pincode_locator.locate(pincode)
+            if origin is None:
+                return jsonify({'message': 'Unknown pincode'}), 404
+        latitude, longitude, precision = origin
+        
+        ensure_notification_listener()
+        pharmacies = stock_index.nearest_with(
+            medicine_id, latitude, longitude,
+            k=k,
+            min_quantity=min_quantity,
+            delivery_only=request.args.get('delivery') == 'true',
+            max_km=max_km
+        )
+        return jsonify({
+            'medicine_id': medicine_id,
+            'origin': {'latitude': latitude, 'longitude': longitude, 'location_precision': precision},
+            'pharmacies': [dict(pharmacy, pharmacy_id=pharmacy.pop('id')) for pharmacy in pharmacies]
+        }), 200
+        
+    except Exception as e:
+        print(f"Get nearest pharmacies error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/medicines/<int:medicine_id>/reserve', methods=['POST'])
+@jwt_required()
+def reserve_medicine(medicine_id):
+    """Hold stock of a medicine at one pharmacy, taking the earliest-expiring batches first"""
+    conn = None
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json() or {}
+        try:
+            pharmacy_id = int(data.get('pharmacy_id'))
+            quantity = int(data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return jsonify({'message': 'pharmacy_id and quantity must be integers'}), 400
+        if not 0 < quantity <= MAX_RESERVATION_QUANTITY:
+            return jsonify({'message': f'quantity must be between 1 and {MAX_RESERVATION_QUANTITY}'}), 400
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cursor.execute("""
+            SELECT p.id, m.medicine_name, m.strength
+            FROM patients_table p, medicines_table m
+            WHERE p.login_id = %s AND m.id = %s
+        """, (user_id, medicine_id))
+        found = cursor.fetchone()
+        if not found:
+            conn.close()
+            return jsonify({'message': 'Patient profile or medicine not found'}), 404
+        
+        # Lock the usable batches in expiry order; concurrent reservations of the same
+        # medicine wait here, then see the quantities this one leaves behind
+        cursor.execute("""
+            SELECT id, batch_number, expiry_date, quantity_available, price
+            FROM pharmacy_stock_table
+            WHERE pharmacy_id = %s AND medicine_id = %s
+              AND quantity_available > 0 AND expiry_date > CURRENT_DATE
+            ORDER BY expiry_date, id
+            FOR UPDATE
+        """, (pharmacy_id, medicine_id))
+        try:
+            allocation = allocate_fefo(cursor.fetchall(), quantity)
+        except InsufficientStock as e:
+            conn.rollback()
+            conn.close()
+            return jsonify({'message': 'Not enough stock', 'available': e.available}), 409
+        
+        execute_values(cursor, """
+            UPDATE pharmacy_stock_table s
+            SET quantity_available = s.quantity_available - v.quantity,
+                quantity_reserved = COALESCE(s.quantity_reserved, 0) + v.quantity
+            FROM (VALUES %s) AS v(id, quantity)
+            WHERE s.id = v.id
+        """, [(batch['id'], take) for batch, take in allocation])
+        
+        total = sum(batch['price'] * take for batch, take in allocation)
+        expires_at = datetime.now() + timedelta(hours=RESERVATION_HOLD_HOURS)
+        cursor.execute("""
+            INSERT INTO reservations_table
+                (reservation_id, patient_id, pharmacy_id, reservation_type, status, total_amount, expiry_datetime)
+            VALUES (%s, %s, %s, 'general', 'pending', %s, %s)
+            RETURNING id, reservation_id, status, total_amount, expiry_datetime
+        """, (f'RSV{uuid.uuid4().hex[:12].upper()}', found['id'], pharmacy_id, total, expires_at))
+        reservation = cursor.fetchone()
+        execute_values(cursor, """
+            INSERT INTO reservation_items_table
+                (reservation_id, medicine_id, stock_id, medicine_name, strength, quantity_requested,
+                 quantity_confirmed, unit_price, total_price, availability_status)
+            VALUES %s
+        """, [(reservation['id'], medicine_id, batch['id'], found['medicine_name'], found['strength'],
+               take, take, batch['price'], batch['price'] * take, 'available') for batch, take in allocation])
+        conn.commit()
+        conn.close()
+        
+        return jsonify({
+            'message': 'Medicine reserved successfully',
+            'reservation': {
+                'reservation_id': reservation['reservation_id'],
+                'status': reservation['status'],
+                'total_amount': reservation['total_amount'],
+                'expiry_datetime': reservation['expiry_datetime'].isoformat(),
+                'items': [{
+                    'stock_id': batch['id'],
+                    'batch_number': batch['batch_number'],
+                    'expiry_date': batch['expiry_date'].isoformat(),
+                    'quantity': take,
+                    'unit_price': batch['price']
+                } for batch, take in allocation]
+            }
+        }), 201
+        
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Reserve medicine error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/reservations/<reservation_id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel_reservation(reservation_id):
+    """Cancel one of the patient's open reservations and give its stock back"""
+    conn = None
+    try:
+        user_id = get_jwt_identity()
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            UPDATE reservations_table r SET status = 'cancelled'
+            FROM patients_table p
+            WHERE r.reservation_id = %s AND r.patient_id = p.id AND p.login_id = %s
+              AND r.status IN ('pending', 'confirmed')
+            RETURNING r.id
+        """, (reservation_id, user_id))
+        row = cursor.fetchone()
+        if not row:
+            conn.rollback()
+            conn.close()
+            return jsonify({'message': 'No open reservation found'}), 404
+        
+        release_reservation_stock(cursor, [row[0]])
+        conn.commit()
+        conn.close()
+        
+        return jsonify({'message': 'Reservation cancelled'}), 200
+        
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Cancel reservation error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/medicines/rare-request', methods=['POST'])
+@jwt_required()
+def create_rare_medicine_request():
+    """Request a hard-to-find medicine and route it to the pharmacies most likely to supply it"""
+    conn = None
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json() or {}
+        try:
+            medicine_id = int(data['medicine_id']) if data.get('medicine_id') is not None else None
+            quantity = int(data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return jsonify({'message': 'medicine_id and quantity must be integers'}), 400
+        if not 0 < quantity <= MAX_RESERVATION_QUANTITY:
+            return jsonify({'message': f'quantity must be between 1 and {MAX_RESERVATION_QUANTITY}'}), 400
+        urgency = data.get('urgency_level', 'normal')
+        if urgency not in RARE_URGENCY_LEVELS:
+            return jsonify({'message': f'urgency_level must be one of {", ".join(RARE_URGENCY_LEVELS)}'}), 400
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cursor.execute("SELECT id, address FROM patients_table WHERE login_id = %s", (user_id,))
+        patient = cursor.fetchone()
+        if not patient:
+            conn.close()
+            return jsonify({'message': 'Patient profile not found'}), 404
+        
+        medicine_name, strength = data.get('medicine_name'), data.get('strength')
+        if medicine_id is not None:
+            cursor.execute("SELECT medicine_name, strength FROM medicines_table WHERE id = %s", (medicine_id,))
+            medicine = cursor.fetchone()
+            if not medicine:
+                conn.close()
+                return jsonify({'message': 'Medicine not found'}), 404
+            medicine_name, strength = medicine['medicine_name'], medicine['strength']
+        elif not medicine_name:
+            conn.close()
+            return jsonify({'message': 'medicine_id or medicine_name is required'}), 400
+        
+        pincode = (data.get('pincode') or '').strip() or pincode_from_address(patient['address'])
+        city = data.get('city')
+        delivery_required = bool(data.get('delivery_required'))
+        
+        # Candidates come from the in-memory stock index; no pharmacy or stock scan here
+        ensure_notification_listener()
+        candidates = select_candidates(stock_index, medicine_id, pincode=pincode, city=city,
+                                       delivery_only=delivery_required, limit=RARE_FANOUT_LIMIT)
+        
+        cursor.execute("""
+            INSERT INTO rare_medicine_requests_table
+                (request_id, patient_id, medicine_id, medicine_name, strength, quantity_needed, urgency_level,
+                 medical_justification, patient_notes, pincode, city, delivery_required, status, candidate_count)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id, request_id, status, created_at
+        """, (f'RMR{uuid.uuid4().hex[:12].upper()}', patient['id'], medicine_id, medicine_name, strength,
+              quantity, urgency, data.get('medical_justification'), data.get('notes'), pincode, city,
+              delivery_required, 'pharmacy_reviewing' if candidates else 'requested', len(candidates)))
+        rare_request = cursor.fetchone()
+        
+        if candidates:
+            execute_values(cursor, """
+                INSERT INTO rare_medicine_candidates_table
+                    (request_id, pharmacy_id, match_reason, quantity_available, shared_pincode_digits)
+                VALUES %s
+            """, [(rare_request['id'], c['id'], c['match'], c['quantity_available'], c['shared_pincode_digits'])
+                  for c in candidates])
+            # One statement notifies every candidate; the insert trigger wakes their open streams
+            cursor.execute("""
+                INSERT INTO notifications_table
+                    (user_id, title, message, notification_type, priority, action_url, metadata)
+                SELECT p.login_id, 'Rare medicine request', %s, 'rare_medicine_request', %s,
+                       '/pharmacy/rare-requests',
+                       json_build_object('request_id', c.request_id, 'match_reason', c.match_reason)::jsonb
+                FROM rare_medicine_candidates_table c
+                JOIN pharmacies_table p ON p.id = c.pharmacy_id
+                WHERE c.request_id = %s
+            """, (f"A patient needs {quantity} x {medicine_name}{' ' + strength if strength else ''}",
+                  'high' if urgency in ('high', 'critical') else 'normal', rare_request['id']))
+        conn.commit()
+        conn.close()
+        
+        return jsonify({
+            'message': 'Rare medicine request submitted',
+            'request': {
+                'id': rare_request['id'],
+                'request_id': rare_request['request_id'],
+                'status': rare_request['status'],
+                'created_at': rare_request['created_at'].isoformat(),
+                'pharmacies_notified': len(candidates),
+                'pharmacies_with_stock': sum(1 for c in candidates if c['match'] == 'in_stock')
+            }
+        }), 201
+        
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Create rare medicine request error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/patient/rare-requests', methods=['GET'])
+@jwt_required()
+def get_patient_rare_requests():
+    """The patient's rare-medicine requests, newest first, with offers ranked fastest then cheapest"""
+    try:
+        user_id = get_jwt_identity()
+        try:
+            page = get_page_args(request.args, (int,))
+        except ValueError as e:
+            return jsonify({'message': 'Invalid pagination parameters', 'error': str(e)}), 400
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        sql = """
+            SELECT r.id, r.request_id, r.medicine_id, r.medicine_name, r.strength, r.quantity_needed,
+                   r.urgency_level, r.status, r.candidate_count, r.created_at
+            FROM patients_table p
+            JOIN rare_medicine_requests_table r ON r.patient_id = p.id
+            WHERE p.login_id = %s
+        """
+        params = [user_id]
+        if page and page.after:
+            sql += ' AND r.id < %s'
+            params.append(page.after[0])
+        sql += ' ORDER BY r.id DESC LIMIT %s'
+        params.append(page.limit + 1 if page else 50)
+        cursor.execute(sql, tuple(params))
+        requests_found = cursor.fetchall()
+        
+        next_cursor = None
+        if page:
+            requests_found, next_cursor = split_page(requests_found, page.limit, lambda r: (r['id'],))
+        
+        # All responses for the page in one query, grouped and ranked here
+        responses = {}
+        if requests_found:
+            cursor.execute("""
+                SELECT resp.request_id, resp.pharmacy_id, ph.pharmacy_name, ph.phone, ph.city, ph.pincode,
+                       ph.delivery_available, resp.response_status, resp.estimated_time_days,
+                       resp.estimated_cost, resp.pharmacy_notes, resp.contact_details, resp.created_at
+                FROM rare_medicine_responses_table resp
+                JOIN pharmacies_table ph ON ph.id = resp.pharmacy_id
+                WHERE resp.request_id = ANY(%s)
+            """, ([r['id'] for r in requests_found],))
+            for response in cursor.fetchall():
+                responses.setdefault(response['request_id'], []).append(response)
+        conn.close()
+        
+        result = []
+        for item in requests_found:
+            item_dict = dict(item)
+            received = responses.get(item['id'], [])
+            item_dict['offers'] = [dict(offer, created_at=offer['created_at'].isoformat())
+                                   for offer in rank_offers(received)]
+            item_dict['declined_count'] = sum(1 for r in received if r['response_status'] == 'declined')
+            item_dict['created_at'] = item['created_at'].isoformat()
+            result.append(item_dict)
+        
+        return jsonify({'requests': result, 'next_cursor': next_cursor}), 200
+        
+    except Exception as e:
+        print(f"Get patient rare requests error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/pharmacy/rare-requests', methods=['GET'])
+@jwt_required()
+def get_pharmacy_rare_requests():
+    """Open rare-medicine requests routed to this pharmacy, newest first, with its own response"""
+    try:
+        user_id = get_jwt_identity()
+        try:
+            page = get_page_args(request.args, (int,))
+        except ValueError as e:
+            return jsonify({'message': 'Invalid pagination parameters', 'error': str(e)}), 400
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        sql = """
+            SELECT r.id, r.request_id, r.medicine_id, r.medicine_name, r.strength, r.quantity_needed,
+                   r.urgency_level, r.patient_notes, r.pincode, r.city, r.delivery_required, r.status,
+                   r.created_at, c.match_reason, c.quantity_available, c.shared_pincode_digits,
+                   resp.response_status, resp.estimated_time_days, resp.estimated_cost
+            FROM pharmacies_table ph
+            JOIN rare_medicine_candidates_table c ON c.pharmacy_id = ph.id
+            JOIN rare_medicine_requests_table r ON r.id = c.request_id
+            LEFT JOIN rare_medicine_responses_table resp ON resp.request_id = r.id AND resp.pharmacy_id = ph.id
+            WHERE ph.login_id = %s AND r.status NOT IN ('declined', 'fulfilled')
+        """
+        params = [user_id]
+        if page and page.after:
+            sql += ' AND c.request_id < %s'
+            params.append(page.after[0])
+        sql += ' ORDER BY c.request_id DESC LIMIT %s'
+        params.append(page.limit + 1 if page else 50)
+        cursor.execute(sql, tuple(params))
+        inbox = cursor.fetchall()
+        conn.close()
+        
+        next_cursor = None
+        if page:
+            inbox, next_cursor = split_page(inbox, page.limit, lambda r: (r['id'],))
+        
+        return jsonify({
+            'requests': [dict(item, created_at=item['created_at'].isoformat()) for item in inbox],
+            'next_cursor': next_cursor
+        }), 200
+        
+    except Exception as e:
+        print(f"Get pharmacy rare requests error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/pharmacy/rare-requests/<int:request_id>/respond', methods=['POST'])
+@jwt_required()
+def respond_to_rare_request(request_id):
+    """Offer (or decline) to supply a rare medicine; answering again replaces the earlier response"""
+    conn = None
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json() or {}
+        status = data.get('response_status')
+        if status not in RARE_RESPONSE_STATUSES:
+            return jsonify({'message': f'response_status must be one of {", ".join(RARE_RESPONSE_STATUSES)}'}), 400
+        try:
+            days = int(data['estimated_time_days']) if data.get('estimated_time_days') is not None else None
+            cost = float(data['estimated_cost']) if data.get('estimated_cost') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({'message': 'estimated_time_days and estimated_cost must be numbers'}), 400
+        if (days is not None and days < 0) or (cost is not None and cost < 0):
+            return jsonify({'message': 'estimated_time_days and estimated_cost cannot be negative'}), 400
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor()
+        
+        # Only pharmacies the request was routed to may respond
+        cursor.execute("""
+            INSERT INTO rare_medicine_responses_table
+                (request_id, pharmacy_id, response_status, estimated_time_days, estimated_cost,
+                 pharmacy_notes, contact_details)
+            SELECT c.request_id, c.pharmacy_id, %s, %s, %s, %s, %s
+            FROM rare_medicine_candidates_table c
+            JOIN pharmacies_table ph ON ph.id = c.pharmacy_id
+            WHERE c.request_id = %s AND ph.login_id = %s
+            ON CONFLICT (request_id, pharmacy_id) DO UPDATE SET
+                response_status = EXCLUDED.response_status,
+                estimated_time_days = EXCLUDED.estimated_time_days,
+                estimated_cost = EXCLUDED.estimated_cost,
+                pharmacy_notes = EXCLUDED.pharmacy_notes,
+                contact_details = EXCLUDED.contact_details,
+                created_at = CURRENT_TIMESTAMP
+            RETURNING id
+        """, (status, days, cost, data.get('pharmacy_notes'), data.get('contact_details'), request_id, user_id))
+        if not cursor.fetchone():
+            conn.rollback()
+            conn.close()
+            return jsonify({'message': 'Request not found for this pharmacy'}), 404
+        
+        if status != 'declined':
+            cursor.execute("""
+                UPDATE rare_medicine_requests_table SET status = 'accepted'
+                WHERE id = %s AND status IN ('requested', 'pharmacy_reviewing')
+            """, (request_id,))
+            cursor.execute("""
+                INSERT INTO notifications_table (user_id, title, message, notification_type, action_url, metadata)
+                SELECT p.login_id, 'New offer for your medicine request',
+                       'A pharmacy can supply ' || r.medicine_name, 'rare_medicine_offer',
+                       '/patient/medicines', json_build_object('request_id', r.request_id)::jsonb
+                FROM rare_medicine_requests_table r
+                JOIN patients_table p ON p.id = r.patient_id
+                WHERE r.id = %s
+            """, (request_id,))
+        conn.commit()
+        conn.close()
+        
+        return jsonify({'message': 'Response recorded'}), 200
+        
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Respond to rare request error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
 # General Routes
 @app.route('/api/doctors', methods=['GET'])
 def get_doctors():
     """Get list of available doctors"""
     try:
+        try:
+            page = get_page_args(request.args, (str, int, int))
+        except ValueError as e:
+            return jsonify({'message': 'Invalid pagination parameters', 'error': str(e)}), 400
+        
+        cache_key = (page.limit, tuple(page.after) if page.after else None) if page else None
+        body = doctor_cache.get(cache_key)
+        if body is not None:
+            return Response(body, mimetype='application/json', headers={'X-Cache': 'HIT'}), 200
+        # Read before querying, so an invalidation during the query is not papered over
+        version = doctor_cache.current_version()
+        
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        cursor.execute("""
+        # Sort key is (rating, experience, id) with NULLs folded to 0 so it is total and seekable
+        sql = """
             SELECT id, doctor_id, first_name, last_name, specialization, 
                    qualification, experience_years, consultation_fee, 
                    availability_status, rating, clinic_name
             FROM doctors_table
             WHERE availability_status IN ('available', 'on_call')
-            ORDER BY rating DESC, experience_years DESC
-        """)
-        
+        """
+        params = []
+        if page and page.after:
+            sql += " AND (COALESCE(rating, 0), COALESCE(experience_years, 0), id) < (%s, %s, %s)"
+            params.extend(page.after)
+        sql += " ORDER BY COALESCE(rating, 0) DESC, COALESCE(experience_years, 0) DESC, id DESC"
+        if page:
+            sql += " LIMIT %s"
+            params.append(page.limit + 1)
+        
+        cursor.execute(sql, tuple(params))
         doctors = cursor.fetchall()
         conn.close()
         
-        return jsonify({'doctors': [dict(doc) for doc in doctors]}), 200
+        next_cursor = None
+        if page:
+            doctors, next_cursor = split_page(
+                doctors, page.limit, lambda d: (d['rating'] or 0, d['experience_years'] or 0, d['id'])
+            )
+        
+        body = app.json.dumps({'doctors': [dict(doc) for doc in doctors], 'next_cursor': next_cursor})
+        doctor_cache.set(cache_key, body, version)
+        return Response(body, mimetype='application/json', headers={'X-Cache': 'MISS'}), 200
         
     except Exception as e:
         print(f"Get doctors error: {e}")
         return jsonify({'message': 'Internal server error'}), 500
 
+@app.route('/api/medicines', methods=['GET'])
+def get_medicines():
+    """List medicines in name order"""
+    try:
+        category = request.args.get('category')
+        try:
+            page = get_page_args(request.args, (str, int))
+        except ValueError as e:
+            return jsonify({'message': 'Invalid pagination parameters', 'error': str(e)}), 400
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        conditions = []
+        params = []
+        if category:
+            conditions.append('category = %s')
+            params.append(category)
+        if page and page.after:
+            conditions.append('(medicine_name, id) > (%s, %s)')
+            params.extend(page.after)
+        
+        sql = 'SELECT * FROM medicines_table'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY medicine_name, id'
+        if page:
+            sql += ' LIMIT %s'
+            params.append(page.limit + 1)
+        
+        cursor.execute(sql, tuple(params))
+        medicines = cursor.fetchall()
+        conn.close()
+        
+        next_cursor = None
+        if page:
+            medicines, next_cursor = split_page(
+                medicines, page.limit, lambda m: (m['medicine_name'], m['id'])
+            )
+        
+        return jsonify({'medicines': [dict(med) for med in medicines], 'next_cursor': next_cursor}), 200
+        
+    except Exception as e:
+        print(f"Get medicines error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/medicines/suggest', methods=['GET'])
+def suggest_medicines():
+    """Autocomplete medicine names from the in-memory prefix index"""
+    try:
+        prefix = request.args.get('prefix', '')
+        try:
+            limit = max(1, min(int(request.args.get('limit', 10)), 50))
+        except ValueError:
+            return jsonify({'message': 'limit must be an integer'}), 400
+        
+        ensure_medicine_suggestions()
+        return jsonify({'suggestions': medicine_suggestions.suggest(prefix, limit)}), 200
+        
+    except Exception as e:
+        print(f"Suggest medicines error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
 @app.route('/api/medicines/search', methods=['GET'])
 def search_medicines():
-    """Search medicines"""
+    """Search medicines by name, generic, brand or category, best match first"""
     try:
-        query = request.args.get('q', '')
+        query = request.args.get('q', '').strip()
         
         if not query:
             return jsonify({'medicines': []}), 200
@@ -702,12 +1766,25 @@ def search_medicines():
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
+        # `q <% column` (word similarity) is served by the pg_trgm GIN indexes and
+        # tolerates typos; the prefix ILIKE keeps 1-2 character queries working.
         cursor.execute("""
-            SELECT * FROM medicines_table 
-            WHERE medicine_name ILIKE %s OR generic_name ILIKE %s
-            ORDER BY medicine_name
+            SELECT m.*,
+                   GREATEST(
+                       word_similarity(%(q)s, m.medicine_name),
+                       word_similarity(%(q)s, COALESCE(m.generic_name, '')) * 0.9,
+                       word_similarity(%(q)s, COALESCE(m.brand_name, '')) * 0.9,
+                       word_similarity(%(q)s, COALESCE(m.category, '')) * 0.5
+                   ) + CASE WHEN m.medicine_name ILIKE %(prefix)s THEN 0.5 ELSE 0 END AS relevance
+            FROM medicines_table m
+            WHERE %(q)s <%% m.medicine_name
+               OR %(q)s <%% m.generic_name
+               OR %(q)s <%% m.brand_name
+               OR %(q)s <%% m.category
+               OR m.medicine_name ILIKE %(prefix)s
+            ORDER BY relevance DESC, m.medicine_name
             LIMIT 50
-        """, (f'%{query}%', f'%{query}%'))
+        """, {'q': query, 'prefix': query.replace('%', r'\%').replace('_', r'\_') + '%'})
         
         medicines = cursor.fetchall()
         conn.close()
@@ -727,6 +1804,269 @@ def not_found(error):
 def internal_error(error):
     return jsonify({'message': 'Internal server error'}), 500
 
+# Notification and chat routes
+@app.route('/api/notifications', methods=['GET'])
+@jwt_required()
+def get_notifications():
+    """List the user's notifications, newest first"""
+    try:
+        user_id = get_jwt_identity()
+        unread_only = request.args.get('unread') == 'true'
+        try:
+            page = get_page_args(request.args, (int,))
+        except ValueError as e:
+            return jsonify({'message': 'Invalid pagination parameters', 'error': str(e)}), 400
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        sql = f'SELECT {NOTIFICATION_COLUMNS} FROM notifications_table WHERE user_id = %s'
+        params = [user_id]
+        if unread_only:
+            sql += ' AND is_read = FALSE'
+        if page and page.after:
+            sql += ' AND id < %s'
+            params.append(page.after[0])
+        sql += ' ORDER BY id DESC LIMIT %s'
+        params.append(page.limit + 1 if page else 50)
+        
+        cursor.execute(sql, tuple(params))
+        notifications = cursor.fetchall()
+        conn.close()
+        
+        next_cursor = None
+        if page:
+            notifications, next_cursor = split_page(notifications, page.limit, lambda n: (n['id'],))
+        
+        return jsonify({
+            'notifications': [dict(n) for n in notifications],
+            'next_cursor': next_cursor
+        }), 200
+        
+    except Exception as e:
+        print(f"Get notifications error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/notifications/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_notifications():
+    """Server-Sent Events stream of the user's new notifications.
+
+    EventSource cannot send headers, so browsers pass the token as ?jwt=.
+    """
+    user_id = get_jwt_identity()
+    # Fresh connections only stream what is new; history comes from GET /api/notifications
+    return open_event_stream(
+        notification_broker, user_id,
+        lambda after_id, limit: fetch_notifications_after(user_id, after_id, limit),
+        'notification',
+        lambda: latest_notification_id(user_id)
+    )
+
+# -------------------------------------------------------------
+# Chat between the patient and doctor of an appointment
+# (chat_messages_table). Messages are sent with POST and pushed to
+# open SSE streams; idle streams hold no database connection.
+# -------------------------------------------------------------
+
+@app.route('/api/chat/<int:appointment_id>/messages', methods=['GET'])
+@jwt_required()
+def get_chat_messages(appointment_id):
+    """Chat history for an appointment, newest first (keyset on created_at, id)"""
+    try:
+        user_id = get_jwt_identity()
+        try:
+            page = get_page_args(request.args, (datetime.fromisoformat, int))
+        except ValueError as e:
+            return jsonify({'message': 'Invalid pagination parameters', 'error': str(e)}), 400
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        if not chat_role(cursor, appointment_id, user_id):
+            conn.close()
+            return jsonify({'message': 'Not a participant of this appointment'}), 403
+        
+        sql = f'SELECT {CHAT_COLUMNS} FROM chat_messages_table WHERE appointment_id = %s'
+        params = [appointment_id]
+        if page and page.after:
+            sql += ' AND (created_at, id) < (%s, %s)'
+            params.extend(page.after)
+        sql += ' ORDER BY created_at DESC, id DESC LIMIT %s'
+        params.append(page.limit + 1 if page else 50)
+        
+        cursor.execute(sql, tuple(params))
+        messages = cursor.fetchall()
+        conn.close()
+        
+        next_cursor = None
+        if page:
+            messages, next_cursor = split_page(messages, page.limit, lambda m: (m['created_at'], m['id']))
+        
+        return jsonify({'messages': [dict(m) for m in messages], 'next_cursor': next_cursor}), 200
+        
+    except Exception as e:
+        print(f"Get chat messages error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/chat/<int:appointment_id>/messages', methods=['POST'])
+@jwt_required()
+def send_chat_message(appointment_id):
+    """Send a chat message; open streams are woken by the table trigger"""
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json() or {}
+        message_type = data.get('message_type', 'text')
+        content = data.get('message_content')
+        
+        if message_type not in ('text', 'file', 'prescription', 'image', 'voice'):
+            return jsonify({'message': 'Invalid message_type'}), 400
+        if not content and not data.get('file_url') and not data.get('prescription_data'):
+            return jsonify({'message': 'message_content, file_url or prescription_data is required'}), 400
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        role = chat_role(cursor, appointment_id, user_id)
+        if not role:
+            conn.close()
+            return jsonify({'message': 'Not a participant of this appointment'}), 403
+        
+        prescription_data = data.get('prescription_data')
+        cursor.execute(
+            f"""
+            INSERT INTO chat_messages_table
+                (message_id, appointment_id, sender_id, sender_role, message_type, message_content,
+                 file_url, file_name, file_size, is_prescription_item, prescription_data, reply_to_message_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING {CHAT_COLUMNS}
+            """,
+            (f"MSG{uuid.uuid4().hex[:12].upper()}", appointment_id, user_id, role, message_type, content,
+             data.get('file_url'), data.get('file_name'), data.get('file_size'),
+             prescription_data is not None, json.dumps(prescription_data) if prescription_data is not None else None,
+             data.get('reply_to_message_id'))
+        )
+        message = cursor.fetchone()
+        conn.commit()
+        conn.close()
+        
+        return jsonify({'message': 'Message sent', 'chat_message': dict(message)}), 201
+        
+    except Exception as e:
+        print(f"Send chat message error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/chat/<int:appointment_id>/read', methods=['POST'])
+@jwt_required()
+def mark_chat_read(appointment_id):
+    """Mark every message from the other participant (up to up_to_id, if given) as read"""
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or {}
+        up_to_id = data.get('up_to_id')
+        if up_to_id is not None:
+            try:
+                up_to_id = int(up_to_id)
+            except (TypeError, ValueError):
+                return jsonify({'message': 'up_to_id must be an integer'}), 400
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        if not chat_role(cursor, appointment_id, user_id):
+            conn.close()
+            return jsonify({'message': 'Not a participant of this appointment'}), 403
+        
+        sql = """
+            UPDATE chat_messages_table SET is_read = TRUE
+            WHERE appointment_id = %s AND sender_id <> %s AND is_read = FALSE
+        """
+        params = [appointment_id, user_id]
+        if up_to_id is not None:
+            sql += ' AND id <= %s'
+            params.append(up_to_id)
+        cursor.execute(sql, tuple(params))
+        updated = cursor.rowcount
+        conn.commit()
+        conn.close()
+        
+        return jsonify({'message': 'Messages marked as read', 'updated': updated}), 200
+        
+    except Exception as e:
+        print(f"Mark chat read error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/chat/unread', methods=['GET'])
+@jwt_required()
+def get_chat_unread_counts():
+    """Unread message counts for all of the user's appointments in one query"""
+    try:
+        user_id = get_jwt_identity()
+        appointment_ids = request.args.get('appointment_ids')
+        try:
+            appointment_ids = [int(i) for i in appointment_ids.split(',')] if appointment_ids else None
+        except ValueError:
+            return jsonify({'message': 'appointment_ids must be comma-separated integers'}), 400
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'message': 'Database connection error'}), 500
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        sql = """
+            SELECT c.appointment_id, COUNT(*) AS unread
+            FROM chat_messages_table c
+            JOIN appointments_table a ON a.id = c.appointment_id
+            LEFT JOIN patients_table p ON p.id = a.patient_id
+            LEFT JOIN doctors_table d ON d.id = a.doctor_id
+            WHERE (p.login_id = %s OR d.login_id = %s)
+              AND c.sender_id <> %s AND c.is_read = FALSE
+        """
+        params = [user_id, user_id, user_id]
+        if appointment_ids:
+            sql += ' AND c.appointment_id = ANY(%s)'
+            params.append(appointment_ids)
+        sql += ' GROUP BY c.appointment_id'
+        
+        cursor.execute(sql, tuple(params))
+        counts = {str(row['appointment_id']): row['unread'] for row in cursor.fetchall()}
+        conn.close()
+        
+        return jsonify({'unread': counts, 'total': sum(counts.values())}), 200
+        
+    except Exception as e:
+        print(f"Get chat unread error: {e}")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/api/chat/<int:appointment_id>/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_chat(appointment_id):
+    """Server-Sent Events stream of new messages in an appointment's chat"""
+    user_id = get_jwt_identity()
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'message': 'Database connection error'}), 500
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    if not chat_role(cursor, appointment_id, user_id):
+        conn.close()
+        return jsonify({'message': 'Not a participant of this appointment'}), 403
+    cursor.execute("SELECT COALESCE(MAX(id), 0) AS latest FROM chat_messages_table WHERE appointment_id = %s",
+                   (appointment_id,))
+    latest = cursor.fetchone()['latest']
+    conn.close()
+    
+    return open_event_stream(
+        chat_broker, appointment_id,
+        lambda after_id, limit: fetch_chat_after(appointment_id, after_id, limit),
+        'message',
+        lambda: latest
+    )
+
 # Health check
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -734,9 +2074,19 @@ def health_check():
     conn = get_db_connection()
     if conn:
         conn.close()
-        return jsonify({'status': 'healthy', 'database': 'connected'}), 200
+        return jsonify({'status': 'healthy', 'database': 'connected', 'pool': db_pool.stats(),
+                        'login_bcrypt': bcrypt_executor.stats(),
+                        'notification_streams': notification_broker.stats(), 'chat_streams': chat_broker.stats(),
+                        'doctor_cache': doctor_cache.stats(), 'stock_index': stock_index.stats(),
+                        'reservation_sweeper': reservation_sweeper.stats(),
+                        'expiry_report': expiry_refresher.stats()}), 200
     else:
-        return jsonify({'status': 'unhealthy', 'database': 'disconnected'}), 500
+        return jsonify({'status': 'unhealthy', 'database': 'disconnected', 'pool': db_pool.stats(),
+                        'login_bcrypt': bcrypt_executor.stats(),
+                        'notification_streams': notification_broker.stats(), 'chat_streams': chat_broker.stats(),
+                        'doctor_cache': doctor_cache.stats(), 'stock_index': stock_index.stats(),
+                        'reservation_sweeper': reservation_sweeper.stats(),
+                        'expiry_report': expiry_refresher.stats()}), 500
 
 if __name__ == '__main__':
     print("🏥 Starting Helio Healthcare Backend...")
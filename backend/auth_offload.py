@@ -0,0 +1,119 @@
+"""Keep slow login work off the request path.
+
+bcrypt is deliberately expensive, so verification runs in a small thread
+pool sized to the CPU (the bcrypt module releases the GIL while hashing)
+with a bounded backlog: once it is full new logins are refused straight
+away instead of queueing behind a login storm. last_login timestamps are
+collected in memory and written in one UPDATE every few seconds.
+"""
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExecutorSaturated(Exception):
+    """Every worker is busy and the backlog is full"""
+
+
+class BoundedExecutor:
+    """ThreadPoolExecutor that rejects work beyond `max_workers + max_pending` tasks"""
+
+    def __init__(self, max_workers, max_pending, name='bounded'):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'rejected': 0, 'in_flight': 0}
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise ExecutorSaturated(f'{self.max_workers + self.max_pending} tasks already in flight')
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['in_flight'] += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def run(self, fn, *args):
+        """Run `fn` in the pool and wait for its result"""
+        return self.submit(fn, *args).result()
+
+    def _release(self):
+        with self._lock:
+            self._stats['in_flight'] -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, max_workers=self.max_workers, max_pending=self.max_pending)
+
+
+class LastLoginBatcher:
+    """Collect user_id -> login time and hand them to `flush` in batches.
+
+    `flush` receives a list of (user_id, datetime) pairs and is called from a
+    daemon thread every `interval` seconds, as soon as `max_batch` users are
+    waiting, and once more by close() (registered to run at interpreter exit).
+    """
+
+    def __init__(self, flush, interval=5.0, max_batch=500):
+        self.flush = flush
+        self.interval = interval
+        self.max_batch = max_batch
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def record(self, user_id, when):
+        with self._lock:
+            self._pending[user_id] = when
+            if len(self._pending) >= self.max_batch:
+                self._wake.set()
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name='last-login-flush', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def flush_now(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            self.flush(sorted(batch.items()))
+        except Exception as e:
+            # last_login is informational; keep the newest values for the next attempt
+            print(f"last_login flush error: {e}")
+            with self._lock:
+                for user_id, when in batch.items():
+                    self._pending.setdefault(user_id, when)
+            return 0
+        return len(batch)
+
+    def close(self, timeout=10.0):
+        """Stop the flush thread, then write whatever is still pending"""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wake.set()
+        if thread is not None:
+            # Joined first so an older batch can't land after the final one
+            thread.join(timeout)
+        return self.flush_now()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._closed:
+                self.flush_now()
@@ -0,0 +1,72 @@
+"""Benchmark login password checks under a login storm.
+
+Fires `clients` concurrent logins and compares running bcrypt in every
+request thread (the old login()) with the bounded bcrypt pool used by
+app_new.py now. Reports throughput, latency and how many logins were shed
+with 429. Run from the backend directory:
+
+    python bench_login.py [clients] [logins_per_client] [bcrypt_rounds]
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+
+import bcrypt
+
+from auth_offload import BoundedExecutor, ExecutorSaturated
+
+
+def check_password(password, hashed):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def storm(label, verify, clients, per_client, hashed):
+    latencies, rejected = [], [0]
+    lock = threading.Lock()
+    start_line = threading.Barrier(clients)
+
+    def client():
+        start_line.wait()
+        for _ in range(per_client):
+            start = time.perf_counter()
+            try:
+                assert verify('patient123', hashed)
+            except ExecutorSaturated:
+                with lock:
+                    rejected[0] += 1
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0
+    print(f'  {label:<10} {len(latencies) / elapsed:7.1f} logins/s  '
+          f'p50 {statistics.median(latencies) if latencies else 0:7.1f} ms  p99 {p99:7.1f} ms  '
+          f'shed {rejected[0]}')
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    per_client = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    hashed = bcrypt.hashpw(b'patient123', bcrypt.gensalt(rounds)).decode('utf-8')
+    workers = os.cpu_count() or 2
+    print(f'{clients} clients x {per_client} logins, bcrypt cost {rounds}, {workers} CPUs')
+
+    storm('inline', check_password, clients, per_client, hashed)
+    pool = BoundedExecutor(max_workers=workers, max_pending=workers * 4, name='bench-bcrypt')
+    storm('bounded', lambda pw, h: pool.run(check_password, pw, h), clients, per_client, hashed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark medicine search on synthetic data (SQLite build of app.py).
+
+Compares the old ILIKE '%q%' scan with the trigram FTS5 search used by
+/api/medicines?search=. Run from the backend directory:
+
+    python bench_medicine_search.py [row_count]
+"""
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'))
+
+from app import app, db, Medicine, search_medicine_ids
+import medicine_search
+
+SYLLABLES = ['pa', 'ra', 'ce', 'ta', 'mo', 'xi', 'ci', 'ti', 'ri', 'me', 'for', 'tor', 'va',
+             'lo', 'sar', 'pra', 'zo', 'thro', 'bu', 'do', 'mon', 'te', 'lu', 'le', 'vo', 'clo',
+             'pi', 'dro', 'am', 'di', 'na', 'ke', 'sto', 'fe', 'gli', 'ben', 'cla', 'ri', 'tho']
+SUFFIXES = ['mol', 'cillin', 'zine', 'min', 'statin', 'tan', 'zole', 'mycin', 'fen', 'floxacin',
+            'pril', 'olol', 'dipine', 'sone', 'vir', 'mab', 'tide', 'parin', 'lukast', 'grel']
+CATEGORIES = ['Pain Relief', 'Antibiotics', 'Antihistamines', 'Diabetes', 'Cardiac', 'Gastro',
+              'Respiratory', 'Neurology', 'Dermatology', 'Oncology', 'Vitamins', 'Antivirals']
+MANUFACTURERS = ['Cipla Ltd', 'Sun Pharma', "Dr. Reddy's", 'Lupin', 'Mankind', 'Zydus',
+                 'Glenmark', 'Torrent', 'Alkem', 'Intas', 'Biocon', 'Abbott India']
+
+
+def synthetic_name(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))) + rng.choice(SUFFIXES)
+
+
+def synthetic_medicines(count, seed=42):
+    rng = random.Random(seed)
+    for i in range(count):
+        name = synthetic_name(rng).capitalize()
+        yield {
+            'id': f'bench-{i}',
+            'name': f'{name} {rng.choice([5, 10, 250, 500])}mg',
+            'generic_name': synthetic_name(rng),
+            'manufacturer': rng.choice(MANUFACTURERS),
+            'price': round(rng.uniform(5, 500), 2),
+            'stock_quantity': rng.randint(0, 200),
+            'category': rng.choice(CATEGORIES)
+        }
+
+
+def misspell(word, rng):
+    """Drop one interior letter, the most common typo on a phone keyboard"""
+    i = rng.randint(1, len(word) - 2)
+    return word[:i] + word[i + 1:]
+
+
+def benchmark_queries(medicines, count=8, seed=7):
+    rng = random.Random(seed)
+    names = [m['name'].split()[0].lower() for m in rng.sample(medicines, count)]
+    return names + [misspell(name, rng) for name in names] + ['cipla', 'statin']
+
+
+def time_queries(label, search, queries, repeat=5):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            hits = search(query)
+        timings.append((time.perf_counter() - start) / repeat * 1000)
+        print(f'  {label:<8} {query!r:<14} {len(hits):>6} hits  {timings[-1]:8.2f} ms')
+    return sum(timings) / len(timings)
+
+
+def ilike_scan(query):
+    return Medicine.query.filter(db.or_(
+        Medicine.name.ilike(f'%{query}%'),
+        Medicine.generic_name.ilike(f'%{query}%')
+    )).limit(medicine_search.SEARCH_RESULT_LIMIT).all()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        medicines = list(synthetic_medicines(count))
+        queries = benchmark_queries(medicines)
+        db.session.execute(db.insert(Medicine), medicines)
+        db.session.commit()
+        print(f'Inserted {count} medicines in {time.perf_counter() - start:.1f}s')
+
+        start = time.perf_counter()
+        with db.engine.begin() as connection:
+            medicine_search.ensure_sqlite_fts(connection)
+        print(f'Built FTS5 trigram index in {time.perf_counter() - start:.1f}s')
+
+        legacy = time_queries('ILIKE', ilike_scan, queries)
+        ranked = time_queries('trigram', search_medicine_ids, queries)
+        print(f'Mean per query: ILIKE {legacy:.2f} ms, trigram {ranked:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark "k nearest pharmacies with stock" on synthetic data.
+
+Places `pharmacy_count` pharmacies on random PIN codes across India and
+stocks one common, one occasional and one rare medicine. For each, compares
+measuring the distance to every pharmacy that holds it (what a query over
+pharmacies_table would do) with StockIndex.nearest_with(), which picks
+between scanning the holders and walking the grid. Run from the backend
+directory:
+
+    python bench_pharmacy_proximity.py [pharmacy_count] [queries]
+"""
+import heapq
+import os
+import random
+import sys
+import tempfile
+import time
+
+from pincode_geo import PincodeLocator, haversine_km
+from stock_index import StockIndex
+
+PINCODE_COUNT = 19000
+# medicine_id -> share of pharmacies holding it
+MEDICINES = {1: 0.5, 2: 0.05, 3: 0.002}
+K = 10
+
+
+def synthetic_pincode_file(rng):
+    """A pincode table the size of India's, at random points; returns (path, pincodes)"""
+    path = os.path.join(tempfile.mkdtemp(prefix='helio-bench-'), 'pincodes.csv')
+    pincodes = [str(p) for p in rng.sample(range(110000, 860000), PINCODE_COUNT)]
+    with open(path, 'w') as f:
+        f.write('pincode,latitude,longitude\n')
+        for pincode in pincodes:
+            f.write(f'{pincode},{rng.uniform(8.0, 34.0):.4f},{rng.uniform(69.0, 96.0):.4f}\n')
+    return path, pincodes
+
+
+def synthetic_stock(count, pincodes, rng):
+    pharmacies = [{'id': i, 'pharmacy_name': f'Pharmacy {i}', 'pincode': rng.choice(pincodes),
+                   'city': '', 'delivery_available': rng.random() < 0.4} for i in range(1, count + 1)]
+    availability = [(pharmacy['id'], medicine_id, rng.randint(1, 200))
+                    for medicine_id, share in MEDICINES.items()
+                    for pharmacy in pharmacies if rng.random() < share]
+    return pharmacies, availability
+
+
+def scan_holders(holders, points, lat, lon):
+    """Distance to every holder, as a per-request query would compute it"""
+    return heapq.nsmallest(K, ((haversine_km(lat, lon, *points[p]), p) for p in holders))
+
+
+def time_queries(search, origins, medicine_id):
+    start = time.perf_counter()
+    for lat, lon in origins:
+        search(medicine_id, lat, lon)
+    return (time.perf_counter() - start) / len(origins) * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rng = random.Random(42)
+    path, pincodes = synthetic_pincode_file(rng)
+    locator = PincodeLocator(path)
+    pharmacies, availability = synthetic_stock(count, pincodes, rng)
+    index = StockIndex(lambda: (pharmacies, availability), locator=locator)
+
+    start = time.perf_counter()
+    index.reload()
+    print(f'Indexed {count} pharmacies ({index.stats()["located"]} located) '
+          f'in {time.perf_counter() - start:.2f}s')
+
+    points = {p['id']: locator.locate(p['pincode'])[:2] for p in pharmacies}
+    holders_of = {}
+    for pharmacy_id, medicine_id, _ in availability:
+        holders_of.setdefault(medicine_id, []).append(pharmacy_id)
+
+    origins = [(rng.uniform(8.0, 34.0), rng.uniform(69.0, 96.0)) for _ in range(queries)]
+    for medicine_id, share in MEDICINES.items():
+        holders = holders_of[medicine_id]
+        for lat, lon in origins[:20]:
+            expected = [p for _, p in scan_holders(holders, points, lat, lon)]
+            found = [p['id'] for p in index.nearest_with(medicine_id, lat, lon, k=K)]
+            assert found == expected, (medicine_id, lat, lon)
+        scan = time_queries(lambda m, lat, lon: scan_holders(holders, points, lat, lon), origins, medicine_id)
+        indexed = time_queries(lambda m, lat, lon: index.nearest_with(m, lat, lon, k=K), origins, medicine_id)
+        print(f'  {share:>6.1%} stocked ({len(holders):>6} holders)  scan {scan:8.3f} ms  '
+              f'index {indexed:8.3f} ms  ({scan / indexed:5.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
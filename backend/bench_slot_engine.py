@@ -0,0 +1,70 @@
+"""Benchmark slot availability for a busy doctor.
+
+Compares the old per-slot any() scan (re-parsing every slot time for every
+appointment) with slot_engine.compute_slots. Run from the backend directory:
+
+    python bench_slot_engine.py [appointments_per_doctor] [days]
+"""
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import slot_engine
+
+
+def synthetic_appointments(first_day, days, count, seed=42):
+    rng = random.Random(seed)
+    appointments = []
+    for _ in range(count):
+        day = first_day + timedelta(days=rng.randrange(days))
+        start = datetime.combine(day, datetime.min.time()) + timedelta(minutes=rng.randrange(9 * 60, 17 * 60, 15))
+        appointments.append((start, rng.choice([15, 30, 45, 60])))
+    return appointments
+
+
+def legacy_slots(first_day, last_day, appointments):
+    """The original loop, applied once per day to that day's appointments"""
+    days = []
+    day = first_day
+    while day <= last_day:
+        todays = [start for start, _ in appointments if start.date() == day]
+        slots = []
+        for hour in range(9, 17):
+            for minute in [0, 30]:
+                slot_time = f"{hour:02d}:{minute:02d}"
+                is_booked = any(
+                    start.time().replace(second=0, microsecond=0) ==
+                    datetime.strptime(slot_time, '%H:%M').time()
+                    for start in todays
+                )
+                slots.append({'time': slot_time, 'available': not is_booked})
+        days.append((day, slots))
+        day += timedelta(days=1)
+    return days
+
+
+def timed(label, fn, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    print(f'  {label:<14} {elapsed:9.2f} ms')
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 31
+    first_day = date(2025, 1, 1)
+    last_day = first_day + timedelta(days=days - 1)
+    appointments = synthetic_appointments(first_day, days, count)
+    print(f'{count} appointments over {days} days')
+
+    legacy = timed('legacy any()', lambda: legacy_slots(first_day, last_day, appointments))
+    engine = timed('slot_engine', lambda: slot_engine.compute_slots(first_day, last_day, None, appointments))
+    print(f'Speed-up: {legacy / engine:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
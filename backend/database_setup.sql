@@ -7,6 +7,10 @@
 
 -- Enable UUID extension for better IDs
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+-- Trigram matching for typo-tolerant medicine search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+-- GiST equality on plain columns, for the appointment overlap constraint
+CREATE EXTENSION IF NOT EXISTS btree_gist;
 
 -- 1. LOGIN TABLE - Central authentication table
 CREATE TABLE login_table (
@@ -70,6 +74,9 @@ CREATE TABLE doctors_table (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Keyset pagination of the doctor directory
+CREATE INDEX idx_doctors_directory ON doctors_table((COALESCE(rating, 0)) DESC, (COALESCE(experience_years, 0)) DESC, id DESC);
+
 -- 4. PHARMACIES TABLE - Pharmacy/Pharmacist details
 CREATE TABLE pharmacies_table (
     id SERIAL PRIMARY KEY,
@@ -113,6 +120,13 @@ CREATE TABLE medicines_table (
 -- Create index for medicine search
 CREATE INDEX idx_medicine_name ON medicines_table(medicine_name);
 CREATE INDEX idx_medicine_generic ON medicines_table(generic_name);
+-- Trigram indexes for /api/medicines/search (ILIKE '%q%' and word similarity `<%`)
+CREATE INDEX idx_medicine_name_trgm ON medicines_table USING gin (medicine_name gin_trgm_ops);
+CREATE INDEX idx_medicine_generic_trgm ON medicines_table USING gin (generic_name gin_trgm_ops);
+CREATE INDEX idx_medicine_brand_trgm ON medicines_table USING gin (brand_name gin_trgm_ops);
+CREATE INDEX idx_medicine_category_trgm ON medicines_table USING gin (category gin_trgm_ops);
+-- Keyset pagination of the medicine listing
+CREATE INDEX idx_medicine_listing ON medicines_table(medicine_name, id);
 
 -- 6. PHARMACY STOCK TABLE - Inventory management
 CREATE TABLE pharmacy_stock_table (
@@ -167,6 +181,15 @@ CREATE INDEX idx_appointments_patient ON appointments_table(patient_id);
 CREATE INDEX idx_appointments_doctor ON appointments_table(doctor_id);
 CREATE INDEX idx_appointments_date ON appointments_table(appointment_date);
 CREATE INDEX idx_appointments_status ON appointments_table(status);
+-- Keyset pagination of appointment listings (newest first)
+CREATE INDEX idx_appointments_doctor_listing ON appointments_table(doctor_id, appointment_date DESC, appointment_time DESC, id DESC);
+CREATE INDEX idx_appointments_patient_listing ON appointments_table(patient_id, appointment_date DESC, appointment_time DESC, id DESC);
+-- No two live appointments of one doctor may overlap; concurrent bookings of a slot get an exclusion violation
+ALTER TABLE appointments_table ADD CONSTRAINT appointments_no_overlap EXCLUDE USING gist (
+    doctor_id WITH =,
+    tsrange(appointment_date + appointment_time,
+            appointment_date + appointment_time + make_interval(mins => COALESCE(duration_minutes, 30))) WITH &&
+) WHERE (status NOT IN ('cancelled', 'no_show'));
 
 -- 8. PRESCRIPTIONS TABLE - Doctor prescriptions for patients
 CREATE TABLE prescriptions_table (
@@ -203,6 +226,9 @@ CREATE TABLE prescription_items_table (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Popularity counts for medicine autocomplete
+CREATE INDEX idx_prescription_items_medicine ON prescription_items_table(medicine_id);
+
 -- 9. CHAT MESSAGES TABLE - Patient-Doctor communication
 CREATE TABLE chat_messages_table (
     id SERIAL PRIMARY KEY,
@@ -226,6 +252,9 @@ CREATE TABLE chat_messages_table (
 CREATE INDEX idx_chat_appointment ON chat_messages_table(appointment_id);
 CREATE INDEX idx_chat_sender ON chat_messages_table(sender_id);
 CREATE INDEX idx_chat_created ON chat_messages_table(created_at);
+-- Keyset history per appointment (newest first) and unread counts
+CREATE INDEX idx_chat_appointment_history ON chat_messages_table(appointment_id, created_at DESC, id DESC);
+CREATE INDEX idx_chat_unread ON chat_messages_table(appointment_id, sender_id) WHERE is_read = FALSE;
 
 -- 10. RESERVATIONS TABLE - Medicine reservations from pharmacies
 CREATE TABLE reservations_table (
@@ -270,15 +299,24 @@ CREATE INDEX idx_reservations_patient ON reservations_table(patient_id);
 CREATE INDEX idx_reservations_pharmacy ON reservations_table(pharmacy_id);
 CREATE INDEX idx_reservations_status ON reservations_table(status);
 CREATE INDEX idx_reservations_pickup ON reservations_table(pickup_date);
+-- Open holds by expiry, for the reservation sweeper
+CREATE INDEX idx_reservations_open_expiry ON reservations_table(expiry_datetime) WHERE status IN ('pending', 'confirmed');
+-- Items of a reservation, to release their stock
+CREATE INDEX idx_reservation_items_reservation ON reservation_items_table(reservation_id);
 
 -- 11. RARE MEDICINE REQUESTS TABLE - Special medicine request handling
 CREATE TABLE rare_medicine_requests_table (
     id SERIAL PRIMARY KEY,
     request_id VARCHAR(50) UNIQUE NOT NULL,
     patient_id INTEGER NOT NULL REFERENCES patients_table(id) ON DELETE CASCADE,
+    medicine_id INTEGER REFERENCES medicines_table(id) ON DELETE SET NULL, -- when the medicine is catalogued
     medicine_name VARCHAR(200) NOT NULL,
     strength VARCHAR(50),
     quantity_needed INTEGER NOT NULL,
+    pincode VARCHAR(10), -- where the patient wants it, for matching pharmacies
+    city VARCHAR(50),
+    delivery_required BOOLEAN DEFAULT FALSE,
+    candidate_count INTEGER DEFAULT 0,
     urgency_level VARCHAR(20) DEFAULT 'normal' CHECK (urgency_level IN ('low', 'normal', 'high', 'critical')),
     medical_justification TEXT,
     prescription_image_url VARCHAR(255),
@@ -298,9 +336,26 @@ CREATE TABLE rare_medicine_responses_table (
     estimated_cost DECIMAL(10,2),
     pharmacy_notes TEXT,
     contact_details TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(request_id, pharmacy_id)
 );
 
+-- A patient's requests, newest first
+CREATE INDEX idx_rare_requests_patient ON rare_medicine_requests_table(patient_id, id DESC);
+
+-- Pharmacies each rare request was routed to; doubles as each pharmacy's inbox
+CREATE TABLE rare_medicine_candidates_table (
+    request_id INTEGER NOT NULL REFERENCES rare_medicine_requests_table(id) ON DELETE CASCADE,
+    pharmacy_id INTEGER NOT NULL REFERENCES pharmacies_table(id) ON DELETE CASCADE,
+    match_reason VARCHAR(20) NOT NULL CHECK (match_reason IN ('in_stock', 'nearby')),
+    quantity_available INTEGER DEFAULT 0, -- at matching time
+    shared_pincode_digits INTEGER DEFAULT 0,
+    notified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (request_id, pharmacy_id)
+);
+
+CREATE INDEX idx_rare_candidates_pharmacy ON rare_medicine_candidates_table(pharmacy_id, request_id DESC);
+
 -- 12. NOTIFICATIONS TABLE - System notifications
 CREATE TABLE notifications_table (
     id SERIAL PRIMARY KEY,
@@ -319,6 +374,30 @@ CREATE TABLE notifications_table (
 -- Index for notifications
 CREATE INDEX idx_notifications_user ON notifications_table(user_id);
 CREATE INDEX idx_notifications_read ON notifications_table(is_read);
+-- Stream catch-up and listing: a user's notifications by id
+CREATE INDEX idx_notifications_user_id ON notifications_table(user_id, id);
+
+-- Wake the user's open /api/notifications/stream connections (LISTEN helio_notifications)
+CREATE OR REPLACE FUNCTION notify_new_notification() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('helio_notifications', json_build_object('user_id', NEW.user_id, 'id', NEW.id)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notifications_notify AFTER INSERT ON notifications_table
+    FOR EACH ROW EXECUTE FUNCTION notify_new_notification();
+
+-- Wake open /api/chat/<appointment_id>/stream connections (LISTEN helio_chat)
+CREATE OR REPLACE FUNCTION notify_new_chat_message() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('helio_chat', json_build_object('appointment_id', NEW.appointment_id, 'id', NEW.id)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER chat_messages_notify AFTER INSERT ON chat_messages_table
+    FOR EACH ROW EXECUTE FUNCTION notify_new_chat_message();
 
 -- 13. AUDIT LOG TABLE - Track important actions
 CREATE TABLE audit_log_table (
@@ -334,6 +413,225 @@ CREATE TABLE audit_log_table (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- 14. PHARMACY AVAILABILITY TABLE - Stock summed over batches, per pharmacy and medicine
+-- Maintained by a trigger on pharmacy_stock_table; never written by the application.
+CREATE TABLE pharmacy_availability_table (
+    pharmacy_id INTEGER NOT NULL REFERENCES pharmacies_table(id) ON DELETE CASCADE,
+    medicine_id INTEGER NOT NULL REFERENCES medicines_table(id) ON DELETE CASCADE,
+    quantity_available INTEGER NOT NULL DEFAULT 0,
+    quantity_reserved INTEGER NOT NULL DEFAULT 0,
+    threshold_quantity INTEGER NOT NULL DEFAULT 0, -- largest threshold among the batches
+    batch_count INTEGER NOT NULL DEFAULT 0,
+    next_expiry DATE, -- earliest expiry among batches still in stock
+    stock_level SMALLINT NOT NULL DEFAULT 0, -- 0 ok, 1 low (<= threshold), 2 out of stock
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (pharmacy_id, medicine_id)
+);
+
+-- "Who has medicine X" and a pharmacy's low-stock list
+CREATE INDEX idx_availability_medicine ON pharmacy_availability_table(medicine_id, pharmacy_id) WHERE quantity_available > 0;
+CREATE INDEX idx_availability_low ON pharmacy_availability_table(pharmacy_id, stock_level) WHERE stock_level > 0;
+
+-- Recompute one (pharmacy, medicine) aggregate; on the way down past a threshold, alert the
+-- pharmacist through notifications_table, and tell API workers (LISTEN helio_stock) to update
+-- their in-memory availability index
+CREATE OR REPLACE FUNCTION refresh_pharmacy_availability(p_pharmacy_id INTEGER, p_medicine_id INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    old_level SMALLINT;
+    new_level SMALLINT;
+    agg RECORD;
+BEGIN
+    -- Serialise refreshes of one pair until commit. Row locks can't do it: the first two stock
+    -- inserts for a pair find no aggregate row to lock, and the second one's upsert, after waiting
+    -- for the first, would write totals computed without the first one's batch.
+    PERFORM pg_advisory_xact_lock(p_pharmacy_id, p_medicine_id);
+    SELECT stock_level INTO old_level FROM pharmacy_availability_table
+        WHERE pharmacy_id = p_pharmacy_id AND medicine_id = p_medicine_id;
+
+    -- Served by the UNIQUE (pharmacy_id, medicine_id, batch_number) index
+    SELECT COUNT(*) AS batches,
+           COALESCE(SUM(quantity_available), 0) AS available,
+           COALESCE(SUM(quantity_reserved), 0) AS reserved,
+           COALESCE(MAX(threshold_quantity), 0) AS threshold,
+           MIN(expiry_date) FILTER (WHERE quantity_available > 0) AS next_expiry
+        INTO agg
+        FROM pharmacy_stock_table
+        WHERE pharmacy_id = p_pharmacy_id AND medicine_id = p_medicine_id;
+
+    IF agg.batches = 0 THEN
+        DELETE FROM pharmacy_availability_table WHERE pharmacy_id = p_pharmacy_id AND medicine_id = p_medicine_id;
+    ELSE
+        new_level := CASE WHEN agg.available <= 0 THEN 2 WHEN agg.available <= agg.threshold THEN 1 ELSE 0 END;
+        INSERT INTO pharmacy_availability_table
+            (pharmacy_id, medicine_id, quantity_available, quantity_reserved, threshold_quantity,
+             batch_count, next_expiry, stock_level, updated_at)
+        VALUES (p_pharmacy_id, p_medicine_id, agg.available, agg.reserved, agg.threshold,
+                agg.batches, agg.next_expiry, new_level, CURRENT_TIMESTAMP)
+        ON CONFLICT (pharmacy_id, medicine_id) DO UPDATE SET
+            quantity_available = EXCLUDED.quantity_available,
+            quantity_reserved = EXCLUDED.quantity_reserved,
+            threshold_quantity = EXCLUDED.threshold_quantity,
+            batch_count = EXCLUDED.batch_count,
+            next_expiry = EXCLUDED.next_expiry,
+            stock_level = EXCLUDED.stock_level,
+            updated_at = EXCLUDED.updated_at;
+
+        IF new_level > COALESCE(old_level, 0) THEN
+            INSERT INTO notifications_table (user_id, title, message, notification_type, priority, action_url, metadata)
+            SELECT p.login_id,
+                   CASE WHEN new_level = 2 THEN 'Out of stock' ELSE 'Low stock' END,
+                   m.medicine_name || ': ' || agg.available || ' left (threshold ' || agg.threshold || ')',
+                   'low_stock_alert',
+                   CASE WHEN new_level = 2 THEN 'high' ELSE 'normal' END,
+                   '/pharmacy/stock',
+                   json_build_object('pharmacy_id', p_pharmacy_id, 'medicine_id', p_medicine_id,
+                                     'quantity_available', agg.available, 'threshold_quantity', agg.threshold)::jsonb
+            FROM pharmacies_table p, medicines_table m
+            WHERE p.id = p_pharmacy_id AND m.id = p_medicine_id;
+        END IF;
+    END IF;
+
+    PERFORM pg_notify('helio_stock', json_build_object(
+        'pharmacy_id', p_pharmacy_id, 'medicine_id', p_medicine_id,
+        'available', CASE WHEN agg.batches = 0 THEN 0 ELSE agg.available END)::text);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION pharmacy_stock_changed() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM refresh_pharmacy_availability(NEW.pharmacy_id, NEW.medicine_id);
+    END IF;
+    IF TG_OP = 'DELETE' OR (OLD.pharmacy_id, OLD.medicine_id) IS DISTINCT FROM (NEW.pharmacy_id, NEW.medicine_id) THEN
+        PERFORM refresh_pharmacy_availability(OLD.pharmacy_id, OLD.medicine_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER pharmacy_stock_availability
+    AFTER INSERT OR DELETE OR UPDATE OF pharmacy_id, medicine_id, quantity_available, quantity_reserved,
+                                        threshold_quantity, expiry_date
+    ON pharmacy_stock_table
+    FOR EACH ROW EXECUTE FUNCTION pharmacy_stock_changed();
+
+-- Aggregate any stock that is already there (running this script over an existing stock table)
+INSERT INTO pharmacy_availability_table
+    (pharmacy_id, medicine_id, quantity_available, quantity_reserved, threshold_quantity,
+     batch_count, next_expiry, stock_level)
+SELECT pharmacy_id, medicine_id, available, reserved, threshold, batches, next_expiry,
+       CASE WHEN available <= 0 THEN 2 WHEN available <= threshold THEN 1 ELSE 0 END
+FROM (
+    SELECT pharmacy_id, medicine_id,
+           COUNT(*) AS batches,
+           COALESCE(SUM(quantity_available), 0) AS available,
+           COALESCE(SUM(quantity_reserved), 0) AS reserved,
+           COALESCE(MAX(threshold_quantity), 0) AS threshold,
+           MIN(expiry_date) FILTER (WHERE quantity_available > 0) AS next_expiry
+    FROM pharmacy_stock_table
+    GROUP BY pharmacy_id, medicine_id
+) agg
+ON CONFLICT (pharmacy_id, medicine_id) DO NOTHING;
+
+-- 15. STOCK EXPIRY SUMMARY TABLE - Expiring stock and value at risk, per pharmacy
+-- Rebuilt by refresh_stock_expiry_summary(), which the expiry report job in app_new.py calls every
+-- few minutes: pharmacies whose stock changed since the last run are recomputed, and all of them
+-- once a day as the windows move on. Never written by the application.
+CREATE TABLE stock_expiry_summary_table (
+    pharmacy_id INTEGER NOT NULL REFERENCES pharmacies_table(id) ON DELETE CASCADE,
+    window_days SMALLINT NOT NULL, -- 0: already expired; 30, 60, 90: expiring within that many days
+    medicine_count INTEGER NOT NULL,
+    batch_count INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    value_at_risk DECIMAL(14,2) NOT NULL, -- price * quantity_available
+    earliest_expiry DATE,
+    as_of DATE NOT NULL, -- the day the windows are counted from
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (pharmacy_id, window_days)
+);
+
+-- Pharmacies whose stock changed since the last refresh (no foreign key: rows are queued while
+-- a pharmacy's stock is being cascade-deleted)
+CREATE TABLE stock_expiry_dirty_table (
+    pharmacy_id INTEGER PRIMARY KEY,
+    marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- One row: when the summary was last rebuilt in full
+CREATE TABLE stock_expiry_refresh_table (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    full_refresh_date DATE,
+    refreshed_at TIMESTAMP
+);
+INSERT INTO stock_expiry_refresh_table (singleton) VALUES (TRUE);
+
+-- A pharmacy's in-stock batches by expiry, for the refresh and the report's batch list
+CREATE INDEX idx_stock_pharmacy_expiry ON pharmacy_stock_table(pharmacy_id, expiry_date) WHERE quantity_available > 0;
+
+CREATE OR REPLACE FUNCTION mark_stock_expiry_dirty() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO stock_expiry_dirty_table (pharmacy_id) VALUES (NEW.pharmacy_id) ON CONFLICT DO NOTHING;
+    END IF;
+    IF TG_OP = 'DELETE' OR OLD.pharmacy_id <> NEW.pharmacy_id THEN
+        INSERT INTO stock_expiry_dirty_table (pharmacy_id) VALUES (OLD.pharmacy_id) ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER pharmacy_stock_expiry_dirty
+    AFTER INSERT OR DELETE OR UPDATE OF pharmacy_id, quantity_available, expiry_date, price
+    ON pharmacy_stock_table
+    FOR EACH ROW EXECUTE FUNCTION mark_stock_expiry_dirty();
+
+-- Recompute the summary of the pharmacies marked dirty, or of every pharmacy with stock expiring
+-- in the next 90 days when asked to or when the day has changed since the last full rebuild.
+-- Returns how many pharmacies were recomputed, or -1 if another refresh is running.
+CREATE OR REPLACE FUNCTION refresh_stock_expiry_summary(full_refresh BOOLEAN DEFAULT FALSE)
+RETURNS INTEGER AS $$
+DECLARE
+    targets INTEGER[];
+BEGIN
+    SELECT full_refresh OR full_refresh_date IS DISTINCT FROM CURRENT_DATE INTO full_refresh
+        FROM stock_expiry_refresh_table FOR UPDATE SKIP LOCKED;
+    IF NOT FOUND THEN
+        RETURN -1;
+    END IF;
+
+    IF full_refresh THEN
+        DELETE FROM stock_expiry_dirty_table;
+        DELETE FROM stock_expiry_summary_table;
+        -- Served by idx_stock_expiry: only batches near or past expiry are read
+        SELECT array_agg(DISTINCT pharmacy_id) INTO targets FROM pharmacy_stock_table
+            WHERE expiry_date < CURRENT_DATE + 90 AND quantity_available > 0;
+    ELSE
+        WITH claimed AS (DELETE FROM stock_expiry_dirty_table RETURNING pharmacy_id)
+        SELECT array_agg(pharmacy_id) INTO targets FROM claimed;
+        DELETE FROM stock_expiry_summary_table WHERE pharmacy_id = ANY(targets);
+    END IF;
+
+    IF targets IS NOT NULL THEN
+        INSERT INTO stock_expiry_summary_table
+            (pharmacy_id, window_days, medicine_count, batch_count, quantity, value_at_risk, earliest_expiry, as_of)
+        SELECT s.pharmacy_id, w.days, COUNT(DISTINCT s.medicine_id), COUNT(*), SUM(s.quantity_available),
+               SUM(s.price * s.quantity_available), MIN(s.expiry_date), CURRENT_DATE
+        FROM pharmacy_stock_table s
+        JOIN (VALUES (0), (30), (60), (90)) AS w(days)
+          ON CASE WHEN w.days = 0 THEN s.expiry_date < CURRENT_DATE
+                  ELSE s.expiry_date >= CURRENT_DATE AND s.expiry_date < CURRENT_DATE + w.days END
+        WHERE s.pharmacy_id = ANY(targets) AND s.quantity_available > 0 AND s.expiry_date < CURRENT_DATE + 90
+        GROUP BY s.pharmacy_id, w.days;
+    END IF;
+
+    UPDATE stock_expiry_refresh_table SET
+        refreshed_at = CURRENT_TIMESTAMP,
+        full_refresh_date = CASE WHEN full_refresh THEN CURRENT_DATE ELSE full_refresh_date END;
+    RETURN COALESCE(cardinality(targets), 0);
+END;
+$$ LANGUAGE plpgsql;
+
 -- Create updated_at trigger function
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
@@ -0,0 +1,230 @@
+"""PostgreSQL connection pool for the psycopg2 backend (app_new.py)"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the checkout timeout"""
+
+
+class PooledConnection:
+    """Wrapper around a borrowed connection; close() hands it back to the pool"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    @property
+    def released(self):
+        return self._conn is None
+
+    def close(self):
+        """Return the connection to the pool instead of closing the socket"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+    def discard(self):
+        """Drop a broken connection instead of returning it for reuse"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn, discard=True)
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError('connection already returned to the pool')
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """Thread-safe bounded pool of psycopg2 connections.
+
+    Connections are opened lazily up to ``maxconn`` and kept for reuse;
+    prewarm() opens ``minconn`` of them up front. Borrowers wait up to
+    ``timeout`` seconds for a free connection, and connections that sat idle
+    for longer than ``check_interval`` seconds are pinged before reuse.
+
+    A pool used in a forked child (gunicorn --preload) forgets the parent's
+    connections instead of sharing their sockets, and starts afresh.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, timeout=5.0, check_interval=30.0,
+                 connect=psycopg2.connect, **conn_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError('Invalid pool size: minconn=%s maxconn=%s' % (minconn, maxconn))
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._connect = connect
+        self._conn_kwargs = conn_kwargs
+
+        self._lock = threading.Condition()
+        self._idle = []          # [(conn, last_used_monotonic)]
+        self._in_use = set()     # id(conn) of borrowed connections
+        self._total = 0          # idle + in use + being opened
+        self._pid = os.getpid()
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'failed_health_checks': 0
+        }
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _check_pid(self):
+        # Called with the lock held; the parent's sockets are left to the parent
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle, self._in_use, self._total = [], set(), 0
+
+    def getconn(self):
+        """Borrow a raw connection, opening or waiting for one as needed"""
+        deadline = time.monotonic() + self.timeout
+        with self._lock:
+            self._check_pid()
+            waited = False
+            while True:
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._total < self.maxconn:
+                    conn, idle_since = None, None
+                    self._total += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout('No database connection available within %.1fs' % self.timeout)
+                if not waited:
+                    self._stats['waits'] += 1
+                    waited = True
+                self._lock.wait(remaining)
+
+        # Open or validate outside the lock so slow handshakes don't block others
+        if conn is not None and not self._is_healthy(conn, idle_since):
+            with self._lock:
+                self._stats['failed_health_checks'] += 1
+                self._stats['discarded'] += 1
+            self._close_quietly(conn)
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect(**self._conn_kwargs)
+            except Exception:
+                with self._lock:
+                    self._total -= 1
+                    self._lock.notify()
+                raise
+            with self._lock:
+                self._stats['created'] += 1
+
+        with self._lock:
+            self._in_use.add(id(conn))
+            self._stats['checkouts'] += 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Give a borrowed connection back, rolling back any open transaction"""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._lock:
+            if id(conn) not in self._in_use:
+                return
+            self._in_use.discard(id(conn))
+            if discard or conn.closed:
+                self._total -= 1
+                self._stats['discarded'] += 1
+                close = True
+            else:
+                self._idle.append((conn, time.monotonic()))
+                close = False
+            self._lock.notify()
+
+        if close:
+            self._close_quietly(conn)
+
+    def borrow(self):
+        """Borrow a connection wrapped so that close() returns it to the pool"""
+        return PooledConnection(self, self.getconn())
+
+    @contextmanager
+    def connection(self):
+        """Context manager yielding a pooled connection, always returned on exit"""
+        conn = self.borrow()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def prewarm(self):
+        """Open connections until ``minconn`` are idle"""
+        opened = []
+        try:
+            while len(opened) < self.minconn:
+                with self._lock:
+                    if len(self._idle) + len(opened) >= self.minconn or self._total >= self.maxconn:
+                        break
+                opened.append(self.getconn())
+        finally:
+            for conn in opened:
+                self.putconn(conn)
+
+    def closeall(self):
+        """Close every idle connection; borrowed ones are closed on return"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Snapshot of pool utilisation for health checks"""
+        with self._lock:
+            in_use = len(self._in_use)
+            return dict(self._stats, **{
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'size': self._total,
+                'in_use': in_use,
+                'idle': len(self._idle),
+                'utilisation': round(in_use / self.maxconn, 3)
+            })
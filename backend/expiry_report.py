@@ -0,0 +1,87 @@
+"""Expiry report: stock expiring soon and its value, per pharmacy.
+
+The figures live in stock_expiry_summary_table, which the database function
+refresh_stock_expiry_summary() keeps current: a trigger queues pharmacies
+whose stock changes, each refresh recomputes only those, and once a day
+everything is recomputed because the windows move with the date. An
+ExpiryReportRefresher thread per worker calls it every few minutes, so a
+report request reads a handful of summary rows instead of the stock table.
+"""
+import threading
+import time
+
+EXPIRY_WINDOWS = (30, 60, 90)
+EXPIRED = 0
+
+
+def summarize(rows):
+    """The report for one pharmacy from its stock_expiry_summary_table rows"""
+    by_window = {row['window_days']: row for row in rows}
+
+    def section(days):
+        row = by_window.get(days)
+        if not row:
+            return {'medicine_count': 0, 'batch_count': 0, 'quantity': 0, 'value_at_risk': 0,
+                    'earliest_expiry': None}
+        return {
+            'medicine_count': row['medicine_count'],
+            'batch_count': row['batch_count'],
+            'quantity': row['quantity'],
+            'value_at_risk': row['value_at_risk'],
+            'earliest_expiry': row['earliest_expiry'].isoformat() if row['earliest_expiry'] else None
+        }
+
+    as_of = max((row['as_of'] for row in rows), default=None)
+    refreshed_at = max((row['refreshed_at'] for row in rows), default=None)
+    return {
+        'as_of': as_of.isoformat() if as_of else None,
+        'refreshed_at': refreshed_at.isoformat() if refreshed_at else None,
+        'expired': section(EXPIRED),
+        'windows': [dict(section(days), days=days) for days in EXPIRY_WINDOWS]
+    }
+
+
+class ExpiryReportRefresher(threading.Thread):
+    """Daemon thread calling `refresh()` on start and then every `interval` seconds.
+
+    `refresh()` returns how many pharmacies it recomputed, or -1 when another
+    worker's refresh was already running (that run counts as skipped).
+    """
+
+    def __init__(self, refresh, interval=300.0):
+        super().__init__(name='expiry-report-refresh', daemon=True)
+        self.refresh = refresh
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {'runs': 0, 'skipped': 0, 'pharmacies_refreshed': 0, 'errors': 0, 'last_run_ms': None}
+
+    def stop(self):
+        self._stopping.set()
+
+    def refresh_once(self):
+        start = time.perf_counter()
+        try:
+            refreshed = self.refresh()
+        except Exception as e:
+            print(f"Expiry report refresh error: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+            return None
+        with self._lock:
+            self._stats['runs'] += 1
+            if refreshed < 0:
+                self._stats['skipped'] += 1
+            else:
+                self._stats['pharmacies_refreshed'] += refreshed
+            self._stats['last_run_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return refreshed
+
+    def run(self):
+        while not self._stopping.is_set():
+            self.refresh_once()
+            self._stopping.wait(self.interval)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, interval=self.interval)
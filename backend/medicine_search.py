@@ -0,0 +1,170 @@
+"""Typo-tolerant, ranked medicine search.
+
+app_new.py searches PostgreSQL directly with pg_trgm (see the trigram indexes
+in database_setup.sql). The SQLAlchemy build in app.py runs on SQLite, so it
+keeps an FTS5 table with the trigram tokenizer in sync with `medicine` via
+triggers, pulls candidates that share trigrams with the query, and ranks them
+here with the same similarity measure pg_trgm uses.
+"""
+import re
+
+FTS_TABLE = 'medicine_fts'
+SEARCH_RESULT_LIMIT = 50
+CANDIDATE_LIMIT = 200
+MIN_RELEVANCE = 0.3
+
+# Column order matters: bm25() weights below and rank() take the same order
+FTS_COLUMNS = ('name', 'generic_name', 'manufacturer', 'category')
+FIELD_WEIGHTS = (1.0, 0.9, 0.4, 0.5)
+
+SQLITE_FTS_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        name, generic_name, manufacturer, category,
+        content='medicine', content_rowid='rowid', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER medicine_fts_insert AFTER INSERT ON medicine BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, generic_name, manufacturer, category)
+        VALUES (new.rowid, new.name, new.generic_name, new.manufacturer, new.category);
+    END""",
+    f"""CREATE TRIGGER medicine_fts_delete AFTER DELETE ON medicine BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, generic_name, manufacturer, category)
+        VALUES ('delete', old.rowid, old.name, old.generic_name, old.manufacturer, old.category);
+    END""",
+    f"""CREATE TRIGGER medicine_fts_update AFTER UPDATE ON medicine BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, generic_name, manufacturer, category)
+        VALUES ('delete', old.rowid, old.name, old.generic_name, old.manufacturer, old.category);
+        INSERT INTO {FTS_TABLE}(rowid, name, generic_name, manufacturer, category)
+        VALUES (new.rowid, new.name, new.generic_name, new.manufacturer, new.category);
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+]
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def _words(text):
+    return _WORD_RE.findall(text.lower())
+
+
+def _trigrams(text):
+    """pg_trgm-style trigrams: each word padded with two leading and one trailing space"""
+    grams = set()
+    for word in _words(text):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    """Share of trigrams two strings have in common (0..1), as pg_trgm's similarity()"""
+    ta, tb = _trigrams(a), _trigrams(b)
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
+
+def field_score(query, text):
+    """How well `query` matches one field: prefix > substring > closest word"""
+    if not text:
+        return 0.0
+    query = query.strip().lower()
+    text = text.lower()
+    if text.startswith(query):
+        return 1.0
+    if query in text:
+        return 0.9
+    return max([similarity(query, text)] + [similarity(query, word) for word in _words(text)])
+
+
+def rank(query, rows, limit=None):
+    """Rank (id, name, generic_name, manufacturer, category) rows by relevance.
+
+    Returns (id, score) pairs, best first, dropping rows below MIN_RELEVANCE.
+    """
+    scored = []
+    for row in rows:
+        score = max(weight * field_score(query, value or '')
+                    for weight, value in zip(FIELD_WEIGHTS, row[1:]))
+        if score >= MIN_RELEVANCE:
+            scored.append((row[0], score, row[1] or ''))
+    scored.sort(key=lambda item: (-item[1], item[2]))
+    return [(medicine_id, score) for medicine_id, score, _ in scored[:limit]]
+
+
+def _query_trigrams(query):
+    """Unpadded trigrams in query order (as the FTS5 trigram tokenizer indexes them)"""
+    grams = []
+    for word in _words(query):
+        grams.extend(word[i:i + 3] for i in range(len(word) - 2))
+    return list(dict.fromkeys(grams))
+
+
+def fts_match_expression(query, fuzzy=False):
+    """FTS5 MATCH string for the query's trigrams, or None if the query is too short.
+
+    The exact form ANDs every trigram, i.e. a substring match. The fuzzy form
+    splits the trigrams into three runs and ORs the ANDed runs: one typo
+    damages at most three consecutive trigrams, so at least one run survives
+    intact while each run stays selective enough to avoid scanning most rows.
+    """
+    grams = ['"%s"' % gram.replace('"', '""') for gram in _query_trigrams(query)]
+    if not grams:
+        return None
+    if not fuzzy:
+        return ' AND '.join(grams)
+    size = max(1, -(-len(grams) // 3))
+    runs = [grams[i:i + size] for i in range(0, len(grams), size)]
+    return '{name generic_name} : (%s)' % ' OR '.join('(%s)' % ' AND '.join(run) for run in runs)
+
+
+def sqlite_fts_ready(connection):
+    """True if the FTS5 index and the triggers keeping it in sync exist"""
+    found = connection.exec_driver_sql(
+        "SELECT count(*) FROM sqlite_master WHERE (type = 'table' AND name = ?) "
+        "OR (type = 'trigger' AND name LIKE 'medicine_fts_%')", (FTS_TABLE,)
+    ).scalar()
+    return found == 4
+
+
+def ensure_sqlite_fts(connection):
+    """Create and populate the FTS5 index if missing; False if SQLite lacks trigram FTS5.
+
+    Run it at startup in a transaction that commits: the index is built
+    from `medicine`, so building it inside a request would be undone with
+    the request's rollback.
+    """
+    if sqlite_fts_ready(connection):
+        return True
+    try:
+        # A leftover index whose triggers went with a dropped `medicine` is stale
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        for statement in SQLITE_FTS_STATEMENTS:
+            connection.exec_driver_sql(statement)
+    except Exception as e:
+        print(f"Medicine FTS index unavailable, using LIKE search: {e}")
+        return False
+    return True
+
+
+def sqlite_candidates(connection, query, limit=CANDIDATE_LIMIT):
+    """Rows worth ranking for `query`: substring hits, or near misses if there are none"""
+    match = fts_match_expression(query)
+    if match is None:
+        prefix = query.strip() + '%'
+        return connection.exec_driver_sql(
+            "SELECT id, name, generic_name, manufacturer, category FROM medicine "
+            "WHERE name LIKE ? OR generic_name LIKE ? ORDER BY name LIMIT ?",
+            (prefix, prefix, limit)
+        ).fetchall()
+
+    sql = (
+        f"SELECT m.id, m.name, m.generic_name, m.manufacturer, m.category "
+        f"FROM {FTS_TABLE} JOIN medicine m ON m.rowid = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH ? "
+        f"ORDER BY bm25({FTS_TABLE}, 10.0, 9.0, 4.0, 5.0) LIMIT ?"
+    )
+    rows = connection.exec_driver_sql(sql, (match, limit)).fetchall()
+    if rows:
+        return rows
+    # No substring hit: most likely a typo, so widen to rows sharing a run of trigrams
+    return connection.exec_driver_sql(sql, (fts_match_expression(query, fuzzy=True), limit)).fetchall()
@@ -0,0 +1,146 @@
+"""In-memory prefix index behind /api/medicines/suggest.
+
+Medicine names, generic names and brand names are kept as a sorted list of
+(term, medicine_id) keys, so every term starting with a prefix is one
+contiguous slice found with bisect. The best suggestions for prefixes of up
+to three letters (the slices that can cover a large part of the catalogue) are
+precomputed and maintained on every change, so lookups touch at most a few
+hundred keys. Deleted medicines only leave the index with the next load().
+"""
+import bisect
+import heapq
+import threading
+
+
+def normalize(text):
+    """Lowercase and collapse whitespace so 'Paracetamol  500mg' == 'paracetamol 500mg'"""
+    return ' '.join((text or '').lower().split())
+
+
+class MedicineSuggestIndex:
+    """Thread-safe prefix index of medicines ranked by popularity"""
+
+    TERM_FIELDS = ('medicine_name', 'generic_name', 'brand_name')
+
+    def __init__(self, short_prefix_length=3, cached_suggestions=20):
+        self.short_prefix_length = short_prefix_length
+        self.cached_suggestions = cached_suggestions
+        self._lock = threading.RLock()
+        self._keys = []         # sorted [(term, medicine_id)]
+        self._medicines = {}    # medicine_id -> suggestion dict
+        self._terms = {}        # medicine_id -> terms indexed for it
+        self._top = {}          # short prefix -> best medicine ids, most popular first
+        self.last_updated_at = None
+
+    def __len__(self):
+        return len(self._medicines)
+
+    def _entry(self, row):
+        terms = {normalize(row.get(field)) for field in self.TERM_FIELDS}
+        terms.discard('')
+        medicine = {
+            'id': row['id'],
+            'name': row['medicine_name'],
+            'generic_name': row.get('generic_name'),
+            'brand_name': row.get('brand_name'),
+            'popularity': row.get('popularity') or 0
+        }
+        return medicine, terms
+
+    def _note_updated_at(self, row):
+        updated_at = row.get('updated_at')
+        if updated_at and (self.last_updated_at is None or updated_at > self.last_updated_at):
+            self.last_updated_at = updated_at
+
+    def _sort_key(self, medicine_id):
+        medicine = self._medicines[medicine_id]
+        return (-medicine['popularity'], medicine['name'].lower())
+
+    def _best(self, lo, hi, limit):
+        ids = {medicine_id for _, medicine_id in self._keys[lo:hi]}
+        return heapq.nsmallest(limit, ids, key=self._sort_key)
+
+    def _range(self, prefix):
+        lo = bisect.bisect_left(self._keys, (prefix,))
+        hi = bisect.bisect_left(self._keys, (prefix + '\uffff',), lo)
+        return lo, hi
+
+    def _refresh_top(self, prefixes):
+        for prefix in prefixes:
+            best = self._best(*self._range(prefix), self.cached_suggestions)
+            if best:
+                self._top[prefix] = best
+            else:
+                self._top.pop(prefix, None)
+
+    def _update_top(self, medicine_id, old_terms, new_terms):
+        """Patch cached top lists after one medicine changed, rescanning only when needed"""
+        new_prefixes = self._short_prefixes(new_terms)
+        for prefix in self._short_prefixes(old_terms) | new_prefixes:
+            cached = self._top.get(prefix, [])
+            was_cached = medicine_id in cached
+            if was_cached and prefix not in new_prefixes:
+                # It left this slice; something outside the cache may now qualify
+                self._refresh_top([prefix])
+                continue
+            if prefix not in new_prefixes:
+                continue
+            candidates = [i for i in cached if i != medicine_id] + [medicine_id]
+            candidates.sort(key=self._sort_key)
+            if was_cached and candidates.index(medicine_id) == len(candidates) - 1 \
+                    and len(candidates) >= self.cached_suggestions:
+                # It may have dropped below rows that were never cached
+                self._refresh_top([prefix])
+            else:
+                self._top[prefix] = candidates[:self.cached_suggestions]
+
+    def _short_prefixes(self, terms):
+        return {term[:n] for term in terms for n in range(1, self.short_prefix_length + 1) if len(term) >= n}
+
+    def load(self, rows):
+        """Replace the whole index (startup and periodic full rebuilds)"""
+        medicines, terms_by_id, keys = {}, {}, []
+        for row in rows:
+            medicine, terms = self._entry(row)
+            medicines[medicine['id']] = medicine
+            terms_by_id[medicine['id']] = terms
+            keys.extend((term, medicine['id']) for term in terms)
+        keys.sort()
+
+        with self._lock:
+            self._medicines, self._terms, self._keys = medicines, terms_by_id, keys
+            self._top = {}
+            self._refresh_top(self._short_prefixes(
+                term for terms in terms_by_id.values() for term in terms
+            ))
+            self.last_updated_at = None
+            for row in rows:
+                self._note_updated_at(row)
+
+    def upsert(self, row):
+        """Add or update one medicine without rebuilding the index"""
+        medicine, terms = self._entry(row)
+        with self._lock:
+            old_terms = self._terms.get(medicine['id'], set())
+            for term in old_terms - terms:
+                i = bisect.bisect_left(self._keys, (term, medicine['id']))
+                if i < len(self._keys) and self._keys[i] == (term, medicine['id']):
+                    del self._keys[i]
+            for term in terms - old_terms:
+                bisect.insort(self._keys, (term, medicine['id']))
+            self._medicines[medicine['id']] = medicine
+            self._terms[medicine['id']] = terms
+            self._update_top(medicine['id'], old_terms, terms)
+            self._note_updated_at(row)
+
+    def suggest(self, prefix, limit=10):
+        """Most popular medicines with a name, generic or brand starting with `prefix`"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            if len(prefix) <= self.short_prefix_length and limit <= self.cached_suggestions:
+                ids = self._top.get(prefix, [])[:limit]
+            else:
+                ids = self._best(*self._range(prefix), limit)
+            return [dict(self._medicines[medicine_id]) for medicine_id in ids]
@@ -0,0 +1,202 @@
+"""Push new rows to Server-Sent Events streams.
+
+Each worker keeps one NotificationBroker per kind of stream (notifications
+keyed by user, chat keyed by appointment). Open streams subscribe under
+their key and sleep until woken; a single PgNotificationListener thread per
+worker LISTENs on the channels that the table triggers NOTIFY (see
+database_setup.sql) and wakes the matching streams. Woken streams read their
+new rows themselves, so a NOTIFY only has to carry the key and missed
+wake-ups are harmless. An idle stream costs one thread and one Event, never
+a database connection.
+"""
+import json
+import select
+import threading
+import time
+
+import psycopg2
+
+from db_pool import PoolTimeout
+
+NOTIFY_CHANNEL = 'helio_notifications'
+CHAT_CHANNEL = 'helio_chat'
+STOCK_CHANNEL = 'helio_stock'
+
+
+class StreamLimitReached(Exception):
+    """This worker already serves its maximum number of open streams"""
+
+
+class Subscription:
+    """One open stream; wait() blocks until there may be something new"""
+
+    def __init__(self, broker, key):
+        self.broker = broker
+        self.key = key
+        self._event = threading.Event()
+
+    def wake(self):
+        self._event.set()
+
+    def wait(self, timeout):
+        """True if woken, False if `timeout` seconds passed quietly"""
+        woken = self._event.wait(timeout)
+        self._event.clear()
+        return woken
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class NotificationBroker:
+    """In-process pub/sub keyed by user or appointment id, capped at `max_streams` subscribers"""
+
+    def __init__(self, max_streams=500):
+        self.max_streams = max_streams
+        self._lock = threading.Lock()
+        self._subscribers = {}   # key -> set of Subscription
+        self._count = 0
+        self._stats = {'published': 0, 'delivered': 0, 'rejected': 0}
+
+    def subscribe(self, key):
+        key = str(key)
+        with self._lock:
+            if self._count >= self.max_streams:
+                self._stats['rejected'] += 1
+                raise StreamLimitReached(f'{self._count} streams already open')
+            subscription = Subscription(self, key)
+            self._subscribers.setdefault(key, set()).add(subscription)
+            self._count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.key)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.key]
+            self._count -= 1
+
+    def publish(self, key):
+        """Wake every stream open under `key` in this worker"""
+        with self._lock:
+            subscriptions = list(self._subscribers.get(str(key), ()))
+            self._stats['published'] += 1
+            self._stats['delivered'] += len(subscriptions)
+        for subscription in subscriptions:
+            subscription.wake()
+
+    def wake_all(self):
+        """Wake every stream, e.g. after the listener reconnects and may have missed NOTIFYs"""
+        with self._lock:
+            subscriptions = [s for group in self._subscribers.values() for s in group]
+        for subscription in subscriptions:
+            subscription.wake()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, open_streams=self._count, max_streams=self.max_streams,
+                        keys=len(self._subscribers))
+
+
+class PgNotificationListener(threading.Thread):
+    """Daemon thread relaying PostgreSQL NOTIFY payloads to brokers.
+
+    `routes` maps channel -> (broker, payload field holding the key); with a
+    field of None the broker is handed the whole decoded payload. Uses its
+    own connection rather than one from the pool, since it is held for the
+    life of the worker.
+    """
+
+    def __init__(self, conn_kwargs, routes, retry_seconds=5.0):
+        super().__init__(name='notification-listener', daemon=True)
+        self.conn_kwargs = conn_kwargs
+        self.routes = routes
+        self.retry_seconds = retry_seconds
+        self.connected = False
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                print(f"Notification listener error: {e}")
+            self.connected = False
+            self._stopping.wait(self.retry_seconds)
+
+    def _listen(self):
+        conn = psycopg2.connect(**self.conn_kwargs)
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            for channel in self.routes:
+                cursor.execute(f'LISTEN {channel}')
+            self.connected = True
+            # Anything sent while we were disconnected was lost; let streams re-check
+            for broker, _ in self.routes.values():
+                broker.wake_all()
+            while not self._stopping.is_set():
+                if select.select([conn], [], [], 5.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        broker, field = self.routes[notify.channel]
+                        payload = json.loads(notify.payload)
+                        broker.publish(payload if field is None else payload[field])
+                    except (ValueError, KeyError, TypeError):
+                        print(f"Ignoring malformed notification payload: {notify.payload!r}")
+        finally:
+            conn.close()
+
+
+def format_event(event_id, data, event='notification'):
+    """One SSE frame"""
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+def heartbeat():
+    """SSE comment line that keeps proxies from closing an idle stream"""
+    return f': heartbeat {int(time.time())}\n\n'
+
+
+def stream_events(subscription, fetch_after, last_id, heartbeat_seconds, max_seconds,
+                  event='notification', batch=100):
+    """SSE frames for one subscriber until `max_seconds` have passed.
+
+    fetch_after(last_id, batch) returns rows (dicts with an 'id') newer than
+    last_id, oldest first. The subscription is closed when the generator ends,
+    including when the client disconnects.
+    """
+    deadline = time.monotonic() + max_seconds
+    try:
+        # Clients reconnect after 3s, sending the last id they saw as Last-Event-ID
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < deadline:
+            while True:
+                rows = fetch_after(last_id, batch)
+                for row in rows:
+                    last_id = row['id']
+                    yield format_event(row['id'], dict(row), event)
+                if len(rows) < batch:
+                    break
+            # A timeout also re-checks, covering NOTIFYs lost while the listener was down
+            if not subscription.wait(heartbeat_seconds):
+                yield heartbeat()
+    except (psycopg2.Error, PoolTimeout) as e:
+        print(f"Event stream error: {e}")
+    finally:
+        subscription.close()
@@ -0,0 +1,65 @@
+"""Keyset (cursor) pagination helpers shared by the SQLAlchemy and psycopg2 backends.
+
+A cursor is the sort key of the last row on the previous page, JSON-encoded
+and base64url'd so clients treat it as opaque. The next page is fetched with
+``WHERE (sort key) > cursor ORDER BY sort key LIMIT n``, so the cost of a page
+does not depend on how deep into the table it is.
+"""
+import base64
+import binascii
+import json
+from collections import namedtuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+Page = namedtuple('Page', ['limit', 'after'])
+
+
+def encode_cursor(values):
+    """Encode the sort key of a row as an opaque cursor string"""
+    raw = json.dumps(list(values), default=str, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, converters):
+    """Decode a cursor, converting each key part with the matching converter"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeEncodeError):
+        raise ValueError('Malformed cursor')
+    if not isinstance(values, list) or len(values) != len(converters):
+        raise ValueError('Cursor does not match the listing order')
+    try:
+        return [convert(value) for convert, value in zip(converters, values)]
+    except (TypeError, ValueError):
+        raise ValueError('Cursor does not match the listing order')
+
+
+def get_page_args(args, converters, default_limit=DEFAULT_PAGE_SIZE, max_limit=MAX_PAGE_SIZE):
+    """Read ``limit``/``cursor`` query args.
+
+    Returns None when the client asked for neither (legacy unpaginated
+    response), otherwise a Page whose ``after`` is the decoded cursor or None
+    for the first page. Raises ValueError on bad input.
+    """
+    if 'limit' not in args and 'cursor' not in args:
+        return None
+    try:
+        limit = int(args.get('limit', default_limit))
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    cursor = args.get('cursor')
+    after = decode_cursor(cursor, converters) if cursor else None
+    return Page(min(limit, max_limit), after)
+
+
+def split_page(rows, limit, key):
+    """Drop the look-ahead row (queries fetch limit + 1) and build the next cursor"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
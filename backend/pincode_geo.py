@@ -0,0 +1,164 @@
+"""Offline PIN code geocoding and a grid index for nearest-pharmacy lookups.
+
+pincode_geo.csv bundles approximate post office coordinates for the area
+Helio serves (Punjab, Haryana, Delhi and neighbours). Point
+PINCODE_GEO_FILE at the full India Post directory (data.gov.in "All India
+Pincode Directory", which has pincode, latitude and longitude among its
+columns) to cover the whole country; the rows of one PIN code are averaged.
+
+A PIN code missing from the table is placed at the centroid of the known
+codes sharing its longest prefix, down to 3 digits (the sorting district),
+so a new post office still lands in the right district.
+
+GridIndex buckets points into cells of `cell_degrees` and answers k-nearest
+queries by scanning rings of cells outwards from the query point, stopping
+once no unscanned ring can hold anything closer than the k-th best so far.
+"""
+import csv
+import heapq
+import math
+import os
+import threading
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+MIN_PREFIX_DIGITS = 3
+DEFAULT_PINCODE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pincode_geo.csv')
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_coordinates(lat, lon):
+    """(latitude, longitude) as floats; ValueError unless both are finite and on the globe"""
+    lat, lon = float(lat), float(lon)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('latitude must be within ±90 and longitude within ±180')
+    return lat, lon
+
+
+def load_pincode_table(path):
+    """{pincode: (latitude, longitude)} from a CSV with pincode, latitude and longitude columns"""
+    sums = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        for row in reader:
+            pincode = (row.get('pincode') or '').strip()
+            try:
+                lat, lon = float(row['latitude']), float(row['longitude'])
+            except (KeyError, TypeError, ValueError):
+                continue  # the India Post file has NA for some offices
+            if len(pincode) != 6 or not pincode.isdigit() or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                continue
+            total = sums.setdefault(pincode, [0.0, 0.0, 0])
+            total[0] += lat
+            total[1] += lon
+            total[2] += 1
+    return {pincode: (lat / n, lon / n) for pincode, (lat, lon, n) in sums.items()}
+
+
+class PincodeLocator:
+    """PIN code -> (latitude, longitude, digits matched), read from `path` on first use"""
+
+    def __init__(self, path=DEFAULT_PINCODE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._points = None
+
+    def _load(self):
+        with self._lock:
+            if self._points is None:
+                table = load_pincode_table(self.path)
+                points = {pincode: (lat, lon, 6) for pincode, (lat, lon) in table.items()}
+                for digits in range(5, MIN_PREFIX_DIGITS - 1, -1):
+                    sums = {}
+                    for pincode, (lat, lon) in table.items():
+                        total = sums.setdefault(pincode[:digits], [0.0, 0.0, 0])
+                        total[0] += lat
+                        total[1] += lon
+                        total[2] += 1
+                    points.update((prefix, (lat / n, lon / n, digits)) for prefix, (lat, lon, n) in sums.items())
+                self._points = points
+            return self._points
+
+    def locate(self, pincode):
+        """Where a PIN code is, or None if neither it nor its district is known"""
+        pincode = (pincode or '').strip()
+        if len(pincode) != 6 or not pincode.isdigit():
+            return None
+        points = self._points or self._load()
+        for digits in range(6, MIN_PREFIX_DIGITS - 1, -1):
+            point = points.get(pincode[:digits])
+            if point:
+                return point
+        return None
+
+
+class GridIndex:
+    """(key, latitude, longitude) points bucketed into lat/long cells for k-nearest queries"""
+
+    def __init__(self, points, cell_degrees=0.25):
+        self.cell_degrees = cell_degrees
+        self._cells = {}
+        for key, lat, lon in points:
+            self._cells.setdefault(self._cell(lat, lon), []).append((key, lat, lon))
+        rows = [i for i, _ in self._cells] or [0]
+        cols = [j for _, j in self._cells] or [0]
+        self._bounds = (min(rows), max(rows), min(cols), max(cols))
+        self._count = sum(len(cell) for cell in self._cells.values())
+
+    def __len__(self):
+        return self._count
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def _ring(self, ci, cj, ring):
+        if ring == 0:
+            yield ci, cj
+            return
+        for j in range(cj - ring, cj + ring + 1):
+            yield ci - ring, j
+            yield ci + ring, j
+        for i in range(ci - ring + 1, ci + ring):
+            yield i, cj - ring
+            yield i, cj + ring
+
+    def _ring_distance_km(self, lat, ring):
+        """A lower bound on the distance from a point to anything in ring `ring` or beyond"""
+        gap = max(ring - 1, 0) * self.cell_degrees
+        # Along a meridian a degree is KM_PER_DEGREE; across, distances shrink with the
+        # cosine of the most polar latitude the ring reaches
+        polar = math.radians(min(abs(lat) + (ring + 1) * self.cell_degrees, 90.0))
+        across = EARTH_RADIUS_KM * math.cos(polar) * math.sin(math.radians(min(gap, 90.0)))
+        return min(gap * KM_PER_DEGREE, across)
+
+    def nearest(self, lat, lon, k=10, accept=None, max_km=None):
+        """Up to k (distance_km, key) pairs, nearest first (ties by key), of keys passing `accept(key)`"""
+        if not self._cells or k <= 0:
+            return []
+        ci, cj = self._cell(lat, lon)
+        min_i, max_i, min_j, max_j = self._bounds
+        last_ring = max(ci - min_i, max_i - ci, cj - min_j, max_j - cj)
+        best = []  # the k nearest so far, nearest first
+        for ring in range(0, last_ring + 1):
+            bound = self._ring_distance_km(lat, ring)
+            if (len(best) == k and bound > best[-1][0]) or (max_km is not None and bound > max_km):
+                break
+            found = []
+            for cell in self._ring(ci, cj, ring):
+                for key, plat, plon in self._cells.get(cell, ()):
+                    if accept is not None and not accept(key):
+                        continue
+                    distance = haversine_km(lat, lon, plat, plon)
+                    if max_km is not None and distance > max_km:
+                        continue
+                    if len(best) < k or (distance, key) < best[-1]:
+                        found.append((distance, key))
+            if found:
+                best = heapq.nsmallest(k, best + found)
+        return best
@@ -0,0 +1,178 @@
+"""Thread-safe in-memory prescription request store for app_demo.py.
+
+Requests are kept by id plus, for every status, a sorted list of their
+creation sequence numbers. Listing one status (the pharmacist's pending
+queue) therefore never looks at requests in other statuses, and a page is a
+bisect into that list. All access goes through one lock and callers only
+ever see copies. The store can optionally be snapshotted to a JSON file so a
+demo server keeps its requests across restarts.
+
+The store lives in one process, so the demo server must run a single worker
+when snapshotting: SnapshotWriter locks the snapshot file and a second
+process trying to use it gets SnapshotLocked instead of silently
+overwriting the first one's requests.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no lock, single worker is up to the operator
+    fcntl = None
+
+
+class PrescriptionRequestStore:
+    """Prescription requests indexed by id and by status"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._by_seq = {}      # seq -> request
+        self._seqs = []        # every seq, ascending
+        self._seq_by_id = {}   # request id -> seq
+        self._by_status = {}   # status -> sorted [seq]
+        self._next_seq = 1
+        self._version = 0      # bumped on every change, for snapshotting
+
+    def __len__(self):
+        return len(self._by_seq)
+
+    @property
+    def version(self):
+        return self._version
+
+    def _index(self, seq, request):
+        # seq is always larger than any stored so far, so _seqs stays sorted by appending
+        self._by_seq[seq] = request
+        self._seqs.append(seq)
+        self._seq_by_id[request['id']] = seq
+        bisect.insort(self._by_status.setdefault(request['status'], []), seq)
+
+    def add(self, request):
+        """Store a new request; returns a copy of it"""
+        with self._lock:
+            if request['id'] in self._seq_by_id:
+                raise ValueError(f"Prescription request {request['id']} already exists")
+            request = dict(request)
+            self._index(self._next_seq, request)
+            self._next_seq += 1
+            self._version += 1
+            return dict(request)
+
+    def get(self, request_id):
+        with self._lock:
+            seq = self._seq_by_id.get(request_id)
+            return dict(self._by_seq[seq]) if seq is not None else None
+
+    def update(self, request_id, **changes):
+        """Apply `changes` to one request, moving it between status indexes; None if unknown"""
+        with self._lock:
+            seq = self._seq_by_id.get(request_id)
+            if seq is None:
+                return None
+            request = self._by_seq[seq]
+            new_status = changes.get('status', request['status'])
+            if new_status != request['status']:
+                seqs = self._by_status[request['status']]
+                del seqs[bisect.bisect_left(seqs, seq)]
+                bisect.insort(self._by_status.setdefault(new_status, []), seq)
+            request.update(changes)
+            self._version += 1
+            return dict(request)
+
+    def count(self, status=None):
+        with self._lock:
+            return len(self._by_seq) if status is None else len(self._by_status.get(status, ()))
+
+    def page(self, status=None, limit=None, after=None):
+        """Requests in creation order, optionally of one status.
+
+        Returns (requests, last_seq) where `after` and last_seq are creation
+        sequence numbers usable as a keyset cursor; last_seq is None when
+        there are no more pages.
+        """
+        with self._lock:
+            seqs = self._seqs if status is None else self._by_status.get(status, [])
+            start = bisect.bisect_right(seqs, after) if after is not None else 0
+            end = len(seqs) if limit is None else start + limit
+            chosen = seqs[start:end]
+            requests = [dict(self._by_seq[seq]) for seq in chosen]
+            more = end < len(seqs)
+            return requests, (chosen[-1] if more and chosen else None)
+
+    def snapshot(self, path):
+        """Write every request to `path` as JSON (atomically, via a temporary file)"""
+        with self._lock:
+            data = {
+                'next_seq': self._next_seq,
+                'requests': [[seq, dict(request)] for seq, request in sorted(self._by_seq.items())]
+            }
+            version = self._version
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        return version
+
+    def load(self, path):
+        """Replace the contents with a snapshot written by snapshot(); False if there is none"""
+        if not os.path.exists(path):
+            return False
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        with self._lock:
+            self._by_seq, self._seqs, self._seq_by_id, self._by_status = {}, [], {}, {}
+            for seq, request in sorted(data['requests'], key=lambda item: item[0]):
+                self._index(seq, request)
+            self._next_seq = data['next_seq']
+            self._version += 1
+        return True
+
+
+class SnapshotLocked(RuntimeError):
+    """Another process is already snapshotting to this file"""
+
+
+class SnapshotWriter(threading.Thread):
+    """Daemon thread saving a store to disk every `interval` seconds when it changed.
+
+    Holds an exclusive lock on `path + '.lock'` for the life of the process;
+    raises SnapshotLocked if another process holds it.
+    """
+
+    def __init__(self, store, path, interval=10.0):
+        super().__init__(name='prescription-request-snapshot', daemon=True)
+        self.store = store
+        self.path = path
+        self.interval = interval
+        self._lock_file = open(f'{path}.lock', 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                raise SnapshotLocked(f'{path} is in use by another process; run the demo server with one worker')
+        self._saved_version = store.version
+
+    def load(self):
+        """Fill the store from the snapshot, if there is one"""
+        loaded = self.store.load(self.path)
+        self._saved_version = self.store.version
+        return loaded
+
+    def save_if_changed(self):
+        if self.store.version == self._saved_version:
+            return False
+        try:
+            self._saved_version = self.store.snapshot(self.path)
+        except OSError as e:
+            print(f"Prescription request snapshot error: {e}")
+            return False
+        return True
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.save_if_changed()
@@ -0,0 +1,59 @@
+"""Routing rare-medicine requests to the pharmacies most likely to help.
+
+A request is fanned out to a bounded set of candidates picked from the
+in-memory StockIndex, never by scanning pharmacies or stock:
+
+  1. pharmacies holding the medicine, nearest PIN code first;
+  2. then pharmacies near the patient (same PIN sorting district or city)
+     that could source it, up to the fan-out limit.
+
+app_new.py records the candidates in rare_medicine_candidates_table (one
+row per request and pharmacy, which is also each pharmacy's inbox),
+notifies them in one INSERT, and ranks the offers that come back with
+rank_offers().
+"""
+import re
+
+FANOUT_LIMIT = 25
+NEARBY_MIN_SHARED_DIGITS = 3
+
+PINCODE_RE = re.compile(r'\b(\d{6})\b')
+
+# Both are offers; on equal time and cost a firm can_source beats interested
+RESPONSE_ORDER = {'can_source': 0, 'interested': 1}
+
+
+def pincode_from_address(address):
+    """The last 6-digit PIN code in a free-text address, or None"""
+    found = PINCODE_RE.findall(address or '')
+    return found[-1] if found else None
+
+
+def select_candidates(index, medicine_id=None, pincode=None, city=None, delivery_only=False,
+                      limit=FANOUT_LIMIT):
+    """Up to `limit` pharmacy dicts to ask, each with a 'match' of 'in_stock' or 'nearby'"""
+    candidates = []
+    if medicine_id is not None:
+        for pharmacy in index.pharmacies_with(medicine_id, pincode=pincode, limit=limit,
+                                              delivery_only=delivery_only):
+            candidates.append(dict(pharmacy, match='in_stock'))
+    if len(candidates) < limit:
+        nearby = index.pharmacies_near(
+            pincode=pincode, city=city, limit=limit - len(candidates), delivery_only=delivery_only,
+            min_shared_digits=NEARBY_MIN_SHARED_DIGITS, exclude={c['id'] for c in candidates}
+        )
+        candidates.extend(dict(pharmacy, quantity_available=0, match='nearby') for pharmacy in nearby)
+    return candidates
+
+
+def rank_offers(responses):
+    """Offers (declines dropped) ordered fastest, then cheapest; unknown time or cost sorts last"""
+    offers = [dict(r) for r in responses if r['response_status'] in RESPONSE_ORDER]
+    offers.sort(key=lambda r: (
+        r['estimated_time_days'] is None, r['estimated_time_days'] or 0,
+        r['estimated_cost'] is None, r['estimated_cost'] or 0,
+        RESPONSE_ORDER[r['response_status']], r['created_at']
+    ))
+    for rank, offer in enumerate(offers, 1):
+        offer['rank'] = rank
+    return offers
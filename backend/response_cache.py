@@ -0,0 +1,116 @@
+"""In-process response cache with explicit invalidation.
+
+ResponseCache is a small LRU of ready-to-send response bodies with a TTL.
+Invalidation bumps a version number instead of walking the entries: every
+key is stored together with the version it was computed under, so entries
+from before the bump simply stop matching and age out of the LRU.
+
+Where the version lives is pluggable. LocalVersion keeps it in the process,
+which is enough for one worker. FileVersion keeps it in a file (its size,
+grown one byte per bump with O_APPEND, which is atomic), so every gunicorn
+worker on the host sees an invalidation made by any of them for the cost of
+one stat() per lookup. The TTL bounds staleness from writes that bypass the
+app entirely, such as SQL run by hand.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalVersion:
+    """Version counter private to this process"""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        return self._value
+
+    def bump(self):
+        with self._lock:
+            self._value += 1
+
+
+class FileVersion:
+    """Version counter shared by every process on the host through a file"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        open(path, 'ab').close()
+
+    def get(self):
+        try:
+            return os.stat(self.path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def bump(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, b'.')
+        finally:
+            os.close(fd)
+
+
+def version_from_env(name):
+    """FileVersion under RESPONSE_CACHE_DIR when that is set, else LocalVersion"""
+    directory = os.getenv('RESPONSE_CACHE_DIR')
+    if directory:
+        return FileVersion(os.path.join(directory, f'{name}.version'))
+    return LocalVersion()
+
+
+class ResponseCache:
+    """LRU of cached values keyed by request parameters, with a TTL and versioned invalidation"""
+
+    def __init__(self, name, maxsize=256, ttl=60.0, version=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = version or LocalVersion()
+        self._entries = OrderedDict()  # key -> (version, expires_at, value)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+    def get(self, key):
+        """Cached value for `key`, or None"""
+        version = self.version.get()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or entry[1] <= now:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[2]
+
+    def set(self, key, value, version):
+        """Store `value`, computed under `version` (read it with current_version() before computing)"""
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def current_version(self):
+        return self.version.get()
+
+    def invalidate(self):
+        """Drop everything cached so far, in this process and (with FileVersion) all others"""
+        self.version.bump()
+        with self._lock:
+            self._entries.clear()
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(self._stats, size=len(self._entries), maxsize=self.maxsize, ttl=self.ttl,
+                        hit_rate=round(self._stats['hits'] / lookups, 3) if lookups else None)
@@ -0,0 +1,127 @@
+"""Appointment slot computation using sorted interval arithmetic.
+
+Booked appointments become (start, end) intervals that are sorted and merged
+once. Slots are then walked in time order alongside a single pointer into the
+merged list, so computing slots for any number of days costs
+O(slots + appointments) rather than O(slots x appointments).
+"""
+import bisect
+import heapq
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+# Used when a doctor has no DoctorSchedule rows at all (schedules=None)
+DEFAULT_WORKING_HOURS = [(time(9, 0), time(17, 0))]
+
+
+def merge_intervals(intervals):
+    """Sort (start, end) pairs and merge the ones that overlap or touch"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def booked_intervals(appointments, default_minutes=30):
+    """Merged busy intervals from (start_datetime, duration_minutes) pairs"""
+    return merge_intervals(
+        (start, start + timedelta(minutes=duration or default_minutes))
+        for start, duration in appointments
+    )
+
+
+def overlaps(intervals, start, end):
+    """True if any (sorted, merged) interval overlaps [start, end)"""
+    i = bisect.bisect_left(intervals, (start,))
+    if i and intervals[i - 1][1] > start:
+        return True
+    return i < len(intervals) and intervals[i][0] < end
+
+
+def working_intervals(schedules, day):
+    """Working hours on `day` from (day_of_week, start_time, end_time) rows, 0=Monday"""
+    if schedules is not None:
+        hours = [(start, end) for day_of_week, start, end in schedules if day_of_week == day.weekday()]
+    else:
+        hours = DEFAULT_WORKING_HOURS
+    return merge_intervals(
+        (datetime.combine(day, start), datetime.combine(day, end)) for start, end in hours if start < end
+    )
+
+
+def free_intervals(working, busy):
+    """Parts of the (sorted, merged) working intervals not covered by busy intervals"""
+    free = []
+    i = 0
+    for start, end in working:
+        while i < len(busy) and busy[i][1] <= start:
+            i += 1
+        cursor = start
+        j = i
+        while j < len(busy) and busy[j][0] < end:
+            if busy[j][0] > cursor:
+                free.append((cursor, busy[j][0]))
+            cursor = max(cursor, busy[j][1])
+            j += 1
+        if cursor < end:
+            free.append((cursor, end))
+    return free
+
+
+def iter_slots(first_day, last_day, schedules, appointments, slot_minutes=30):
+    """Yield (slot_start, available) in time order for every day in the range.
+
+    A slot is available only if no booked interval overlaps any part of it,
+    so a 45 minute appointment blocks two 30 minute slots.
+    """
+    step = timedelta(minutes=slot_minutes)
+    busy = booked_intervals(appointments)
+    i = 0
+    day = first_day
+    while day <= last_day:
+        for work_start, work_end in working_intervals(schedules, day):
+            slot_start = work_start
+            while slot_start + step <= work_end:
+                slot_end = slot_start + step
+                while i < len(busy) and busy[i][1] <= slot_start:
+                    i += 1
+                yield slot_start, not (i < len(busy) and busy[i][0] < slot_end)
+                slot_start = slot_end
+        day += timedelta(days=1)
+
+
+def compute_slots(first_day, last_day, schedules, appointments, slot_minutes=30):
+    """Slots per day between first_day and last_day inclusive.
+
+    Returns [(day, [(slot_start, available), ...]), ...], one entry per day
+    even when the doctor does not work that day.
+    """
+    days = []
+    day = first_day
+    while day <= last_day:
+        days.append((day, []))
+        day += timedelta(days=1)
+    for slot_start, available in iter_slots(first_day, last_day, schedules, appointments, slot_minutes):
+        days[(slot_start.date() - first_day).days][1].append((slot_start, available))
+    return days
+
+
+def earliest_free_slots(first_day, last_day, doctors, slot_minutes=30, limit=10, not_before=None):
+    """Earliest free slots across several doctors, soonest first.
+
+    `doctors` maps doctor_id -> (schedules, appointments). Each doctor's slots
+    are generated lazily and merged with heapq, so only as many slots are
+    computed as it takes to fill `limit`. Ties go to the doctor listed first.
+    Returns (slot_start, doctor_id) pairs.
+    """
+    def free(order, doctor_id, schedules, appointments):
+        for slot_start, available in iter_slots(first_day, last_day, schedules, appointments, slot_minutes):
+            if available and (not_before is None or slot_start >= not_before):
+                yield slot_start, order, doctor_id
+
+    streams = [free(order, doctor_id, *data) for order, (doctor_id, data) in enumerate(doctors.items())]
+    return [(slot_start, doctor_id) for slot_start, _, doctor_id in islice(heapq.merge(*streams), limit)]
@@ -0,0 +1,267 @@
+"""In-memory index of which pharmacies have which medicine in stock.
+
+Loaded from pharmacy_availability_table (stock summed over batches, kept up
+to date by a trigger) and then patched in place from the helio_stock NOTIFY
+channel, so lookups never touch the database. The index holds
+
+  medicine_id -> {pharmacy_id: quantity available}
+  pincode prefix (1-6 digits) -> {pharmacy_id}
+  city (lower case) -> {pharmacy_id}
+
+and "near pincode X" ranks pharmacies by how many leading digits of their
+PIN code they share with X (6: same post office, 3: same sorting district,
+1: same postal region), walking from the longest shared prefix outwards and
+stopping as soon as enough pharmacies are found. Given a PincodeLocator,
+pharmacies are also placed on a GridIndex by PIN code for "nearest by
+distance" lookups.
+"""
+import heapq
+import threading
+import time
+
+from pincode_geo import GridIndex, haversine_km
+
+PINCODE_DIGITS = 6
+
+
+def shared_prefix(a, b):
+    n = 0
+    for x, y in zip(a or '', b or ''):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class StockIndex:
+    """Thread-safe medicine -> pharmacy availability index.
+
+    `loader()` returns (pharmacies, availability): pharmacy dicts with at
+    least id, pincode and delivery_available, and (pharmacy_id, medicine_id,
+    quantity_available) rows. It is called on first use, after wake_all()
+    (the NOTIFY listener reconnected, so updates may have been missed) and
+    every `max_age` seconds as a safety net.
+    """
+
+    def __init__(self, loader, max_age=900.0, locator=None):
+        self.loader = loader
+        self.max_age = max_age
+        self.locator = locator
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()
+        self._pharmacies = {}
+        self._stock = {}
+        self._by_prefix = {}
+        self._by_city = {}
+        self._locations = {}
+        self._grid = GridIndex(())
+        self._loaded_at = None
+        self._stale = True
+        self._replay = None  # changes published while a reload is querying
+        self._stats = {'loads': 0, 'updates': 0, 'lookups': 0}
+
+    # Loading and updates
+
+    def _fresh(self):
+        with self._lock:
+            return not self._stale and time.monotonic() - self._loaded_at < self.max_age
+
+    def ensure_loaded(self):
+        if self._fresh():
+            return
+        # One thread reloads; the others wait for it rather than querying too
+        with self._reload_lock:
+            if not self._fresh():
+                self.reload()
+
+    def reload(self):
+        # Query outside the lock so lookups keep being served from the old copy meanwhile;
+        # changes arriving during the query may predate or postdate it, so replay them after
+        with self._lock:
+            self._replay = []
+        try:
+            pharmacies, availability = self.loader()
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+        by_id = {pharmacy['id']: dict(pharmacy) for pharmacy in pharmacies}
+        stock = {}
+        for pharmacy_id, medicine_id, quantity in availability:
+            if quantity > 0 and pharmacy_id in by_id:
+                stock.setdefault(medicine_id, {})[pharmacy_id] = quantity
+        by_prefix, by_city = {}, {}
+        for pharmacy_id, pharmacy in by_id.items():
+            pincode = (pharmacy.get('pincode') or '').strip()
+            pharmacy['pincode'] = pincode
+            for n in range(1, min(len(pincode), PINCODE_DIGITS) + 1):
+                by_prefix.setdefault(pincode[:n], set()).add(pharmacy_id)
+            city = (pharmacy.get('city') or '').strip().lower()
+            if city:
+                by_city.setdefault(city, set()).add(pharmacy_id)
+        locations = {}
+        if self.locator is not None:
+            for pharmacy_id, pharmacy in by_id.items():
+                point = self.locator.locate(pharmacy['pincode'])
+                if point:
+                    locations[pharmacy_id] = point
+            unlocated = len(by_id) - len(locations)
+            if unlocated:
+                # Left out of nearest_with(); usually the PIN code table doesn't cover their region
+                print(f"Stock index: {unlocated} of {len(by_id)} pharmacies could not be located "
+                      f"from their PIN code ({self.locator.path})")
+        grid = GridIndex((pharmacy_id, lat, lon) for pharmacy_id, (lat, lon, _) in locations.items())
+        with self._lock:
+            self._pharmacies, self._stock = by_id, stock
+            self._by_prefix, self._by_city = by_prefix, by_city
+            self._locations, self._grid = locations, grid
+            self._loaded_at = time.monotonic()
+            self._stale = False
+            self._stats['loads'] += 1
+            replay, self._replay = self._replay, None
+            for change in replay:
+                self._apply(change)
+
+    def publish(self, change):
+        """Apply one helio_stock payload: {'pharmacy_id', 'medicine_id', 'available'}"""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append(change)
+            if self._loaded_at is not None:
+                self._apply(change)
+
+    def _apply(self, change):
+        with self._lock:
+            self._stats['updates'] += 1
+            pharmacy_id, medicine_id = change['pharmacy_id'], change['medicine_id']
+            if pharmacy_id not in self._pharmacies:
+                # A pharmacy registered since the last load
+                self._stale = True
+                return
+            holders = self._stock.setdefault(medicine_id, {})
+            if change['available'] > 0:
+                holders[pharmacy_id] = change['available']
+            else:
+                holders.pop(pharmacy_id, None)
+
+    def wake_all(self):
+        """Called by the NOTIFY listener after (re)connecting: changes may have been missed"""
+        with self._lock:
+            self._stale = True
+
+    # Lookups
+
+    def quantity(self, pharmacy_id, medicine_id):
+        self.ensure_loaded()
+        with self._lock:
+            return self._stock.get(medicine_id, {}).get(pharmacy_id, 0)
+
+    def pharmacies_with(self, medicine_id, pincode=None, min_quantity=1, limit=20,
+                        delivery_only=False, min_shared_digits=0):
+        """Pharmacies holding at least `min_quantity` of a medicine, nearest PIN codes first.
+
+        Returns dicts of the pharmacy's fields plus quantity_available and
+        shared_pincode_digits, ordered by shared prefix length, then quantity.
+        Without a pincode the ordering is by quantity alone.
+        """
+        self.ensure_loaded()
+        pincode = (pincode or '').strip()
+        with self._lock:
+            self._stats['lookups'] += 1
+            holders = self._stock.get(medicine_id, {})
+
+            def usable(pharmacy_id):
+                return (holders[pharmacy_id] >= min_quantity and
+                        (not delivery_only or self._pharmacies[pharmacy_id].get('delivery_available')))
+
+            chosen, seen = [], set()
+            for digits in range(min(len(pincode), PINCODE_DIGITS), max(min_shared_digits, 1) - 1, -1):
+                area = self._by_prefix.get(pincode[:digits], ())
+                # Iterate whichever side is smaller: pharmacies in the area or holders of the medicine
+                if len(area) < len(holders):
+                    tier = [p for p in area if p in holders and p not in seen and usable(p)]
+                else:
+                    tier = [p for p in holders if p in area and p not in seen and usable(p)]
+                tier.sort(key=lambda p: (-holders[p], p))
+                chosen.extend((p, digits) for p in tier)
+                seen.update(tier)
+                if len(chosen) >= limit:
+                    break
+            if len(chosen) < limit and min_shared_digits == 0:
+                rest = sorted((p for p in holders if p not in seen and usable(p)), key=lambda p: (-holders[p], p))
+                chosen.extend((p, shared_prefix(pincode, self._pharmacies[p]['pincode'])) for p in rest)
+
+            return [dict(self._pharmacies[p], quantity_available=holders[p], shared_pincode_digits=digits)
+                    for p, digits in chosen[:limit]]
+
+    def pharmacies_near(self, pincode=None, city=None, limit=20, delivery_only=False,
+                        min_shared_digits=3, exclude=()):
+        """Pharmacies near a PIN code or in a city, whatever they stock.
+
+        Walks PIN prefix tiers down to `min_shared_digits`, then adds the rest
+        of `city`; within a tier, pharmacies in `city` come first. Returns
+        pharmacy dicts plus shared_pincode_digits, skipping ids in `exclude`.
+        """
+        self.ensure_loaded()
+        pincode = (pincode or '').strip()
+        city = (city or '').strip().lower()
+        with self._lock:
+            self._stats['lookups'] += 1
+            in_city = self._by_city.get(city, set())
+
+            def usable(pharmacy_id):
+                return (pharmacy_id not in exclude and
+                        (not delivery_only or self._pharmacies[pharmacy_id].get('delivery_available')))
+
+            chosen, seen = [], set()
+            tiers = [(self._by_prefix.get(pincode[:digits], ()), digits)
+                     for digits in range(min(len(pincode), PINCODE_DIGITS), max(min_shared_digits, 1) - 1, -1)]
+            tiers.append((in_city, None))
+            for area, digits in tiers:
+                tier = sorted((p for p in area if p not in seen and usable(p)), key=lambda p: (p not in in_city, p))
+                chosen.extend((p, digits) for p in tier)
+                seen.update(tier)
+                if len(chosen) >= limit:
+                    break
+
+            return [dict(self._pharmacies[p], shared_pincode_digits=(
+                        digits if digits is not None else shared_prefix(pincode, self._pharmacies[p]['pincode'])))
+                    for p, digits in chosen[:limit]]
+
+    def nearest_with(self, medicine_id, latitude, longitude, k=10, min_quantity=1,
+                     delivery_only=False, max_km=None):
+        """The k pharmacies nearest a point holding at least `min_quantity` of a medicine.
+
+        Returns pharmacy dicts plus quantity_available, distance_km and
+        location_precision (PIN code digits the pharmacy was placed by).
+        Pharmacies whose PIN code could not be located are left out.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            self._stats['lookups'] += 1
+            holders = self._stock.get(medicine_id, {})
+
+            def usable(pharmacy_id):
+                return (holders.get(pharmacy_id, 0) >= min_quantity and pharmacy_id in self._locations and
+                        (not delivery_only or self._pharmacies[pharmacy_id].get('delivery_available')))
+
+            # The grid finds the k nearest among the holders after visiting about
+            # k * pharmacies / holders points; measuring every holder costs len(holders)
+            if len(holders) ** 2 <= k * len(self._grid):
+                distances = ((haversine_km(latitude, longitude, *self._locations[p][:2]), p)
+                             for p in holders if usable(p))
+                if max_km is not None:
+                    distances = (d for d in distances if d[0] <= max_km)
+                nearest = heapq.nsmallest(k, distances)
+            else:
+                nearest = self._grid.nearest(latitude, longitude, k, accept=usable, max_km=max_km)
+
+            return [dict(self._pharmacies[p], quantity_available=holders[p], distance_km=round(distance, 2),
+                         location_precision=self._locations[p][2])
+                    for distance, p in nearest]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pharmacies=len(self._pharmacies), located=len(self._locations),
+                        medicines=sum(1 for holders in self._stock.values() if holders),
+                        stale=self._stale)
@@ -0,0 +1,235 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+
+# A file rather than sqlite:// so concurrent requests get their own connections
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='helio-db-'), 'test.db'))
+os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp(prefix='helio-uploads-'))
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from app import app, db, User, Doctor, Patient, Appointment, DoctorSchedule
+
+# A Monday in the coming week, so slots are always in the future
+MONDAY = date.today() + timedelta(days=7 - date.today().weekday())
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def seed_doctor_with_appointments(count):
+    """Create one doctor with `count` appointments, each for a different patient"""
+    doctor_user = User(email=f'doctor{count}@demo.com', password_hash='x', user_type='doctor')
+    db.session.add(doctor_user)
+    db.session.flush()
+    doctor = Doctor(user_id=doctor_user.id, name='Dr. Priya Sharma', specialty='Pediatrics')
+    db.session.add(doctor)
+    db.session.flush()
+
+    start = datetime(2025, 1, 6, 9, 0)
+    for i in range(count):
+        patient_user = User(email=f'patient{count}_{i}@demo.com', password_hash='x', user_type='patient')
+        db.session.add(patient_user)
+        db.session.flush()
+        patient = Patient(user_id=patient_user.id, name=f'Patient {i}')
+        db.session.add(patient)
+        db.session.flush()
+        db.session.add(Appointment(
+            patient_id=patient.id,
+            doctor_id=doctor.id,
+            appointment_date=start + timedelta(minutes=30 * i)
+        ))
+    db.session.commit()
+    return create_access_token(identity=doctor_user.id)
+
+
+def count_queries(callback):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        result = callback()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return result, len(statements)
+
+
+def fetch_appointments(client, token):
+    db.session.expunge_all()
+    response = client.get('/api/appointments', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_appointment_listing_query_count_is_constant(client):
+    small_token = seed_doctor_with_appointments(3)
+    large_token = seed_doctor_with_appointments(40)
+    # The first request of the process also runs init_db(); keep that out of the count
+    fetch_appointments(client, small_token)
+
+    small, small_queries = count_queries(lambda: fetch_appointments(client, small_token))
+    large, large_queries = count_queries(lambda: fetch_appointments(client, large_token))
+
+    assert len(small) == 3
+    assert len(large) == 40
+    assert small_queries == large_queries
+    assert {row['doctor_name'] for row in large} == {'Dr. Priya Sharma'}
+    assert 'Unknown' not in {row['patient_name'] for row in large}
+
+
+def test_appointment_listing_keyset_pagination(client):
+    token = seed_doctor_with_appointments(7)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    seen = []
+    cursor = None
+    while True:
+        params = {'limit': 3}
+        if cursor:
+            params['cursor'] = cursor
+        response = client.get('/api/appointments', headers=headers, query_string=params)
+        assert response.status_code == 200
+        page = response.get_json()
+        assert len(page['appointments']) <= 3
+        seen.extend(row['appointment_date'] for row in page['appointments'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+
+    assert seen == sorted(seen)
+    assert len(seen) == len(set(seen)) == 7
+
+    response = client.get('/api/appointments', headers=headers, query_string={'cursor': 'not-a-cursor'})
+    assert response.status_code == 400
+
+
+def test_slots_respect_duration_and_schedule(client):
+    seed_doctor_with_appointments(0)
+    doctor = Doctor.query.first()
+    db.session.add(Appointment(
+        patient_id='p', doctor_id=doctor.id,
+        appointment_date=datetime(2025, 1, 6, 9, 30), duration_minutes=45
+    ))
+    db.session.commit()
+
+    slots = client.get('/api/appointments/slots', query_string={
+        'doctor_id': doctor.id, 'date': '2025-01-06'
+    }).get_json()
+    assert len(slots) == 16
+    assert [slot['available'] for slot in slots[:4]] == [True, False, False, True]
+
+    db.session.add(DoctorSchedule(doctor_id=doctor.id, day_of_week=0, start_time=time(10, 0), end_time=time(12, 0)))
+    db.session.commit()
+    response = client.get('/api/appointments/slots', query_string={
+        'doctor_id': doctor.id, 'start_date': '2025-01-06', 'end_date': '2025-01-07'
+    })
+    assert response.status_code == 200
+    monday, tuesday = response.get_json()['days']
+    assert [slot['time'] for slot in monday['slots']] == ['10:00', '10:30', '11:00', '11:30']
+    assert monday['slots'][0]['available'] is False
+    assert monday['free_intervals'] == [{'start': '10:15', 'end': '12:00'}]
+    assert tuesday['slots'] == []
+
+    response = client.get('/api/appointments/slots', query_string={
+        'doctor_id': doctor.id, 'start_date': '2025-01-06', 'end_date': '2025-03-06'
+    })
+    assert response.status_code == 400
+
+
+def test_first_available_merges_doctors_in_specialty(client):
+    doctors = []
+    for i, specialty in enumerate(['Cardiology', 'cardiology', 'Dermatology']):
+        user = User(email=f'cardio{i}@demo.com', password_hash='x', user_type='doctor')
+        db.session.add(user)
+        db.session.flush()
+        doctor = Doctor(user_id=user.id, name=f'Dr. {i}', specialty=specialty)
+        db.session.add(doctor)
+        doctors.append(doctor)
+    db.session.flush()
+    # Doctor 0 is booked 09:00-10:00, doctor 1 only works 09:30-12:00
+    db.session.add(Appointment(
+        patient_id='p', doctor_id=doctors[0].id,
+        appointment_date=datetime.combine(MONDAY, time(9, 0)), duration_minutes=60
+    ))
+    db.session.add(DoctorSchedule(doctor_id=doctors[1].id, day_of_week=0, start_time=time(9, 30), end_time=time(12, 0)))
+    db.session.commit()
+
+    response, queries = count_queries(lambda: client.get('/api/appointments/first-available', query_string={
+        'specialty': 'Cardiology', 'start_date': MONDAY.isoformat(),
+        'end_date': (MONDAY + timedelta(days=6)).isoformat(), 'limit': 4
+    }))
+    assert response.status_code == 200
+    slots = [(slot['doctor_name'], slot['time']) for slot in response.get_json()['slots']]
+    assert slots == [('Dr. 1', '09:30'), ('Dr. 0', '10:00'), ('Dr. 1', '10:00'), ('Dr. 0', '10:30')]
+    assert queries == 4
+
+    response = client.get('/api/appointments/first-available', query_string={
+        'specialty': 'Cardiology', 'consultation_type': 'house-call'
+    })
+    assert response.status_code == 400
+
+
+def seed_patients(count):
+    tokens = []
+    for i in range(count):
+        user = User(email=f'racer{i}@demo.com', password_hash='x', user_type='patient')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Patient(user_id=user.id, name=f'Racer {i}'))
+        tokens.append(create_access_token(identity=user.id))
+    db.session.commit()
+    return tokens
+
+
+def book(token, doctor_id, start, duration=30):
+    with app.test_client() as client:
+        return client.post('/api/appointments', headers={'Authorization': f'Bearer {token}'}, json={
+            'doctor_id': doctor_id, 'appointment_date': start, 'duration_minutes': duration
+        }).status_code
+
+
+def test_concurrent_bookings_for_one_slot_have_one_winner(client):
+    seed_doctor_with_appointments(0)
+    doctor_id = Doctor.query.first().id
+    tokens = seed_patients(200)
+
+    def attempt(token):
+        with app.app_context():
+            return book(token, doctor_id, f'{MONDAY}T10:00:00')
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        statuses = list(pool.map(attempt, tokens))
+
+    assert statuses.count(201) == 1
+    assert statuses.count(409) == len(tokens) - 1
+    assert Appointment.query.filter_by(doctor_id=doctor_id).count() == 1
+
+
+def test_overlapping_booking_and_holds_conflict(client):
+    seed_doctor_with_appointments(0)
+    doctor_id = Doctor.query.first().id
+    first, second = seed_patients(2)
+
+    assert book(first, doctor_id, f'{MONDAY}T10:00:00', 45) == 201
+    assert book(second, doctor_id, f'{MONDAY}T10:30:00') == 409
+    assert book(second, doctor_id, f'{MONDAY}T10:45:00') == 201
+
+    response = client.post('/api/appointments/holds', headers={'Authorization': f'Bearer {first}'}, json={
+        'doctor_id': doctor_id, 'appointment_date': f'{MONDAY}T12:00:00'
+    })
+    assert response.status_code == 201
+    assert book(second, doctor_id, f'{MONDAY}T12:00:00') == 409
+    assert book(first, doctor_id, f'{MONDAY}T12:00:00') == 201
@@ -0,0 +1,82 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from auth_offload import BoundedExecutor, ExecutorSaturated, LastLoginBatcher
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_executor_rejects_work_beyond_workers_plus_backlog():
+    executor = BoundedExecutor(max_workers=2, max_pending=1, name='test-bcrypt')
+    release = threading.Event()
+    futures = [executor.submit(release.wait, 5) for _ in range(3)]
+
+    with pytest.raises(ExecutorSaturated):
+        executor.submit(release.wait, 5)
+    assert executor.stats() == {'submitted': 3, 'rejected': 1, 'in_flight': 3, 'max_workers': 2, 'max_pending': 1}
+
+    release.set()
+    assert all(future.result(5) for future in futures)
+    assert wait_for(lambda: executor.stats()['in_flight'] == 0)
+    assert executor.run(sum, [1, 2, 3]) == 6
+
+
+def test_failed_tasks_free_their_slot():
+    executor = BoundedExecutor(max_workers=1, max_pending=0)
+    with pytest.raises(ZeroDivisionError):
+        executor.run(lambda: 1 / 0)
+    assert wait_for(lambda: executor.stats()['in_flight'] == 0)
+    assert executor.run(len, 'ok') == 2
+
+
+def test_batcher_flushes_on_interval_keeping_the_latest_login():
+    batches = []
+    batcher = LastLoginBatcher(batches.append, interval=0.05)
+    batcher.record(2, datetime(2026, 5, 1, 9, 0))
+    batcher.record(1, datetime(2026, 5, 1, 9, 1))
+    batcher.record(2, datetime(2026, 5, 1, 9, 2))
+
+    assert wait_for(lambda: batches)
+    assert batches[0] == [(1, datetime(2026, 5, 1, 9, 1)), (2, datetime(2026, 5, 1, 9, 2))]
+    batcher.close()
+
+
+def test_batcher_flushes_early_once_the_batch_is_full():
+    batches = []
+    batcher = LastLoginBatcher(batches.append, interval=60, max_batch=3)
+    for user_id in range(2):
+        batcher.record(user_id, datetime(2026, 5, 1))
+    time.sleep(0.1)
+    assert batches == []
+
+    batcher.record(2, datetime(2026, 5, 1))
+    assert wait_for(lambda: batches)
+    assert [user_id for user_id, _ in batches[0]] == [0, 1, 2]
+    batcher.close()
+
+
+def test_close_writes_what_is_left_and_failed_flushes_are_retried():
+    attempts = []
+
+    def flush(batch):
+        attempts.append(batch)
+        if len(attempts) == 1:
+            raise RuntimeError('connection lost')
+
+    batcher = LastLoginBatcher(flush, interval=60)
+    batcher.record(1, datetime(2026, 5, 1, 9, 0))
+    assert batcher.flush_now() == 0
+    batcher.record(1, datetime(2026, 5, 1, 9, 5))
+
+    assert batcher.close() == 1
+    assert attempts[-1] == [(1, datetime(2026, 5, 1, 9, 5))]
+    assert not batcher._thread.is_alive()
+    assert batcher.close() == 0
@@ -0,0 +1,128 @@
+import threading
+import time
+import uuid
+
+import psycopg2
+import pytest
+from flask_jwt_extended import create_access_token
+
+import app_new
+from app_new import app
+
+
+@pytest.fixture
+def appointment():
+    """A patient and doctor sharing one appointment; skips without the PostgreSQL schema"""
+    try:
+        conn = psycopg2.connect(**app_new.DB_CONFIG)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f'PostgreSQL not reachable: {e}')
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('chat_messages_table') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        conn.close()
+        pytest.skip('database_setup.sql has not been loaded')
+
+    tag = uuid.uuid4().hex[:8]
+    logins = []
+    for role in ('patient', 'doctor', 'patient'):
+        cursor.execute("INSERT INTO login_table (username, password_hash, role) VALUES (%s, 'x', %s) RETURNING id",
+                       (f'chat-{role}-{tag}-{len(logins)}', role))
+        logins.append(cursor.fetchone()[0])
+    cursor.execute("INSERT INTO patients_table (login_id, patient_id, first_name, last_name) "
+                   "VALUES (%s, %s, 'Asha', 'Rao') RETURNING id", (logins[0], f'pc{tag}'))
+    patient_id = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO doctors_table (login_id, doctor_id, first_name, last_name, specialization) "
+                   "VALUES (%s, %s, 'Vikram', 'Nair', 'Cardiology') RETURNING id", (logins[1], f'dc{tag}'))
+    doctor_id = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO appointments_table (appointment_id, patient_id, doctor_id, appointment_date, "
+                   "appointment_time) VALUES (%s, %s, %s, CURRENT_DATE, '10:00') RETURNING id",
+                   (f'APT{tag}', patient_id, doctor_id))
+    appointment_id = cursor.fetchone()[0]
+    conn.commit()
+
+    with app.app_context():
+        tokens = {name: {'Authorization': f'Bearer {create_access_token(identity=str(login_id))}'}
+                  for name, login_id in zip(('patient', 'doctor', 'stranger'), logins)}
+    yield appointment_id, tokens
+
+    cursor.execute("DELETE FROM login_table WHERE id = ANY(%s)", (logins,))
+    conn.commit()
+    conn.close()
+
+
+def send(client, appointment_id, headers, content):
+    return client.post(f'/api/chat/{appointment_id}/messages', headers=headers, json={'message_content': content})
+
+
+def test_participants_send_and_page_through_history(appointment):
+    appointment_id, tokens = appointment
+    client = app.test_client()
+    for i in range(5):
+        response = send(client, appointment_id, tokens['patient' if i % 2 == 0 else 'doctor'], f'message {i}')
+        assert response.status_code == 201
+    assert response.get_json()['chat_message']['sender_role'] == 'patient'
+    assert send(client, appointment_id, tokens['stranger'], 'hello').status_code == 403
+    assert send(client, appointment_id, tokens['patient'], '').status_code == 400
+
+    seen, cursor = [], None
+    while True:
+        query = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+        response = client.get(f'/api/chat/{appointment_id}/messages', headers=tokens['doctor'], query_string=query)
+        assert response.status_code == 200
+        body = response.get_json()
+        seen.extend(m['message_content'] for m in body['messages'])
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    assert seen == [f'message {i}' for i in reversed(range(5))]
+
+    unread = client.get('/api/chat/unread', headers=tokens['patient']).get_json()
+    assert unread['unread'] == {str(appointment_id): 2}
+    response = client.post(f'/api/chat/{appointment_id}/read', headers=tokens['patient'])
+    assert response.get_json()['updated'] == 2
+    assert client.get('/api/chat/unread', headers=tokens['patient']).get_json()['total'] == 0
+
+
+def test_new_messages_reach_open_streams(appointment, monkeypatch):
+    appointment_id, tokens = appointment
+    monkeypatch.setattr(app_new, 'SSE_HEARTBEAT_SECONDS', 0.2)
+    monkeypatch.setattr(app_new, 'SSE_MAX_STREAM_SECONDS', 10)
+    client = app.test_client()
+    send(client, appointment_id, tokens['patient'], 'sent before the stream opened')
+
+    response = client.get(f'/api/chat/{appointment_id}/stream', headers=tokens['doctor'], buffered=False)
+    assert response.status_code == 200
+    frames = []
+
+    def read_until_delivered():
+        for chunk in response.response:
+            frames.append(chunk.decode())
+            if 'arrived live' in frames[-1]:
+                return
+
+    reader = threading.Thread(target=read_until_delivered, daemon=True)
+    reader.start()
+    deadline = time.monotonic() + 5
+    while not app_new.chat_broker.stats()['keys'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    while not app_new._notification_listener.connected and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    sent = send(client, appointment_id, tokens['patient'], 'arrived live').get_json()['chat_message']
+    reader.join(5)
+    assert not reader.is_alive()
+    response.close()
+
+    messages = [frame for frame in frames if frame.startswith('id: ')]
+    assert len(messages) == 1 and messages[0].startswith(f"id: {sent['id']}\nevent: message\n")
+    assert 'sent before the stream opened' not in ''.join(frames)
+    assert send(client, appointment_id, tokens['stranger'], 'x').status_code == 403
+    assert client.get(f'/api/chat/{appointment_id}/stream', headers=tokens['stranger']).status_code == 403
+
+
+def test_mark_read_rejects_a_non_integer_up_to_id():
+    with app.app_context():
+        headers = {'Authorization': f'Bearer {create_access_token(identity="1")}'}
+    response = app.test_client().post('/api/chat/1/read', headers=headers, json={'up_to_id': 'latest'})
+    assert response.status_code == 400
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    """Just enough of a psycopg2 connection for the pool"""
+
+    def __init__(self, number):
+        self.number = number
+        self.closed = 0
+        self.in_transaction = False
+        self.rollbacks = 0
+        self.healthy = True
+
+    def get_transaction_status(self):
+        return extensions.TRANSACTION_STATUS_INTRANS if self.in_transaction else extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql):
+                if not connection.healthy:
+                    raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+        return Cursor()
+
+    def close(self):
+        self.closed = 1
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect(**conn_kwargs):
+        opened.append(FakeConnection(len(opened) + 1))
+        return opened[-1]
+
+    return ConnectionPool(connect=connect, **kwargs), opened
+
+
+def test_connections_are_reused_and_rolled_back_on_return():
+    pool, opened = make_pool(maxconn=2)
+    with pool.connection() as conn:
+        opened[0].in_transaction = True
+        first = conn.number
+    with pool.connection() as conn:
+        assert conn.number == first
+    assert (len(opened), opened[0].rollbacks) == (1, 1)
+
+    conn = pool.borrow()
+    conn.close()
+    conn.close()  # a second close is a no-op
+    with pytest.raises(psycopg2.InterfaceError):
+        conn.cursor()
+    assert pool.stats()['idle'] == 1 and pool.stats()['in_use'] == 0
+
+
+def test_exhausted_pool_times_out_then_hands_over_on_return():
+    pool, opened = make_pool(maxconn=1, timeout=0.05)
+    held = pool.borrow()
+    with pytest.raises(PoolTimeout):
+        pool.borrow()
+    assert pool.stats()['timeouts'] == 1
+
+    pool.timeout = 5
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.borrow()))
+    waiter.start()
+    time.sleep(0.05)
+    held.close()
+    waiter.join(5)
+    assert got[0].number == 1 and len(opened) == 1
+    assert pool.stats()['waits'] == 2
+
+
+def test_discarded_and_unhealthy_connections_are_replaced():
+    pool, opened = make_pool(maxconn=1, check_interval=0)
+    conn = pool.borrow()
+    conn.discard()
+    assert opened[0].closed and pool.stats()['size'] == 0
+
+    with pool.connection():
+        pass
+    opened[1].healthy = False
+    with pool.connection() as conn:
+        assert conn.number == 3
+    stats = pool.stats()
+    assert (stats['failed_health_checks'], stats['discarded'], stats['created']) == (1, 2, 3)
+
+
+def test_failed_connect_frees_its_slot():
+    attempts = []
+
+    def connect(**kwargs):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise psycopg2.OperationalError('could not connect to server')
+        return FakeConnection(len(attempts))
+
+    pool = ConnectionPool(maxconn=1, timeout=0.05, connect=connect)
+    with pytest.raises(psycopg2.OperationalError):
+        pool.borrow()
+    assert pool.borrow().number == 2
+
+
+def test_prewarm_opens_minconn_idle_connections():
+    pool, opened = make_pool(minconn=3, maxconn=5)
+    pool.prewarm()
+    pool.prewarm()
+    assert len(opened) == 3 and pool.stats()['idle'] == 3
+
+
+def test_forked_child_does_not_reuse_the_parents_connections():
+    pool, opened = make_pool(minconn=2, maxconn=2)
+    pool.prewarm()
+    pool._pid -= 1  # as seen from a child after fork()
+    with pool.connection() as conn:
+        assert conn.number == 3
+    assert not any(c.closed for c in opened[:2])
+    assert pool.stats()['size'] == 1
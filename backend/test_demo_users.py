@@ -0,0 +1,69 @@
+import os
+import tempfile
+
+os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp(prefix='helio-uploads-'))
+
+import pytest
+
+import app_demo
+from app_demo import DEMO_USERS, DEMO_USERS_BY_ID, DEMO_USERS_BY_ROLE, find_demo_user, index_demo_user
+
+
+@pytest.fixture(autouse=True)
+def restore_demo_users():
+    saved = dict(DEMO_USERS), dict(DEMO_USERS_BY_ID), {role: dict(users) for role, users in DEMO_USERS_BY_ROLE.items()}
+    yield
+    for index, copy in zip((DEMO_USERS, DEMO_USERS_BY_ID, DEMO_USERS_BY_ROLE), saved):
+        index.clear()
+        index.update(copy)
+
+
+def assert_indexes_consistent():
+    assert DEMO_USERS_BY_ID == {str(user['id']): user for user in DEMO_USERS.values()}
+    by_role = {}
+    for user in DEMO_USERS.values():
+        by_role.setdefault(user['role'], {})[user['username']] = user
+    assert DEMO_USERS_BY_ROLE == by_role
+
+
+def user(username, id, role='patient'):
+    return {'id': id, 'username': username, 'password_hash': 'x', 'role': role, 'profile': {}}
+
+
+def test_built_in_and_synthetic_users_are_indexed():
+    assert_indexes_consistent()
+    app_demo.add_synthetic_demo_users(30)
+    assert_indexes_consistent()
+    assert len(DEMO_USERS_BY_ROLE['doctor']) == 2 + 10
+    assert find_demo_user(1001)['username'] == 'sd000001'
+    assert find_demo_user('1001', role='doctor') is not None
+    assert find_demo_user(1001, role='patient') is None
+
+
+def test_re_registering_replaces_the_old_entries():
+    index_demo_user(user('walkin', 9001))
+    index_demo_user(user('walkin', 9002))
+    assert_indexes_consistent()
+    assert find_demo_user(9001) is None and find_demo_user(9002)['username'] == 'walkin'
+
+
+def test_role_change_moves_the_user_between_roles():
+    index_demo_user(user('switcher', 9001, role='pharmacist'))
+    index_demo_user(user('switcher', 9001, role='doctor'))
+    assert_indexes_consistent()
+    assert 'switcher' not in DEMO_USERS_BY_ROLE['pharmacist']
+    assert find_demo_user(9001, role='pharmacist') is None
+
+    only = user('solo', 9003, role='admin')
+    index_demo_user(only)
+    index_demo_user(dict(only, role='patient'))
+    assert 'admin' not in DEMO_USERS_BY_ROLE
+    assert_indexes_consistent()
+
+
+def test_an_id_belongs_to_one_username():
+    index_demo_user(user('first', 9001))
+    with pytest.raises(ValueError):
+        index_demo_user(user('second', 9001))
+    assert 'second' not in DEMO_USERS
+    assert_indexes_consistent()
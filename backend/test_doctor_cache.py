@@ -0,0 +1,103 @@
+import os
+import tempfile
+
+# A file rather than sqlite:// so concurrent requests get their own connections
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='helio-db-'), 'test.db'))
+os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp(prefix='helio-uploads-'))
+
+import pytest
+from sqlalchemy import event
+
+from app import app, db, User, Doctor, doctor_cache
+from response_cache import FileVersion, ResponseCache
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.create_all()
+        doctor_cache.invalidate()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def add_doctor(name, specialty):
+    user = User(email=f'{name.lower().replace(" ", "")}@demo.com', password_hash='x', user_type='doctor')
+    db.session.add(user)
+    db.session.flush()
+    doctor = Doctor(user_id=user.id, name=name, specialty=specialty)
+    db.session.add(doctor)
+    db.session.commit()
+    return doctor
+
+
+def count_queries():
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    return statements
+
+
+def test_directory_is_served_from_cache_until_a_doctor_changes(client):
+    doctor = add_doctor('Dr. Asha Rao', 'Cardiology')
+    add_doctor('Dr. Vikram Nair', 'Dermatology')
+    statements = count_queries()
+
+    first = client.get('/api/doctors?specialty=cardio')
+    assert (first.headers['X-Cache'], [d['name'] for d in first.get_json()]) == ('MISS', ['Dr. Asha Rao'])
+    executed = len(statements)
+    again = client.get('/api/doctors?specialty=CARDIO')
+    assert (again.headers['X-Cache'], again.get_json()) == ('HIT', first.get_json())
+    assert len(statements) == executed
+    # Other parameters are cached separately
+    assert client.get('/api/doctors').headers['X-Cache'] == 'MISS'
+    assert client.get('/api/doctors?limit=1').get_json()['next_cursor'] is not None
+
+    doctor.is_available = False
+    doctor.specialty = 'Interventional Cardiology'
+    db.session.commit()
+    changed = client.get('/api/doctors?specialty=cardio')
+    assert changed.headers['X-Cache'] == 'MISS'
+    assert changed.get_json()[0]['specialty'] == 'Interventional Cardiology'
+
+    # Bulk updates bypass the unit of work but still invalidate
+    client.get('/api/doctors')
+    assert client.get('/api/doctors').headers['X-Cache'] == 'HIT'
+    User.query.filter_by(user_type='doctor').update({'is_active': False})
+    db.session.commit()
+    assert client.get('/api/doctors').get_json() == []
+
+    stats = client.get('/api/health').get_json()['doctor_cache']
+    assert stats['hits'] == 2 and stats['invalidations'] >= 2
+
+
+def test_rolled_back_changes_keep_the_cache(client):
+    doctor = add_doctor('Dr. Meera Iyer', 'Pediatrics')
+    client.get('/api/doctors')
+    doctor.name = 'Dr. M. Iyer'
+    db.session.flush()
+    db.session.rollback()
+    assert client.get('/api/doctors').headers['X-Cache'] == 'HIT'
+
+
+def test_file_version_invalidates_every_process_sharing_it(tmp_path):
+    path = str(tmp_path / 'doctors.version')
+    worker_a = ResponseCache('doctors', version=FileVersion(path))
+    worker_b = ResponseCache('doctors', version=FileVersion(path))
+    worker_b.set('all', b'[]', worker_b.current_version())
+    assert worker_b.get('all') == b'[]'
+
+    worker_a.invalidate()
+    assert worker_b.get('all') is None
+
+
+def test_lru_eviction_and_ttl():
+    cache = ResponseCache('test', maxsize=2, ttl=60)
+    for key in 'abc':
+        cache.set(key, key, cache.current_version())
+    assert (cache.get('a'), cache.get('c')) == (None, 'c')
+    assert cache.stats()['evictions'] == 1
+
+    expired = ResponseCache('test', ttl=0)
+    expired.set('a', 'a', expired.current_version())
+    assert expired.get('a') is None
@@ -0,0 +1,50 @@
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from expiry_report import ExpiryReportRefresher, summarize
+
+
+def row(window_days, batches, value, earliest):
+    return {'window_days': window_days, 'medicine_count': batches, 'batch_count': batches, 'quantity': batches * 10,
+            'value_at_risk': Decimal(value), 'earliest_expiry': earliest, 'as_of': date(2026, 5, 1),
+            'refreshed_at': datetime(2026, 5, 1, 9, 30)}
+
+
+def test_summary_rows_become_the_report():
+    report = summarize([row(0, 1, '40.00', date(2026, 4, 2)), row(90, 3, '930.50', date(2026, 5, 20)),
+                        row(60, 1, '300.00', date(2026, 5, 20))])
+
+    assert (report['as_of'], report['refreshed_at']) == ('2026-05-01', '2026-05-01T09:30:00')
+    assert report['expired']['value_at_risk'] == Decimal('40.00')
+    assert [(w['days'], w['batch_count'], w['value_at_risk'], w['earliest_expiry']) for w in report['windows']] == [
+        (30, 0, 0, None), (60, 1, Decimal('300.00'), '2026-05-20'), (90, 3, Decimal('930.50'), '2026-05-20')]
+
+
+def test_pharmacy_without_expiring_stock():
+    report = summarize([])
+    assert report['as_of'] is None and report['expired']['quantity'] == 0
+    assert [w['days'] for w in report['windows']] == [30, 60, 90]
+
+
+def test_refresher_counts_runs_skips_and_errors():
+    results = [12, -1, RuntimeError('connection lost'), 3]
+
+    def refresh():
+        result = results.pop(0) if results else 0
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    refresher = ExpiryReportRefresher(refresh, interval=0.01)
+    refresher.start()
+    deadline = time.monotonic() + 5
+    while results and time.monotonic() < deadline:
+        time.sleep(0.01)
+    refresher.stop()
+    refresher.join(5)
+
+    stats = refresher.stats()
+    assert not refresher.is_alive()
+    assert stats['runs'] >= 3 and (stats['skipped'], stats['errors']) == (1, 1)
+    assert stats['pharmacies_refreshed'] == 15
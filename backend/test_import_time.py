@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cumulative import time allowed per module, dependencies included. Flask and
+# SQLAlchemy alone take a few hundred milliseconds; anything near the budget
+# means import-time work (hashing, I/O, network) has crept in.
+IMPORT_TIME_BUDGET_SECONDS = float(os.getenv('IMPORT_TIME_BUDGET_SECONDS', '1.5'))
+
+MODULES = [
+    'app',
+    'app_new',
+    'app_demo',
+    'db_pool',
+    'pagination',
+    'medicine_search',
+    'medicine_suggest',
+    'slot_engine',
+    'notification_stream',
+    'auth_offload',
+    'upload_store',
+    'thumbnails',
+    'upload_sessions',
+    'upload_routes',
+    'response_cache',
+    'stock_index',
+    'reservations',
+    'rare_matcher',
+    'pincode_geo',
+    'expiry_report',
+]
+
+
+def import_time_seconds(module):
+    """Cumulative import time of `module` in a fresh interpreter, from python -X importtime"""
+    env = dict(os.environ, DATABASE_URL='sqlite://', PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, _, cumulative, name = [part.strip() for part in line.replace('import time:', '|', 1).split('|')]
+        if name == module:
+            return int(cumulative) / 1e6
+    raise AssertionError(f'No importtime entry for {module}')
+
+
+@pytest.mark.parametrize('module', MODULES)
+def test_import_time_within_budget(module):
+    seconds = import_time_seconds(module)
+    assert seconds < IMPORT_TIME_BUDGET_SECONDS, \
+        f'import {module} took {seconds:.2f}s (budget {IMPORT_TIME_BUDGET_SECONDS}s)'
@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+# A file rather than sqlite:// so concurrent requests get their own connections
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='helio-db-'), 'test.db'))
+os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp(prefix='helio-uploads-'))
+
+import pytest
+
+from app import app, db, init_db, Medicine
+import medicine_search
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        init_db()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def add_medicine(name, generic_name, category='Pain Relief'):
+    db.session.add(Medicine(name=name, generic_name=generic_name, manufacturer='Cipla', price=10.0,
+                            stock_quantity=50, category=category))
+    db.session.commit()
+
+
+def search(client, term):
+    response = client.get('/api/medicines', query_string={'search': term})
+    assert response.status_code == 200
+    return [m['name'] for m in response.get_json()]
+
+
+def test_index_survives_across_requests(client):
+    add_medicine('Paracetamol 500mg', 'Acetaminophen')
+    add_medicine('Amoxicillin 250mg', 'Amoxicillin', category='Antibiotic')
+
+    assert search(client, 'paracetmol') == ['Paracetamol 500mg']
+    assert search(client, 'amoxicilin') == ['Amoxicillin 250mg']
+    with db.engine.connect() as connection:
+        assert medicine_search.sqlite_fts_ready(connection)
+
+
+def test_index_follows_inserts_after_startup(client):
+    assert search(client, 'cetirizine') == []
+    add_medicine('Cetirizine 10mg', 'Cetirizine', category='Antihistamine')
+    assert search(client, 'cetirizine') == ['Cetirizine 10mg']
+
+
+def test_index_is_rebuilt_after_the_table_is_recreated(client):
+    add_medicine('Ibuprofen 400mg', 'Ibuprofen')
+    db.session.remove()
+    db.drop_all()
+    init_db()
+    add_medicine('Omeprazole 20mg', 'Omeprazole', category='Antacid')
+    assert search(client, 'ibuprofen') == []
+    assert search(client, 'omeprazol') == ['Omeprazole 20mg']
+
+
+def test_first_request_builds_the_index_without_init_db(client):
+    import app as app_module
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    app_module.db_initialised = False
+    add_medicine('Paracetamol 500mg', 'Acetaminophen')
+
+    assert search(client, 'paracetmol') == ['Paracetamol 500mg']
+    with db.engine.connect() as connection:
+        assert medicine_search.sqlite_fts_ready(connection)
@@ -0,0 +1,75 @@
+import random
+from datetime import datetime
+
+from medicine_suggest import MedicineSuggestIndex
+
+
+def medicine(medicine_id, name, popularity=0, generic_name=None, brand_name=None, updated_at=None):
+    return {'id': medicine_id, 'medicine_name': name, 'generic_name': generic_name, 'brand_name': brand_name,
+            'popularity': popularity, 'updated_at': updated_at}
+
+
+def names(suggestions):
+    return [s['name'] for s in suggestions]
+
+
+def test_prefix_matches_name_generic_and_brand():
+    index = MedicineSuggestIndex()
+    index.load([medicine(1, 'Crocin 500', generic_name='Paracetamol'),
+                medicine(2, 'Dolo 650', generic_name='Paracetamol', brand_name='Dolo'),
+                medicine(3, 'Pantocid 40', generic_name='Pantoprazole')])
+
+    assert names(index.suggest('para')) == ['Crocin 500', 'Dolo 650']
+    assert names(index.suggest('  DOLO ')) == ['Dolo 650']
+    assert names(index.suggest('pant')) == ['Pantocid 40']
+    assert index.suggest('xyz') == [] and index.suggest('') == []
+
+
+def test_ranked_by_popularity_then_name_and_limited():
+    index = MedicineSuggestIndex(short_prefix_length=2, cached_suggestions=3)
+    index.load([medicine(1, 'Amlodipine 5', 10), medicine(2, 'Amoxicillin 250', 50),
+                medicine(3, 'Amikacin 100', 10), medicine(4, 'Ambroxol 30', 5)])
+
+    assert names(index.suggest('am')) == ['Amoxicillin 250', 'Amikacin 100', 'Amlodipine 5', 'Ambroxol 30']
+    assert names(index.suggest('am', limit=2)) == ['Amoxicillin 250', 'Amikacin 100']
+    assert names(index.suggest('ami', limit=1)) == ['Amikacin 100']
+
+
+def test_upsert_updates_cached_prefixes():
+    index = MedicineSuggestIndex(short_prefix_length=2, cached_suggestions=2)
+    index.load([medicine(1, 'Cetirizine 10', 5), medicine(2, 'Cefixime 200', 3), medicine(3, 'Cefuroxime 500', 1)])
+    assert names(index.suggest('ce', limit=2)) == ['Cetirizine 10', 'Cefixime 200']
+
+    index.upsert(medicine(4, 'Ceftriaxone 1g', 9, updated_at=datetime(2026, 5, 1)))
+    assert names(index.suggest('ce', limit=2)) == ['Ceftriaxone 1g', 'Cetirizine 10']
+    assert index.last_updated_at == datetime(2026, 5, 1)
+
+    # Dropping out of the cached top list lets a row that was never cached back in
+    index.upsert(medicine(1, 'Cetirizine 10', 0))
+    assert names(index.suggest('ce', limit=2)) == ['Ceftriaxone 1g', 'Cefixime 200']
+    index.upsert(medicine(4, 'Zerodol 100', 9))
+    index.upsert(medicine(2, 'Zinc 50', 3))
+    assert names(index.suggest('ce', limit=2)) == ['Cefuroxime 500', 'Cetirizine 10']
+    assert names(index.suggest('z')) == ['Zerodol 100', 'Zinc 50'] and len(index) == 4
+
+
+def test_incremental_changes_match_a_full_rebuild():
+    rng = random.Random(7)
+    words = ['para', 'pan', 'pred', 'amox', 'aml', 'cef', 'cet', 'met', 'mon']
+
+    def random_medicine(medicine_id):
+        return medicine(medicine_id, f'{rng.choice(words)}{rng.choice(words)} {medicine_id}',
+                        rng.randint(0, 20), generic_name=rng.choice(words + [None]))
+
+    rows = {i: random_medicine(i) for i in range(60)}
+    index = MedicineSuggestIndex(cached_suggestions=5)
+    index.load(list(rows.values()))
+    for _ in range(300):
+        medicine_id = rng.randrange(80)
+        rows[medicine_id] = random_medicine(medicine_id)
+        index.upsert(rows[medicine_id])
+
+    rebuilt = MedicineSuggestIndex(cached_suggestions=5)
+    rebuilt.load(list(rows.values()))
+    for prefix in ['p', 'pa', 'par', 'a', 'am', 'c', 'ce', 'cef', 'm', 'me', 'mon', 'paraam']:
+        assert index.suggest(prefix, limit=5) == rebuilt.suggest(prefix, limit=5), prefix
@@ -0,0 +1,123 @@
+import json
+import os
+import time
+
+import psycopg2
+import pytest
+
+from notification_stream import NotificationBroker, PgNotificationListener, StreamLimitReached, stream_events
+
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'database': os.getenv('DB_NAME', 'helio_healthcare'),
+    'user': os.getenv('DB_USER', 'postgres'),
+    'password': os.getenv('DB_PASSWORD', ''),
+    'port': os.getenv('DB_PORT', '5432'),
+    'connect_timeout': 2,
+}
+
+
+def test_publish_wakes_only_streams_under_the_key():
+    broker = NotificationBroker(max_streams=3)
+    alice, alice_too, bob = broker.subscribe(1), broker.subscribe('1'), broker.subscribe(2)
+
+    broker.publish(1)
+    assert alice.wait(0) and alice_too.wait(0) and not bob.wait(0)
+    assert not alice.wait(0)  # a wake-up is consumed by the wait
+    with pytest.raises(StreamLimitReached):
+        broker.subscribe(3)
+
+    broker.wake_all()
+    assert bob.wait(0)
+    alice.close()
+    alice.close()
+    with bob:
+        pass
+    assert broker.stats() == {'published': 1, 'delivered': 2, 'rejected': 1, 'open_streams': 1,
+                              'max_streams': 3, 'keys': 1}
+
+
+def test_stream_sends_rows_in_batches_then_heartbeats_and_unsubscribes():
+    broker = NotificationBroker()
+    subscription = broker.subscribe(7)
+    rows = [{'id': i, 'title': f'Refill {i}'} for i in range(1, 6)]
+    calls = []
+
+    def fetch_after(last_id, batch):
+        calls.append(last_id)
+        return [row for row in rows if row['id'] > last_id][:batch]
+
+    frames = stream_events(subscription, fetch_after, 1, heartbeat_seconds=0.01, max_seconds=0.05, batch=2)
+    assert next(frames) == 'retry: 3000\n\n'
+    sent = [next(frames) for _ in range(4)]
+    assert [frame.split('\n')[0] for frame in sent] == ['id: 2', 'id: 3', 'id: 4', 'id: 5']
+    assert json.loads(sent[0].split('data: ')[1]) == {'id': 2, 'title': 'Refill 2'}
+    assert calls == [1, 3]
+
+    rest = list(frames)
+    assert rest and all(frame.startswith(': heartbeat') for frame in rest)
+    assert calls[:3] == [1, 3, 5] and set(calls[3:]) == {5}
+    assert broker.stats()['open_streams'] == 0
+
+
+def test_stream_ends_on_database_errors():
+    broker = NotificationBroker()
+
+    def fetch_after(last_id, batch):
+        raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+    frames = list(stream_events(broker.subscribe(7), fetch_after, 0, heartbeat_seconds=1, max_seconds=5))
+    assert frames == ['retry: 3000\n\n'] and broker.stats()['open_streams'] == 0
+
+
+def test_closing_the_stream_early_unsubscribes():
+    broker = NotificationBroker()
+    frames = stream_events(broker.subscribe(7), lambda last_id, batch: [], 0, heartbeat_seconds=1, max_seconds=5)
+    next(frames)
+    frames.close()
+    assert broker.stats()['open_streams'] == 0
+
+
+def test_listener_stops_while_retrying():
+    listener = PgNotificationListener(dict(DB_CONFIG, host='127.0.0.1', port=1), {}, retry_seconds=30)
+    listener.start()
+    time.sleep(0.1)
+    listener.stop()
+    listener.join(5)
+    assert not listener.is_alive() and not listener.connected
+
+
+def test_listener_relays_notify_payloads():
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f'PostgreSQL not reachable: {e}')
+    conn.autocommit = True
+    notifications, chat = NotificationBroker(), NotificationBroker()
+    received = []
+    chat.publish = lambda payload: received.append(payload)
+    listener = PgNotificationListener(DB_CONFIG, {'helio_test_notify': (notifications, 'user_id'),
+                                                  'helio_test_chat': (chat, None)})
+    subscription = notifications.subscribe(42)
+    listener.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not listener.connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert listener.connected
+        subscription.wait(0)  # the wake-up every stream gets on connect
+
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_notify('helio_test_notify', 'not json')")
+            cursor.execute("SELECT pg_notify('helio_test_notify', %s)", (json.dumps({'user_id': 42}),))
+            cursor.execute("SELECT pg_notify('helio_test_chat', %s)", (json.dumps({'appointment_id': 'a1'}),))
+        assert subscription.wait(5)
+        deadline = time.monotonic() + 5
+        while not received and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert received == [{'appointment_id': 'a1'}]
+    finally:
+        listener.stop()
+        listener.join(10)
+        conn.close()
+    assert not listener.is_alive()
@@ -0,0 +1,83 @@
+import threading
+import time
+import uuid
+from datetime import date
+
+import psycopg2
+import pytest
+
+import app_new
+
+
+@pytest.fixture
+def db():
+    """A pharmacy and a medicine with no stock yet; skips without the PostgreSQL schema"""
+    try:
+        conn = psycopg2.connect(**app_new.DB_CONFIG)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f'PostgreSQL not reachable: {e}')
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('pharmacy_availability_table') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        conn.close()
+        pytest.skip('database_setup.sql has not been loaded')
+
+    tag = uuid.uuid4().hex[:8]
+    cursor.execute("INSERT INTO login_table (username, password_hash, role) VALUES (%s, 'x', 'pharmacist') RETURNING id",
+                   (f'stock-{tag}',))
+    login_id = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO pharmacies_table (login_id, pharmacy_id, pharmacy_name, owner_name, address) "
+                   "VALUES (%s, %s, 'Test Pharmacy', 'Owner', 'Sector 17, Chandigarh') RETURNING id",
+                   (login_id, f'pm{tag}'))
+    pharmacy_id = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO medicines_table (medicine_name) VALUES (%s) RETURNING id", (f'Testamol {tag}',))
+    medicine_id = cursor.fetchone()[0]
+    conn.commit()
+    yield pharmacy_id, medicine_id
+
+    cursor.execute("DELETE FROM medicines_table WHERE id = %s", (medicine_id,))
+    cursor.execute("DELETE FROM login_table WHERE id = %s", (login_id,))
+    conn.commit()
+    conn.close()
+
+
+def availability(pharmacy_id, medicine_id):
+    with psycopg2.connect(**app_new.DB_CONFIG) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT quantity_available, batch_count FROM pharmacy_availability_table "
+                       "WHERE pharmacy_id = %s AND medicine_id = %s", (pharmacy_id, medicine_id))
+        row = cursor.fetchone()
+    conn.close()
+    return row
+
+
+def test_concurrent_first_batches_are_all_counted(db):
+    pharmacy_id, medicine_id = db
+    start = threading.Barrier(6)
+    errors = []
+
+    def add_batch(n):
+        conn = psycopg2.connect(**app_new.DB_CONFIG)
+        try:
+            start.wait()
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO pharmacy_stock_table (pharmacy_id, medicine_id, batch_number, expiry_date, "
+                    "quantity_available, price) VALUES (%s, %s, %s, %s, %s, 12.50)",
+                    (pharmacy_id, medicine_id, f'B{n}', date(2027, 1, n + 1), 10 * (n + 1))
+                )
+            # Hold the transaction open so the others insert while it is uncommitted
+            time.sleep(0.2)
+            conn.commit()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=add_batch, args=(n,)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert errors == []
+    assert availability(pharmacy_id, medicine_id) == (10 + 20 + 30 + 40 + 50 + 60, 6)
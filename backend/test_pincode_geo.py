@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+from pincode_geo import GridIndex, PincodeLocator, haversine_km, load_pincode_table, parse_coordinates
+
+
+def test_bundled_table_and_district_fallback():
+    locator = PincodeLocator()
+    assert locator.locate('147201')[2] == 6
+    # An unlisted Patiala-district office lands between the district's listed ones
+    lat, lon, digits = locator.locate('147999')
+    assert digits == 3 and 29.9 < lat < 30.7 and 76.1 < lon < 76.6
+    assert locator.locate('999999') is None
+    assert locator.locate('1472') is None
+    # Nabha to Patiala is about 23 km by air
+    assert 20 < haversine_km(*locator.locate('147201')[:2], *locator.locate('147001')[:2]) < 27
+
+
+def test_india_post_directory_format(tmp_path):
+    path = tmp_path / 'directory.csv'
+    path.write_text('circlename,regionname,officename,Pincode,Latitude,Longitude\n'
+                    'Punjab,Patiala,Nabha S.O,147201,30.3700,76.1500\n'
+                    'Punjab,Patiala,Nabha City B.O,147201,30.3800,76.1600\n'
+                    'Punjab,Patiala,Unmapped B.O,147202,NA,NA\n')
+    table = load_pincode_table(str(path))
+    assert list(table) == ['147201']
+    assert [round(x, 4) for x in table['147201']] == [30.375, 76.155]
+
+
+def test_grid_matches_brute_force():
+    rng = random.Random(3)
+    points = [(i, rng.uniform(8, 34), rng.uniform(69, 96)) for i in range(3000)]
+    grid = GridIndex(points, cell_degrees=0.5)
+    for _ in range(50):
+        lat, lon = rng.uniform(5, 37), rng.uniform(65, 100)
+        accepted = set(rng.sample(range(3000), rng.choice([20, 300, 3000])))
+        expected = sorted((haversine_km(lat, lon, plat, plon), key)
+                          for key, plat, plon in points if key in accepted)
+        assert grid.nearest(lat, lon, 7, accept=accepted.__contains__) == expected[:7]
+        assert grid.nearest(lat, lon, 7, max_km=150) == [
+            hit for hit in sorted((haversine_km(lat, lon, plat, plon), key) for key, plat, plon in points)[:7]
+            if hit[0] <= 150]
+    assert GridIndex(()).nearest(30.0, 76.0) == []
+
+
+def test_parse_coordinates_rejects_points_off_the_globe():
+    assert parse_coordinates('30.7333', '76.7794') == (30.7333, 76.7794)
+    for lat, lon in [('nan', '76.7'), ('30.7', 'inf'), ('-inf', '0'), ('90.5', '0'), ('0', '-180.1'), ('x', '0')]:
+        with pytest.raises(ValueError):
+            parse_coordinates(lat, lon)
@@ -0,0 +1,142 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# A file rather than sqlite:// so concurrent requests get their own connections
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='helio-db-'), 'test.db'))
+os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp(prefix='helio-uploads-'))
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app import app, db, init_db, User, Patient, PrescriptionRequest
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def seed_queue(count):
+    """`count` pending requests from one patient, oldest first"""
+    user = User(email='queue-patient@demo.com', password_hash='x', user_type='patient')
+    db.session.add(user)
+    db.session.flush()
+    patient = Patient(user_id=user.id, name='Queue Patient')
+    db.session.add(patient)
+    db.session.flush()
+    start = datetime(2025, 1, 6, 9, 0)
+    for i in range(count):
+        db.session.add(PrescriptionRequest(
+            patient_id=patient.id,
+            prescription_image_url=f'/uploads/rx{i}.png',
+            created_at=start + timedelta(minutes=i)
+        ))
+    db.session.commit()
+
+
+def pharmacist_tokens(count):
+    tokens = []
+    for i in range(count):
+        user = User(email=f'pharmacist{i}@demo.com', password_hash='x', user_type='pharmacist')
+        db.session.add(user)
+        db.session.flush()
+        tokens.append(create_access_token(identity=user.id))
+    db.session.commit()
+    return tokens
+
+
+def claim(token, count):
+    with app.test_client() as client:
+        response = client.post('/api/prescription-requests/claim',
+                               headers={'Authorization': f'Bearer {token}'}, json={'count': count})
+        assert response.status_code == 200
+        return [req['id'] for req in response.get_json()['requests']]
+
+
+def test_concurrent_claims_never_overlap(client):
+    seed_queue(30)
+    tokens = pharmacist_tokens(10)
+
+    def attempt(token):
+        with app.app_context():
+            return claim(token, 5)
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        claims = list(pool.map(attempt, tokens))
+
+    claimed = [request_id for ids in claims for request_id in ids]
+    assert len(claimed) == len(set(claimed)) == 30
+    # Claiming again returns what the pharmacist already holds instead of more work
+    assert claim(tokens[0], 5) == claims[0]
+
+
+def test_expired_claims_return_to_queue_and_processed_rows_leave_it(client):
+    seed_queue(2)
+    first, second = pharmacist_tokens(2)
+
+    held = claim(first, 1)
+    assert claim(second, 2) != held
+    assert len(claim(second, 2)) == 1
+
+    response = client.put(f'/api/prescription-requests/{held[0]}/status', json={'status': 'approved'})
+    assert response.status_code == 409
+
+    PrescriptionRequest.query.filter_by(id=held[0]).update({'claim_expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    assert held[0] in claim(second, 2)
+
+    response = client.put(f'/api/prescription-requests/{held[0]}/status',
+                          headers={'Authorization': f'Bearer {second}'}, json={'status': 'approved'})
+    assert response.status_code == 200
+    assert held[0] not in claim(second, 2)
+
+
+def test_init_db_migrates_tables_from_before_claims(client):
+    # The shape prescription_request had before claims, as create_all() left it in existing databases
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE prescription_request")
+        connection.exec_driver_sql("DROP INDEX uq_appointment_doctor_start")
+        connection.exec_driver_sql(
+            "CREATE TABLE prescription_request (id VARCHAR(36) PRIMARY KEY, patient_id VARCHAR(36) NOT NULL, "
+            "prescription_image_url VARCHAR(500) NOT NULL, notes TEXT, status VARCHAR(20), "
+            "created_at DATETIME, processed_at DATETIME, processed_by VARCHAR(100))"
+        )
+    init_db()
+    init_db()
+
+    with db.engine.connect() as connection:
+        columns = [row[1] for row in connection.exec_driver_sql("PRAGMA table_info(prescription_request)")]
+        indexes = {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'claimed_by', 'claim_expires_at'} <= set(columns)
+    assert {'ix_prescription_request_pending', 'uq_appointment_doctor_start'} <= indexes
+
+    seed_queue(2)
+    token, = pharmacist_tokens(1)
+    assert len(claim(token, 2)) == 2
+
+
+def test_only_pharmacists_can_claim(client):
+    seed_queue(1)
+    doctor = User(email='queue-doctor@demo.com', password_hash='x', user_type='doctor')
+    db.session.add(doctor)
+    db.session.commit()
+
+    response = client.post('/api/prescription-requests/claim',
+                           headers={'Authorization': f'Bearer {create_access_token(identity=doctor.id)}'},
+                           json={'count': 1})
+    assert response.status_code == 403
+
+
+def test_unpaginated_listing_is_capped(client, monkeypatch):
+    monkeypatch.setattr('app.MAX_PRESCRIPTION_LISTING', 3)
+    seed_queue(5)
+
+    response = client.get('/api/prescription-requests')
+    assert response.status_code == 200
+    assert [req['prescriptionImageUrl'] for req in response.get_json()] == [f'/uploads/rx{i}.png' for i in range(3)]
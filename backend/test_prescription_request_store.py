@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+from prescription_request_store import PrescriptionRequestStore, SnapshotLocked, SnapshotWriter
+
+
+def request(id, status='pending', **fields):
+    return dict({'id': id, 'status': status, 'patient_id': 'p001'}, **fields)
+
+
+def ids(requests):
+    return [r['id'] for r in requests]
+
+
+def test_status_indexes_follow_updates():
+    store = PrescriptionRequestStore()
+    for i in range(6):
+        store.add(request(f'r{i}'))
+    store.update('r1', status='approved', pharmacy_id='pm001')
+    store.update('r4', status='rejected')
+    store.update('r4', status='pending')
+
+    assert ids(store.page('pending')[0]) == ['r0', 'r2', 'r3', 'r4', 'r5']
+    assert ids(store.page('approved')[0]) == ['r1']
+    assert store.page('rejected') == ([], None)
+    assert (store.count(), store.count('pending'), store.count('approved')) == (6, 5, 1)
+    assert store.get('r1')['pharmacy_id'] == 'pm001'
+    assert store.update('missing', status='approved') is None and store.get('missing') is None
+    with pytest.raises(ValueError):
+        store.add(request('r0'))
+
+
+def test_pages_resume_after_the_cursor_and_return_copies():
+    store = PrescriptionRequestStore()
+    for i in range(5):
+        store.add(request(f'r{i}', status='approved' if i == 2 else 'pending'))
+
+    first, cursor = store.page('pending', limit=2)
+    second, cursor_after = store.page('pending', limit=2, after=cursor)
+    assert (ids(first), ids(second), cursor_after) == (['r0', 'r1'], ['r3', 'r4'], None)
+    assert ids(store.page(limit=4)[0]) == ['r0', 'r1', 'r2', 'r3']
+
+    first[0]['status'] = 'approved'
+    assert store.get('r0')['status'] == 'pending'
+
+
+def test_concurrent_adds_and_updates_keep_the_indexes_consistent():
+    store = PrescriptionRequestStore()
+
+    def worker(n):
+        for i in range(200):
+            store.add(request(f'w{n}-{i}'))
+            if i % 2:
+                store.update(f'w{n}-{i}', status='approved')
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert (store.count(), store.count('pending'), store.count('approved')) == (1600, 800, 800)
+    pending = store.page('pending')[0]
+    assert all(r['status'] == 'pending' for r in pending) and len(set(ids(pending))) == 800
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'requests.json')
+    store = PrescriptionRequestStore()
+    for i in range(3):
+        store.add(request(f'r{i}', medicines=[{'name': 'Dolo 650', 'quantity': i + 1}]))
+    store.update('r1', status='approved')
+    store.snapshot(path)
+
+    restored = PrescriptionRequestStore()
+    assert restored.load(path) and not PrescriptionRequestStore().load(str(tmp_path / 'none.json'))
+    assert restored.page() == store.page()
+    assert ids(restored.page('approved')[0]) == ['r1']
+    restored.add(request('r3'))
+    assert ids(restored.page()[0]) == ['r0', 'r1', 'r2', 'r3']
+
+
+def test_writer_saves_only_changes_and_owns_the_file(tmp_path):
+    path = str(tmp_path / 'requests.json')
+    store = PrescriptionRequestStore()
+    writer = SnapshotWriter(store, path)
+    assert not writer.load() and not writer.save_if_changed()
+    store.add(request('r0'))
+    assert writer.save_if_changed() and not writer.save_if_changed()
+
+    with pytest.raises(SnapshotLocked):
+        SnapshotWriter(PrescriptionRequestStore(), path)
+
+    writer._lock_file.close()  # as when the first process exits
+    restored = PrescriptionRequestStore()
+    second = SnapshotWriter(restored, path)
+    assert second.load() and ids(restored.page()[0]) == ['r0']
+    assert not second.save_if_changed()
@@ -0,0 +1,65 @@
+from datetime import datetime
+from decimal import Decimal
+
+from rare_matcher import pincode_from_address, rank_offers, select_candidates
+from stock_index import StockIndex
+
+PHARMACIES = [
+    {'id': 1, 'pharmacy_name': 'Kaur Medical Store', 'pincode': '147201', 'city': 'Nabha', 'delivery_available': False},
+    {'id': 2, 'pharmacy_name': 'Nabha Chemists', 'pincode': '147201', 'city': 'Nabha', 'delivery_available': True},
+    {'id': 3, 'pharmacy_name': 'Patiala Pharmacy', 'pincode': '147001', 'city': 'Patiala', 'delivery_available': True},
+    {'id': 4, 'pharmacy_name': 'Bhadson Medicos', 'pincode': '147202', 'city': 'Nabha', 'delivery_available': True},
+    {'id': 5, 'pharmacy_name': 'Ludhiana Meds', 'pincode': '141001', 'city': 'Ludhiana', 'delivery_available': True},
+    {'id': 6, 'pharmacy_name': 'Delhi Drug House', 'pincode': '110001', 'city': 'Delhi', 'delivery_available': True},
+]
+
+
+def make_index(availability):
+    return StockIndex(lambda: (PHARMACIES, availability))
+
+
+def matches(candidates):
+    return [(c['id'], c['match'], c['shared_pincode_digits']) for c in candidates]
+
+
+def test_holders_first_then_nearby_pharmacies_up_to_the_limit():
+    index = make_index([(6, 10, 2), (3, 10, 1)])
+
+    assert matches(select_candidates(index, 10, pincode='147201', limit=5)) == [
+        (3, 'in_stock', 3), (6, 'in_stock', 1), (1, 'nearby', 6), (2, 'nearby', 6), (4, 'nearby', 5)]
+    # Far-away pharmacies are only asked when they already hold the medicine
+    assert [c['id'] for c in select_candidates(index, 99, pincode='147201')] == [1, 2, 4, 3]
+    assert matches(select_candidates(index, 10, pincode='147201', delivery_only=True, limit=3)) == [
+        (3, 'in_stock', 3), (6, 'in_stock', 1), (2, 'nearby', 6)]
+
+
+def test_city_fills_in_when_the_pincode_is_unknown():
+    index = make_index([])
+
+    assert [c['id'] for c in select_candidates(index, 10, city=' nabha ')] == [1, 2, 4]
+    assert [c['id'] for c in select_candidates(index, None, pincode='147001', city='Nabha')] == [3, 1, 2, 4]
+    assert select_candidates(index, 10) == []
+
+
+def test_offers_ranked_fastest_then_cheapest():
+    def response(pharmacy_id, status, days, cost, minute=0):
+        return {'pharmacy_id': pharmacy_id, 'response_status': status, 'estimated_time_days': days,
+                'estimated_cost': None if cost is None else Decimal(cost), 'created_at': datetime(2026, 5, 1, 9, minute)}
+
+    offers = rank_offers([
+        response(1, 'interested', 3, '120.00'),
+        response(2, 'declined', 1, '10.00'),
+        response(3, 'can_source', 3, '95.50'),
+        response(4, 'interested', None, '50.00'),
+        response(5, 'can_source', 1, None),
+        response(6, 'interested', 3, '95.50', minute=1),
+        response(7, 'can_source', 3, '95.50', minute=2),
+    ])
+    assert [(o['pharmacy_id'], o['rank']) for o in offers] == [(5, 1), (3, 2), (7, 3), (6, 4), (1, 5), (4, 6)]
+
+
+def test_pincode_from_address():
+    assert pincode_from_address('House 12, Ward 4, Nabha, Punjab 147201') == '147201'
+    assert pincode_from_address('Plot 110001, Sector 5, 147001') == '147001'
+    assert pincode_from_address('Phone 9876543210') is None
+    assert pincode_from_address(None) is None
@@ -0,0 +1,53 @@
+import time
+from datetime import date
+
+import pytest
+
+from reservations import InsufficientStock, ReservationSweeper, allocate_fefo
+
+
+def batch(id, expiry, quantity):
+    return {'id': id, 'expiry_date': expiry, 'quantity_available': quantity}
+
+
+def test_earliest_expiring_batches_are_used_first():
+    batches = [batch(1, date(2027, 6, 1), 10), batch(2, date(2026, 12, 1), 4),
+               batch(3, date(2026, 12, 1), 0), batch(4, date(2026, 12, 1), 3)]
+
+    allocation = allocate_fefo(batches, 9)
+    assert [(b['id'], taken) for b, taken in allocation] == [(2, 4), (4, 3), (1, 2)]
+    assert [(b['id'], taken) for b, taken in allocate_fefo(batches, 2)] == [(2, 2)]
+
+
+def test_insufficient_stock_reports_what_is_available():
+    with pytest.raises(InsufficientStock) as excinfo:
+        allocate_fefo([batch(1, date(2027, 1, 1), 2), batch(2, date(2027, 2, 1), 3)], 6)
+    assert excinfo.value.available == 5
+    with pytest.raises(ValueError):
+        allocate_fefo([batch(1, date(2027, 1, 1), 2)], 0)
+
+
+def test_sweeper_drains_full_batches_in_one_run():
+    backlog = [3, 3, 1]
+
+    def sweep(batch_size):
+        return backlog.pop(0) if backlog else 0
+
+    sweeper = ReservationSweeper(sweep, batch_size=3)
+    assert sweeper.sweep_once() == 7
+    assert sweeper.sweep_once() == 0
+    assert sweeper.stats() == {'runs': 2, 'released': 7, 'errors': 0, 'interval': 60.0, 'batch_size': 3}
+
+
+def test_sweeper_survives_errors_and_stops():
+    def sweep(batch_size):
+        raise RuntimeError('connection lost')
+
+    sweeper = ReservationSweeper(sweep, interval=0.01)
+    sweeper.start()
+    deadline = time.monotonic() + 5
+    while sweeper.stats()['errors'] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sweeper.stop()
+    sweeper.join(5)
+    assert sweeper.stats()['errors'] >= 2 and not sweeper.is_alive()
@@ -0,0 +1,92 @@
+import threading
+
+from pincode_geo import PincodeLocator
+from stock_index import StockIndex
+
+PHARMACIES = [
+    {'id': 1, 'pharmacy_name': 'Kaur Medical Store', 'pincode': '147201', 'delivery_available': False},
+    {'id': 2, 'pharmacy_name': 'Nabha Chemists', 'pincode': '147201', 'delivery_available': True},
+    {'id': 3, 'pharmacy_name': 'Patiala Pharmacy', 'pincode': '147001', 'delivery_available': True},
+    {'id': 4, 'pharmacy_name': 'Ludhiana Meds', 'pincode': '141001', 'delivery_available': True},
+    {'id': 5, 'pharmacy_name': 'Delhi Drug House', 'pincode': '110001', 'delivery_available': True},
+]
+
+
+def make_index(availability):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return PHARMACIES, availability
+
+    return StockIndex(loader), calls
+
+
+def names(results):
+    return [(r['pharmacy_name'], r['shared_pincode_digits']) for r in results]
+
+
+def test_nearest_pincodes_first_then_quantity():
+    index, _ = make_index([(1, 10, 5), (2, 10, 50), (3, 10, 80), (4, 10, 7), (5, 10, 900), (1, 11, 3)])
+
+    assert names(index.pharmacies_with(10, pincode='147201')) == [
+        ('Nabha Chemists', 6), ('Kaur Medical Store', 6), ('Patiala Pharmacy', 3),
+        ('Ludhiana Meds', 2), ('Delhi Drug House', 1)]
+    assert names(index.pharmacies_with(10, pincode='147201', limit=3, delivery_only=True)) == [
+        ('Nabha Chemists', 6), ('Patiala Pharmacy', 3), ('Ludhiana Meds', 2)]
+    assert names(index.pharmacies_with(10, pincode='147201', min_shared_digits=3, min_quantity=10)) == [
+        ('Nabha Chemists', 6), ('Patiala Pharmacy', 3)]
+    assert [r['id'] for r in index.pharmacies_with(10)] == [5, 3, 2, 4, 1]
+    assert index.pharmacies_with(99, pincode='147201') == []
+
+
+def test_stock_notifications_patch_the_index_without_reloading():
+    index, calls = make_index([(1, 10, 5)])
+    assert index.quantity(1, 10) == 5
+
+    index.publish({'pharmacy_id': 2, 'medicine_id': 10, 'available': 12})
+    index.publish({'pharmacy_id': 1, 'medicine_id': 10, 'available': 0})
+    assert [r['id'] for r in index.pharmacies_with(10)] == [2]
+    assert len(calls) == 1
+
+    # An unknown pharmacy, or a listener reconnect, forces a reload on the next lookup
+    index.publish({'pharmacy_id': 42, 'medicine_id': 10, 'available': 1})
+    index.pharmacies_with(10)
+    index.wake_all()
+    index.pharmacies_with(10)
+    assert len(calls) == 3
+
+
+def test_changes_during_a_reload_are_not_lost():
+    querying, release = threading.Event(), threading.Event()
+
+    def slow_loader():
+        querying.set()
+        release.wait(5)
+        return PHARMACIES, [(1, 10, 5)]  # snapshot taken before the change below
+
+    index = StockIndex(slow_loader)
+    loading = threading.Thread(target=index.reload)
+    loading.start()
+    querying.wait(5)
+    index.publish({'pharmacy_id': 1, 'medicine_id': 10, 'available': 2})
+    release.set()
+    loading.join()
+
+    assert index.quantity(1, 10) == 2
+
+
+def test_nearest_pharmacies_by_distance(capsys):
+    pharmacies = PHARMACIES + [{'id': 6, 'pharmacy_name': 'Nowhere Meds', 'pincode': '999999', 'delivery_available': True}]
+    index = StockIndex(lambda: (pharmacies, [(1, 10, 5), (3, 10, 8), (4, 10, 9), (5, 10, 1), (6, 10, 50)]),
+                       locator=PincodeLocator())
+    nabha = PincodeLocator().locate('147201')
+
+    nearest = index.nearest_with(10, nabha[0], nabha[1], k=3)
+    assert [(p['pharmacy_name'], p['location_precision']) for p in nearest] == [
+        ('Kaur Medical Store', 6), ('Patiala Pharmacy', 6), ('Ludhiana Meds', 6)]
+    assert nearest[0]['distance_km'] == 0
+    assert [p['id'] for p in index.nearest_with(10, nabha[0], nabha[1], min_quantity=6, max_km=100)] == [3, 4]
+    assert [p['id'] for p in index.nearest_with(10, nabha[0], nabha[1], delivery_only=True, k=1)] == [3]
+    assert index.stats()['located'] == 5
+    assert '1 of 6 pharmacies could not be located' in capsys.readouterr().out
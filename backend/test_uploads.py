@@ -0,0 +1,326 @@
+import hashlib
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# A file rather than sqlite:// so concurrent requests get their own connections
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='helio-db-'), 'test.db'))
+os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp(prefix='helio-uploads-'))
+
+import pytest
+
+import thumbnails
+import upload_sessions
+import upload_store
+from app import app, db, upload_session_store, StoredFile, User, Patient, PrescriptionRequest
+
+# Enough of each format's header to pass the upload signature check
+JPEG = b'\xff\xd8\xff\xe0'
+PNG = b'\x89PNG\r\n\x1a\n'
+PDF = b'%PDF-1.4\n'
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def upload(client, data, name='rx.JPG'):
+    response = client.post('/api/upload', data={'file': (io.BytesIO(data), name)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_store_upload_is_content_addressed(tmp_path):
+    data = PNG + os.urandom(3 * upload_store.CHUNK_SIZE + 17)
+    sha = hashlib.sha256(data).hexdigest()
+
+    first = upload_store.store_upload(io.BytesIO(data), str(tmp_path), 'PNG')
+    second = upload_store.store_upload(io.BytesIO(data), str(tmp_path), 'png')
+
+    assert (first.sha256, first.size, first.created) == (sha, len(data), True)
+    assert (second.relative_path, second.created) == (first.relative_path, False)
+    assert first.relative_path == os.path.join('cas', sha[:2], sha[2:4], f'{sha}.png')
+    assert (tmp_path / first.relative_path).read_bytes() == data
+    assert os.listdir(tmp_path / upload_store.TMP_DIR) == []
+    assert upload_store.parse_content_name(first.name) == (sha, 'png')
+    assert upload_store.parse_content_name('20250101_120000_rx.png') is None
+
+
+def test_identical_uploads_are_stored_once_and_served_immutable(client):
+    data = JPEG + b'prescription photo bytes'
+    first = upload(client, data)
+    second = upload(client, data, name='another-name.jpg')
+
+    assert first['fileUrl'] == second['fileUrl'] == f"/uploads/{hashlib.sha256(data).hexdigest()}.jpg"
+    assert (first['deduplicated'], second['deduplicated']) == (False, True)
+    stored = db.session.get(StoredFile, (first['sha256'], 'jpg'))
+    assert (stored.upload_count, stored.size) == (2, len(data))
+
+    response = client.get(first['fileUrl'])
+    assert response.status_code == 200
+    assert response.data == data
+    assert 'immutable' in response.headers['Cache-Control']
+    response.close()
+
+
+def test_same_bytes_under_another_extension_get_their_own_record(client):
+    data = JPEG + b'scanned prescription'
+    as_jpg = upload(client, data, name='rx.jpg')
+    as_jpeg = upload(client, data, name='rx.jpeg')
+
+    assert as_jpeg['fileUrl'] == as_jpg['fileUrl'].replace('.jpg', '.jpeg')
+    assert (as_jpg['deduplicated'], as_jpeg['deduplicated']) == (False, False)
+    assert [(f.extension, f.upload_count) for f in StoredFile.query.order_by(StoredFile.extension)] == \
+        [('jpeg', 1), ('jpg', 1)]
+    for url in (as_jpg['fileUrl'], as_jpeg['fileUrl']):
+        response = client.get(url)
+        assert response.data == data
+        response.close()
+
+
+def test_concurrent_identical_uploads_share_one_record(client):
+    data = JPEG + os.urandom(200 * 1024)
+
+    def attempt(_):
+        with app.test_client() as other:
+            return upload(other, data)['sha256']
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        hashes = set(pool.map(attempt, range(16)))
+
+    assert len(hashes) == 1
+    db.session.expire_all()
+    assert db.session.get(StoredFile, (hashes.pop(), 'jpg')).upload_count == 16
+
+
+def test_conditional_and_range_requests(client):
+    data = PDF + bytes(range(256)) * 8
+    url = upload(client, data, name='report.pdf')['fileUrl']
+
+    response = client.get(url)
+    etag = response.headers['ETag']
+    response.close()
+    assert etag == f'"{url.rsplit("/", 1)[1].split(".")[0]}"'
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    response = client.get(url, headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == data[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(data)}'
+    response.close()
+
+
+def test_legacy_uploads_revalidate(client):
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], '20250101_120000_rx.png'), 'wb') as f:
+        f.write(b'legacy')
+
+    response = client.get('/uploads/20250101_120000_rx.png')
+    assert response.data == b'legacy'
+    assert 'immutable' not in response.headers['Cache-Control']
+    assert f"max-age={app.config['UPLOAD_MAX_AGE']}" in response.headers['Cache-Control']
+    last_modified = response.headers['Last-Modified']
+    response.close()
+
+    response = client.get('/uploads/20250101_120000_rx.png', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+
+
+def test_accel_redirect_mode_leaves_bytes_to_nginx(client, monkeypatch):
+    stored = upload(client, PNG + b'served by nginx', name='rx.png')
+    monkeypatch.setitem(app.config, 'UPLOAD_SEND_MODE', 'x-accel-redirect')
+
+    response = client.get(stored['fileUrl'])
+    sha = stored['sha256']
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['X-Accel-Redirect'] == f'/protected-uploads/cas/{sha[:2]}/{sha[2:4]}/{sha}.png'
+    assert response.mimetype == 'image/png'
+    assert 'immutable' in response.headers['Cache-Control']
+
+    assert client.get('/uploads/' + '0' * 64 + '.png').status_code == 404
+    assert client.get('/uploads/..%2Fapp.py').status_code == 404
+
+
+def test_unknown_send_mode_is_refused():
+    assert [upload_store.check_send_mode(mode) for mode in upload_store.SEND_MODES] == list(upload_store.SEND_MODES)
+    with pytest.raises(ValueError):
+        upload_store.check_send_mode('x-accel')
+
+
+def wait_for_thumbnails(sha256, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not thumbnails.has_thumbnails(app.config['UPLOAD_FOLDER'], sha256):
+        assert time.monotonic() < deadline, 'thumbnails were not generated'
+        time.sleep(0.05)
+
+
+def test_uploads_get_background_thumbnails_listed_with_requests(client):
+    Image = pytest.importorskip('PIL.Image')
+    photo = io.BytesIO()
+    Image.new('RGBA', (2400, 1800), (200, 30, 30, 128)).save(photo, 'PNG')
+    stored = upload(client, photo.getvalue(), name='phone-photo.png')
+    wait_for_thumbnails(stored['sha256'])
+
+    user = User(email='thumb-patient@demo.com', password_hash='x', user_type='patient')
+    db.session.add(user)
+    db.session.flush()
+    patient = Patient(user_id=user.id, name='Thumb Patient')
+    db.session.add(patient)
+    db.session.flush()
+    db.session.add(PrescriptionRequest(patient_id=patient.id, prescription_image_url=stored['fileUrl']))
+    db.session.add(PrescriptionRequest(patient_id=patient.id, prescription_image_url='/uploads/old_rx.png'))
+    db.session.commit()
+
+    listed = {req['prescriptionImageUrl']: req['thumbnailUrls']
+              for req in client.get('/api/prescription-requests').get_json()}
+    assert listed['/uploads/old_rx.png'] is None
+    urls = listed[stored['fileUrl']]
+    assert urls == {'webp': f"/uploads/{stored['sha256']}.thumb.webp",
+                    'jpg': f"/uploads/{stored['sha256']}.thumb.jpg"}
+
+    for fmt, url in urls.items():
+        response = client.get(url)
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['Cache-Control']
+        image = Image.open(io.BytesIO(response.data))
+        assert (image.format, max(image.size)) == ({'webp': 'WEBP', 'jpg': 'JPEG'}[fmt], thumbnails.THUMBNAIL_SIZE)
+        assert len(response.data) < 20 * 1024
+        response.close()
+
+
+def test_pdf_uploads_get_a_first_page_preview(client):
+    Image = pytest.importorskip('PIL.Image')
+    fitz = pytest.importorskip('fitz')
+    document = fitz.open()
+    page = document.new_page(width=595, height=842)  # A4 portrait
+    page.insert_text((72, 72), 'Rx: Amoxicillin 500mg', fontsize=24)
+    document.new_page()
+    stored = upload(client, document.tobytes(), name='scan.pdf')
+    wait_for_thumbnails(stored['sha256'])
+
+    response = client.get(f"/uploads/{stored['sha256']}.thumb.jpg")
+    image = Image.open(io.BytesIO(response.data))
+    assert image.size == (round(thumbnails.THUMBNAIL_SIZE * 595 / 842), thumbnails.THUMBNAIL_SIZE)
+    response.close()
+
+
+def test_mislabelled_upload_is_rejected(client):
+    response = client.post('/api/upload', data={'file': (io.BytesIO(b'MZ\x90\x00 not a photo'), 'rx.jpg')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 415
+    assert StoredFile.query.count() == 0
+
+
+def start_session(client, size, filename='scan.pdf'):
+    response = client.post('/api/upload/sessions', json={'filename': filename, 'size': size})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['uploadId']
+
+
+def put_piece(client, upload_id, offset, data):
+    return client.put(f'/api/upload/sessions/{upload_id}', data=data,
+                      headers={'Upload-Offset': str(offset), 'Content-Type': 'application/octet-stream'})
+
+
+def test_resumable_upload_survives_a_dropped_piece(client):
+    data = PDF + os.urandom(300 * 1024)
+    upload_id = start_session(client, len(data))
+
+    assert put_piece(client, upload_id, 0, data[:100 * 1024]).get_json()['offset'] == 100 * 1024
+    # The connection drops halfway through the next piece: whatever arrived is kept
+    partial = upload_sessions.UploadSessions(app.config['UPLOAD_FOLDER'], len(data))
+    partial.append(upload_id, 100 * 1024, io.BytesIO(data[100 * 1024:150 * 1024]))
+
+    # A retry from the old offset is refused with the offset to resume from
+    response = put_piece(client, upload_id, 100 * 1024, data[100 * 1024:200 * 1024])
+    assert (response.status_code, response.get_json()['offset']) == (409, 150 * 1024)
+    offset = client.get(f'/api/upload/sessions/{upload_id}').get_json()['offset']
+    assert offset == 150 * 1024
+
+    response = put_piece(client, upload_id, offset, data[offset:])
+    assert response.status_code == 200
+    finished = response.get_json()
+    assert finished['fileUrl'] == f"/uploads/{hashlib.sha256(data).hexdigest()}.pdf"
+    assert client.get(finished['fileUrl']).data == data
+    assert client.get(f'/api/upload/sessions/{upload_id}').status_code == 404
+    assert db.session.get(StoredFile, (finished['sha256'], 'pdf')).size == len(data)
+
+
+def test_resumable_upload_rejects_early(client):
+    response = client.post('/api/upload/sessions', json={'filename': 'rx.exe', 'size': 10})
+    assert response.status_code == 400
+    response = client.post('/api/upload/sessions', json={'filename': 'rx.jpg', 'size': app.config['MAX_CONTENT_LENGTH'] + 1})
+    assert response.status_code == 413
+
+    upload_id = start_session(client, 1000, filename='rx.jpg')
+    assert put_piece(client, upload_id, 0, b'GIF89a' + bytes(500)).status_code == 415
+    assert client.get(f'/api/upload/sessions/{upload_id}').get_json()['offset'] == 0
+    assert put_piece(client, upload_id, 0, JPEG + bytes(1000)).status_code == 413
+    assert client.get(f'/api/upload/sessions/{upload_id}').get_json()['offset'] == 0
+
+    # Without a Content-Length the excess is only noticed while streaming; nothing is kept
+    sessions = upload_sessions.UploadSessions(app.config['UPLOAD_FOLDER'], 1000)
+    with pytest.raises(upload_sessions.UploadTooLarge):
+        sessions.append(upload_id, 0, io.BytesIO(JPEG + bytes(1000)))
+    assert sessions.get(upload_id)['offset'] == 0
+
+
+def test_signature_is_checked_across_tiny_pieces(client):
+    data = JPEG + os.urandom(100)
+    upload_id = start_session(client, len(data), filename='rx.jpg')
+    for offset in range(0, 12, 2):
+        assert put_piece(client, upload_id, offset, data[offset:offset + 2]).status_code == 200
+    assert put_piece(client, upload_id, 12, data[12:]).get_json()['sha256'] == hashlib.sha256(data).hexdigest()
+
+    # The bad bytes only show once the eighth byte is on disk; the whole file is dropped then
+    fake = b'\xff\xd8' + b'MZ' + os.urandom(100)
+    upload_id = start_session(client, len(fake), filename='rx.jpg')
+    for offset in range(0, 6, 3):
+        assert put_piece(client, upload_id, offset, fake[offset:offset + 3]).status_code == 200
+    assert put_piece(client, upload_id, 6, fake[6:12]).status_code == 415
+    assert client.get(f'/api/upload/sessions/{upload_id}').get_json()['offset'] == 0
+
+
+def test_open_sessions_are_capped_and_stray_parts_purged(client, monkeypatch, tmp_path):
+    ttl = upload_sessions.PURGE_INTERVAL_SECONDS + 60
+    sessions = upload_sessions.UploadSessions(str(tmp_path), 1000, ttl=ttl, max_sessions=2)
+    first = sessions.create('pdf', 10)
+    sessions.create('pdf', 10)
+    with pytest.raises(upload_sessions.TooManySessions):
+        sessions.create('pdf', 10)
+
+    # A crash after the part was stored but before its session file went away
+    os.remove(os.path.join(sessions.root, first['id'] + '.json'))
+    stray = os.path.join(sessions.root, 'f' * 32 + '.part')
+    open(stray, 'wb').close()
+    os.utime(stray, (time.time() - 120, time.time() - 120))
+    assert sessions.purge_expired(now=time.time() + upload_sessions.PURGE_INTERVAL_SECONDS) == 1
+    assert not os.path.exists(stray) and os.path.exists(os.path.join(sessions.root, first['id'] + '.part'))
+    assert sessions.create('pdf', 10)['offset'] == 0
+
+    monkeypatch.setattr(upload_session_store, 'max_sessions', 0)
+    response = client.post('/api/upload/sessions', json={'filename': 'rx.pdf', 'size': 10})
+    assert (response.status_code, response.headers['Retry-After']) == (503, '60')
+
+
+def test_demo_app_shares_the_upload_routes():
+    from app_demo import app as demo_app
+    data = PNG + b'demo upload'
+    with demo_app.test_client() as demo:
+        response = demo.post('/api/upload', data={'file': (io.BytesIO(data), 'rx.png')},
+                             content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert response.get_json()['fileUrl'].endswith(f'/uploads/{hashlib.sha256(data).hexdigest()}.png')
+        response = demo.post('/api/upload/sessions', json={'filename': 'rx.png', 'size': len(data)})
+        upload_id = response.get_json()['uploadId']
+        assert put_piece(demo, upload_id, 0, data).status_code == 200
@@ -0,0 +1,135 @@
+"""Background thumbnails for uploaded prescriptions.
+
+After an upload is stored, a small thread pool renders a downscaled JPEG and
+WebP (at most THUMBNAIL_SIZE pixels on the long side) next to the original in
+content-addressed storage, as <sha256>.thumb.jpg / <sha256>.thumb.webp. PDFs
+get a preview of their first page when PyMuPDF is installed. Listings only
+advertise a thumbnail once it exists, so the pharmacist queue falls back to
+the original while a job is still running. Pillow is optional (the demo
+requirements leave it out); without it no thumbnails are made.
+"""
+import os
+import tempfile
+
+import upload_store
+from auth_offload import BoundedExecutor, ExecutorSaturated
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+try:
+    import fitz  # PyMuPDF, for PDF previews
+except ImportError:
+    fitz = None
+
+THUMBNAIL_SIZE = 320
+# (extension, Pillow format, save options); WebP first as the preferred one
+THUMBNAIL_FORMATS = (
+    ('webp', 'WEBP', {'quality': 75, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+)
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+thumbnail_executor = BoundedExecutor(
+    max_workers=int(os.getenv('THUMBNAIL_WORKERS', '2')),
+    max_pending=int(os.getenv('THUMBNAIL_MAX_PENDING', '64')),
+    name='thumbnails'
+)
+
+
+def can_thumbnail(extension):
+    if Image is None:
+        return False
+    return extension in IMAGE_EXTENSIONS or (extension == 'pdf' and fitz is not None)
+
+
+def thumbnail_extension(fmt):
+    return f'thumb.{fmt}'
+
+
+def thumbnail_path(upload_folder, sha256, fmt):
+    return os.path.join(upload_folder, upload_store.content_relative_path(sha256, thumbnail_extension(fmt)))
+
+
+def has_thumbnails(upload_folder, sha256):
+    # The last format is written last, so its presence means the set is complete
+    return os.path.exists(thumbnail_path(upload_folder, sha256, THUMBNAIL_FORMATS[-1][0]))
+
+
+def load_image(path, extension):
+    """Decoded, upright RGB image scaled down towards THUMBNAIL_SIZE"""
+    if extension == 'pdf':
+        with fitz.open(path) as document:
+            page = document[0]
+            zoom = 2 * THUMBNAIL_SIZE / max(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+    image = Image.open(path)
+    # Let the JPEG decoder skip detail we are about to throw away (DCT scaling)
+    image.draft('RGB', (THUMBNAIL_SIZE * 2, THUMBNAIL_SIZE * 2))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        # Flatten transparency onto white rather than black
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    return image.convert('RGB')
+
+
+def generate_thumbnails(upload_folder, sha256, extension):
+    """Render every thumbnail format for one stored upload; returns the names written"""
+    if has_thumbnails(upload_folder, sha256):
+        return []
+    source = os.path.join(upload_folder, upload_store.content_relative_path(sha256, extension))
+    image = load_image(source, extension)
+    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+
+    written = []
+    for fmt, pillow_format, options in THUMBNAIL_FORMATS:
+        target = thumbnail_path(upload_folder, sha256, fmt)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                image.save(out, pillow_format, **options)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        written.append(f'{sha256}.{thumbnail_extension(fmt)}')
+    return written
+
+
+def run_thumbnail_job(upload_folder, sha256, extension):
+    try:
+        return generate_thumbnails(upload_folder, sha256, extension)
+    except Exception as e:
+        print(f"Thumbnail error for {sha256}.{extension}: {e}")
+        return []
+
+
+def enqueue_thumbnails(upload_folder, stored):
+    """Schedule thumbnails for a StoredUpload; returns the future, or None if nothing was queued"""
+    if not can_thumbnail(stored.extension) or has_thumbnails(upload_folder, stored.sha256):
+        return None
+    try:
+        return thumbnail_executor.submit(run_thumbnail_job, upload_folder, stored.sha256, stored.extension)
+    except ExecutorSaturated:
+        # The listing keeps showing the original; the next identical upload retries
+        print(f"Thumbnail queue full, skipping {stored.name}")
+        return None
+
+
+def thumbnail_urls(upload_folder, file_url):
+    """{'webp': url, 'jpg': url} for an upload URL whose thumbnails exist, else None"""
+    if not file_url:
+        return None
+    base, _, filename = file_url.rpartition('/')
+    content = upload_store.parse_content_name(filename)
+    if content is None or not has_thumbnails(upload_folder, content[0]):
+        return None
+    return {fmt: f'{base}/{content[0]}.{thumbnail_extension(fmt)}' for fmt, _, _ in THUMBNAIL_FORMATS}
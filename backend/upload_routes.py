@@ -0,0 +1,142 @@
+"""Upload routes shared by app.py and app_demo.py.
+
+Both apps accept uploads the same way: in one request to /api/upload, or
+resumably through /api/upload/sessions, with the result served from
+/uploads/<filename>. Only what happens once a file is stored differs (app.py
+records it in the database), so each app passes its own
+stored_upload_response().
+"""
+import os
+
+from flask import request, jsonify
+from werkzeug.utils import secure_filename
+
+import upload_sessions
+import upload_store
+
+
+def upload_session_state(session):
+    return {
+        'uploadId': session['id'],
+        'offset': session['offset'],
+        'size': session['size'],
+        'chunkSize': upload_sessions.CLIENT_CHUNK_SIZE
+    }
+
+
+def register_upload_routes(app, allowed_file, stored_upload_response, on_error=None):
+    """Add the upload routes to `app` and return its UploadSessions store.
+
+    stored_upload_response(stored) builds the response once a file is in
+    content-addressed storage; on_error(), if given, runs before a 500 is
+    returned (app.py rolls back its database session there).
+    """
+    # Resumable uploads: declare the file, then PUT it in pieces with an Upload-Offset header
+    upload_session_store = upload_sessions.UploadSessions(
+        app.config['UPLOAD_FOLDER'], app.config['MAX_CONTENT_LENGTH'],
+        max_sessions=int(os.getenv('UPLOAD_MAX_SESSIONS', '1000'))
+    )
+
+    def failed(action, message, e):
+        print(f"{action} error: {e}")
+        if on_error:
+            on_error()
+        return jsonify({'message': message, 'error': str(e)}), 500
+
+    @app.route('/api/upload', methods=['POST'])
+    def upload_file():
+        """Upload prescription image files"""
+        try:
+            if 'file' not in request.files:
+                return jsonify({'message': 'No file provided'}), 400
+
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'message': 'No file selected'}), 400
+
+            if file and allowed_file(file.filename):
+                extension = secure_filename(file.filename).rsplit('.', 1)[1].lower()
+                # Identical files land on the same path, so the filesystem itself deduplicates
+                stored = upload_store.store_upload(file.stream, app.config['UPLOAD_FOLDER'], extension)
+                return stored_upload_response(stored)
+            else:
+                return jsonify({'message': 'Invalid file type'}), 400
+
+        except upload_store.InvalidUpload as e:
+            return jsonify({'message': str(e)}), 415
+        except Exception as e:
+            return failed('Upload', 'Upload failed', e)
+
+    @app.route('/api/upload/sessions', methods=['POST'])
+    def create_upload_session():
+        """Start a resumable upload of a file of known size"""
+        try:
+            data = request.get_json() or {}
+            filename = secure_filename(data.get('filename', ''))
+            if not allowed_file(filename):
+                return jsonify({'message': 'Invalid file type'}), 400
+            try:
+                size = int(data.get('size'))
+            except (TypeError, ValueError):
+                return jsonify({'message': 'size is required'}), 400
+
+            session = upload_session_store.create(filename.rsplit('.', 1)[1], size)
+            return jsonify(upload_session_state(session)), 201
+
+        except upload_sessions.TooManySessions:
+            response = jsonify({'message': 'Too many uploads in progress, retry shortly'})
+            response.headers['Retry-After'] = '60'
+            return response, 503
+        except upload_sessions.UploadTooLarge as e:
+            return jsonify({'message': str(e)}), 413
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        except Exception as e:
+            return failed('Create upload session', 'Failed to start upload', e)
+
+    @app.route('/api/upload/sessions/<upload_id>', methods=['GET'])
+    def get_upload_session(upload_id):
+        """Current offset of a resumable upload, to continue after a dropped connection"""
+        try:
+            return jsonify(upload_session_state(upload_session_store.get(upload_id))), 200
+        except upload_sessions.UploadSessionNotFound:
+            return jsonify({'message': 'Upload not found'}), 404
+
+    @app.route('/api/upload/sessions/<upload_id>', methods=['PUT'])
+    def put_upload_chunk(upload_id):
+        """Append one piece of a resumable upload, starting at Upload-Offset"""
+        try:
+            try:
+                offset = int(request.headers['Upload-Offset'])
+            except (KeyError, ValueError):
+                return jsonify({'message': 'Upload-Offset header is required'}), 400
+
+            session = upload_session_store.get(upload_id)
+            # Refuse a piece that cannot fit before reading any of its body
+            if request.content_length is not None and offset + request.content_length > session['size']:
+                return jsonify({'message': 'Chunk exceeds the declared upload size'}), 413
+
+            session, stored = upload_session_store.append(upload_id, offset, request.stream)
+            if stored is None:
+                return jsonify(upload_session_state(session)), 200
+            return stored_upload_response(stored)
+
+        except upload_sessions.UploadSessionNotFound:
+            return jsonify({'message': 'Upload not found'}), 404
+        except upload_sessions.OffsetMismatch as e:
+            return jsonify({'message': 'Offset mismatch', 'offset': e.offset}), 409
+        except upload_sessions.SessionBusy:
+            return jsonify({'message': 'Another chunk of this upload is in progress'}), 409
+        except upload_sessions.UploadTooLarge as e:
+            return jsonify({'message': str(e)}), 413
+        except upload_store.InvalidUpload as e:
+            return jsonify({'message': str(e)}), 415
+        except Exception as e:
+            return failed('Upload chunk', 'Upload failed', e)
+
+    @app.route('/uploads/<filename>')
+    def uploaded_file(filename):
+        """Serve uploaded files"""
+        return upload_store.send_upload(filename)
+
+    return upload_session_store
@@ -0,0 +1,220 @@
+"""Resumable chunked uploads.
+
+A client first declares the file it is about to send (type and total size)
+and gets an upload id back. It then PUTs the bytes in as many pieces as it
+likes, each tagged with the offset it starts at; after a dropped connection
+it asks for the current offset and carries on from there instead of starting
+over. Each piece is streamed to disk in small chunks; as soon as the file's
+first bytes are on disk they are checked against the file type's signature,
+however small the pieces that brought them, and once the declared size has
+arrived the file moves into content-addressed storage
+(upload_store.store_file).
+
+Session state lives on disk under UPLOAD_FOLDER/sessions (a JSON file plus
+the partial data), so any worker process can continue an upload. Pieces for
+one session are serialised with flock where the platform has it.
+"""
+import json
+import os
+import re
+import time
+import uuid
+
+import upload_store
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows development servers: no cross-process session locking
+
+SESSIONS_DIR = 'sessions'
+SESSION_TTL_SECONDS = 24 * 3600
+PURGE_INTERVAL_SECONDS = 600
+# Suggested piece size for clients: small enough to retry cheaply on a bad connection
+CLIENT_CHUNK_SIZE = 1024 * 1024
+
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadSessionNotFound(Exception):
+    """Unknown, finished or expired upload id"""
+
+
+class OffsetMismatch(Exception):
+    """A piece was sent for an offset other than the session's current one"""
+
+    def __init__(self, offset):
+        super().__init__(f'Upload is at offset {offset}')
+        self.offset = offset
+
+
+class UploadTooLarge(Exception):
+    """More bytes were sent than the session declared"""
+
+
+class SessionBusy(Exception):
+    """Another request is writing to the same session"""
+
+
+class TooManySessions(Exception):
+    """`max_sessions` uploads are already in progress"""
+
+
+class UploadSessions:
+    """Resumable upload sessions stored under `upload_folder`, at most `max_sessions` open at once"""
+
+    def __init__(self, upload_folder, max_size, ttl=SESSION_TTL_SECONDS, max_sessions=1000):
+        self.upload_folder = upload_folder
+        self.root = os.path.join(upload_folder, SESSIONS_DIR)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._last_purge = 0.0
+
+    def _paths(self, upload_id):
+        if not UPLOAD_ID_RE.match(upload_id or ''):
+            raise UploadSessionNotFound(upload_id)
+        base = os.path.join(self.root, upload_id)
+        return base + '.json', base + '.part'
+
+    def create(self, extension, size):
+        """Start a session for a file of `size` bytes; returns its state"""
+        if size <= 0:
+            raise ValueError('Upload size must be positive')
+        if size > self.max_size:
+            raise UploadTooLarge(f'Uploads are limited to {self.max_size} bytes')
+        os.makedirs(self.root, exist_ok=True)
+        self.purge_expired()
+        if self.open_count() >= self.max_sessions:
+            # Each session holds disk space until it finishes or expires
+            raise TooManySessions(f'{self.max_sessions} uploads already in progress')
+
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._paths(upload_id)
+        session = {'id': upload_id, 'extension': extension.lower(), 'size': size, 'created_at': time.time()}
+        open(part_path, 'wb').close()
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(session, f)
+        os.replace(tmp_path, meta_path)
+        return dict(session, offset=0)
+
+    def open_count(self):
+        return sum(1 for name in os.listdir(self.root) if name.endswith('.json'))
+
+    def get(self, upload_id):
+        """Session state including the current `offset`"""
+        meta_path, part_path = self._paths(upload_id)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                session = json.load(f)
+            offset = os.path.getsize(part_path)
+        except FileNotFoundError:
+            raise UploadSessionNotFound(upload_id)
+        if session['created_at'] + self.ttl < time.time():
+            self._discard(upload_id)
+            raise UploadSessionNotFound(upload_id)
+        return dict(session, offset=offset)
+
+    def append(self, upload_id, offset, stream, chunk_size=upload_store.CHUNK_SIZE):
+        """Write the piece in `stream` at `offset`.
+
+        Returns (session, stored) where `stored` is the StoredUpload once the
+        last byte has arrived and None before that.
+        """
+        meta_path, part_path = self._paths(upload_id)
+        session = self.get(upload_id)
+        try:
+            part = open(part_path, 'r+b')
+        except FileNotFoundError:
+            raise UploadSessionNotFound(upload_id)
+        with part:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise SessionBusy(upload_id)
+            current = os.fstat(part.fileno()).st_size
+            if offset != current:
+                raise OffsetMismatch(current)
+
+            remaining = session['size'] - current
+            # The signature is checked once this many bytes are on disk
+            head_length = min(upload_store.SIGNATURE_LENGTH, session['size'])
+            part.seek(current)
+            chunk = stream.read(min(chunk_size, remaining + 1))
+            while chunk:
+                if len(chunk) > remaining:
+                    part.truncate(offset)
+                    raise UploadTooLarge(f"Upload declared {session['size']} bytes")
+                part.write(chunk)
+                remaining -= len(chunk)
+                written = session['size'] - remaining
+                if written - len(chunk) < head_length <= written:
+                    self._check_head(part, session, head_length)
+                chunk = stream.read(min(chunk_size, remaining + 1))
+            part.flush()
+            session['offset'] = session['size'] - remaining
+            if remaining:
+                return session, None
+
+            # Complete: hand the data to content-addressed storage while still holding the lock
+            stored = upload_store.store_file(part_path, self.upload_folder, session['extension'])
+            os.remove(meta_path)
+            return session, stored
+
+    def _check_head(self, part, session, head_length):
+        """Check the file's first bytes, read back from disk since earlier pieces may have brought some.
+
+        A mislabelled file is emptied, so the session starts over from offset 0.
+        """
+        part.flush()
+        part.seek(0)
+        head = part.read(head_length)
+        part.seek(0, os.SEEK_END)
+        try:
+            upload_store.check_signature(session['extension'], head)
+        except upload_store.InvalidUpload:
+            part.truncate(0)
+            raise
+
+    def _discard(self, upload_id):
+        for path in self._paths(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def purge_expired(self, now=None):
+        """Delete sessions older than the TTL; runs at most every PURGE_INTERVAL_SECONDS.
+
+        Also removes stray partial files whose session file is gone (e.g. after a
+        crash mid-completion) once they are older than the TTL.
+        """
+        now = time.time() if now is None else now
+        if now - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return 0
+        self._last_purge = now
+        purged = 0
+        names = set(os.listdir(self.root))
+        for name in names:
+            upload_id, extension = os.path.splitext(name)
+            if not UPLOAD_ID_RE.match(upload_id):
+                continue
+            if extension == '.part' and upload_id + '.json' not in names:
+                try:
+                    if os.path.getmtime(os.path.join(self.root, name)) + self.ttl < now:
+                        os.remove(os.path.join(self.root, name))
+                        purged += 1
+                except OSError:
+                    pass
+                continue
+            if extension != '.json':
+                continue
+            try:
+                with open(os.path.join(self.root, name), encoding='utf-8') as f:
+                    expired = json.load(f)['created_at'] + self.ttl < now
+            except (OSError, ValueError, KeyError):
+                continue
+            if expired:
+                self._discard(upload_id)
+                purged += 1
+        return purged
@@ -0,0 +1,192 @@
+"""Content-addressed storage for uploaded files.
+
+An upload is streamed to a temporary file in chunks while its SHA-256 is
+computed, then moved to UPLOAD_FOLDER/cas/<aa>/<bb>/<sha256>.<ext>. A second
+upload of the same bytes finds the file already there and the temporary copy
+is dropped, so each distinct file is stored once. Stored files never change,
+which lets them be served with long-lived cache headers; they are addressed
+publicly as /uploads/<sha256>.<ext>.
+
+send_upload() serves both these and legacy flat-named uploads with
+ETag/Last-Modified validation and Range support, or, when UPLOAD_SEND_MODE is
+'x-accel-redirect', hands the bytes off to nginx (see nginx_helio.conf.sample).
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from urllib.parse import quote
+
+from flask import current_app, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+CHUNK_SIZE = 64 * 1024
+CAS_DIR = 'cas'
+TMP_DIR = 'tmp'
+
+# <sha256>.<ext> as handed out in upload URLs, or <sha256>.thumb.<ext> for
+# thumbnails derived from it (see thumbnails.py)
+CONTENT_NAME_RE = re.compile(r'^([0-9a-f]{64})\.((?:thumb\.)?[a-z0-9]{1,10})$')
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+SEND_MODES = ('', 'x-sendfile', 'x-accel-redirect')
+
+
+class StoredUpload:
+    """Result of store_upload()"""
+
+    def __init__(self, sha256, extension, size, relative_path, created):
+        self.sha256 = sha256
+        self.extension = extension
+        self.size = size
+        self.relative_path = relative_path
+        self.created = created  # False when identical content was already stored
+
+    @property
+    def name(self):
+        return f'{self.sha256}.{self.extension}'
+
+
+def check_send_mode(mode):
+    """`mode` if it is one of SEND_MODES, else ValueError (a typo would quietly serve from Python)"""
+    if mode not in SEND_MODES:
+        raise ValueError(f'UPLOAD_SEND_MODE must be one of {SEND_MODES}, not {mode!r}')
+    return mode
+
+
+def content_relative_path(sha256, extension):
+    """Sharded path of a stored file, relative to the upload folder"""
+    return os.path.join(CAS_DIR, sha256[:2], sha256[2:4], f'{sha256}.{extension}')
+
+
+def parse_content_name(filename):
+    """(sha256, extension) if `filename` names a content-addressed upload, else None"""
+    match = CONTENT_NAME_RE.match(filename)
+    return match.groups() if match else None
+
+
+class InvalidUpload(Exception):
+    """The upload's content does not match its file type"""
+
+
+# Leading bytes of each accepted file type; the extension alone proves nothing
+SIGNATURES = {
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'gif': (b'GIF87a', b'GIF89a'),
+    'pdf': (b'%PDF-',),
+    'doc': (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',),
+    'docx': (b'PK\x03\x04',),
+}
+SIGNATURE_LENGTH = max(len(sig) for sigs in SIGNATURES.values() for sig in sigs)
+
+
+def check_signature(extension, head):
+    """Raise InvalidUpload unless `head` (the first bytes of the file) fits `extension`"""
+    signatures = SIGNATURES.get(extension)
+    if signatures is not None and not head.startswith(signatures):
+        raise InvalidUpload(f'File content is not a valid {extension} file')
+
+
+def store_upload(stream, upload_folder, extension, chunk_size=CHUNK_SIZE):
+    """Stream `stream` into content-addressed storage and return a StoredUpload.
+
+    The first chunk is checked against the extension's signature before
+    anything is written, so a mislabelled upload raises InvalidUpload early.
+    """
+    extension = extension.lower()
+    head = stream.read(chunk_size)
+    check_signature(extension, head)
+
+    tmp_dir = os.path.join(upload_folder, TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            chunk = head
+            while chunk:
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+                chunk = stream.read(chunk_size)
+        return place_upload(tmp_path, upload_folder, extension, digest.hexdigest(), size)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def store_file(path, upload_folder, extension, chunk_size=CHUNK_SIZE):
+    """Move a fully written file (e.g. a finished resumable upload) into storage.
+
+    `path` must be on the same filesystem as `upload_folder`; it is consumed.
+    """
+    extension = extension.lower()
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        check_signature(extension, f.read(SIGNATURE_LENGTH))
+        f.seek(0)
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    try:
+        return place_upload(path, upload_folder, extension, digest.hexdigest(), size)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def place_upload(tmp_path, upload_folder, extension, sha256, size):
+    """Move `tmp_path` to its content address unless identical content is already there"""
+    relative_path = content_relative_path(sha256, extension)
+    final_path = os.path.join(upload_folder, relative_path)
+    created = not os.path.exists(final_path)
+    if created:
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.chmod(tmp_path, 0o644)
+        # Atomic, so a concurrent identical upload just replaces equal bytes
+        os.replace(tmp_path, final_path)
+    return StoredUpload(sha256, extension, size, relative_path, created)
+
+
+def send_upload(filename):
+    """Response for GET /uploads/<filename>, honouring the app's UPLOAD_SEND_MODE"""
+    config = current_app.config
+    content = parse_content_name(filename)
+    if content is not None:
+        # The name is the hash of the bytes, so the response can never change
+        path, etag, max_age = content_relative_path(*content), content[0], IMMUTABLE_MAX_AGE
+    else:
+        # Files uploaded before content addressing keep their flat names and may be replaced
+        path, etag, max_age = filename, True, config.get('UPLOAD_MAX_AGE', 0)
+
+    if config.get('UPLOAD_SEND_MODE') == 'x-accel-redirect':
+        response = accel_redirect(config['UPLOAD_FOLDER'], path, config['UPLOAD_ACCEL_PREFIX'], max_age)
+    else:
+        # x-sendfile is handled by Flask itself through USE_X_SENDFILE
+        response = send_from_directory(config['UPLOAD_FOLDER'], path, etag=etag, max_age=max_age)
+    if content is not None:
+        response.cache_control.immutable = True
+    return response
+
+
+def accel_redirect(upload_folder, path, prefix, max_age):
+    """Empty response telling nginx to send `path` from its internal `prefix` location"""
+    full_path = safe_join(upload_folder, path)
+    if full_path is None or not os.path.isfile(full_path):
+        raise NotFound()
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    response = current_app.response_class(mimetype=mimetype)
+    # nginx answers conditional and Range requests itself from the file it serves
+    response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(path.replace(os.sep, '/'))
+    if max_age:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    return response
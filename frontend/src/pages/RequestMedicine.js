@@ -35,7 +35,7 @@ export default function RequestMedicine() {
     setUploading(true);
     try {
       const user = JSON.parse(localStorage.getItem('user') || '{}');
-  const response = await uploadAPI.uploadFile(selectedFile, 'prescription');
+  const response = await uploadAPI.uploadFileResumable(selectedFile);
   // Normalize to absolute URL for consistent rendering across origins
   const rawUrl = response.data.fileUrl;
   const backend = (process.env.REACT_APP_API_URL || 'http://localhost:5000/api').replace(/\/api$/,'');
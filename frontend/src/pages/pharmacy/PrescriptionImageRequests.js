@@ -74,7 +74,11 @@ const PrescriptionImageRequests = () => {
           ...r,
           patientName: forcedName || r.patientName || 'Patient',
           patientId: formattedId,
-          prescriptionImageUrl: toAbsoluteUrl(r.prescriptionImageUrl)
+          prescriptionImageUrl: toAbsoluteUrl(r.prescriptionImageUrl),
+          thumbnailUrls: r.thumbnailUrls ? {
+            webp: toAbsoluteUrl(r.thumbnailUrls.webp),
+            jpg: toAbsoluteUrl(r.thumbnailUrls.jpg)
+          } : null
         };
       });
       
@@ -212,9 +216,21 @@ const PrescriptionImageRequests = () => {
                       </h4>
                       {request.prescriptionImageUrl ? (
                         <div className="rx-image-box">
-                          <div className="w-12 h-12 bg-blue-100 rounded-lg flex items-center justify-center mb-3">
-                            <FaImage className="text-blue-600 text-xl" />
-                          </div>
+                          {request.thumbnailUrls ? (
+                            <picture>
+                              <source srcSet={request.thumbnailUrls.webp} type="image/webp" />
+                              <img
+                                src={request.thumbnailUrls.jpg}
+                                alt="Prescription thumbnail"
+                                loading="lazy"
+                                className="max-h-40 rounded-lg mb-3 object-contain"
+                              />
+                            </picture>
+                          ) : (
+                            <div className="w-12 h-12 bg-blue-100 rounded-lg flex items-center justify-center mb-3">
+                              <FaImage className="text-blue-600 text-xl" />
+                            </div>
+                          )}
                           <p className="text-sm font-medium text-gray-900 mb-3 text-center">Prescription Available</p>
                           <button
                              onClick={() => window.open(request.prescriptionImageUrl, '_blank')}
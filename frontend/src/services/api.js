@@ -77,7 +77,10 @@ export const appointmentAPI = {
   update: (id, data) => api.put(`/appointments/${id}`, data),
   cancel: (id) => api.delete(`/appointments/${id}`),
   getAvailableSlots: (doctorId, date) => 
-    api.get(`/appointments/slots?doctor_id=${doctorId}&date=${date}`)
+    api.get(`/appointments/slots?doctor_id=${doctorId}&date=${date}`),
+  getFirstAvailable: (params = {}) => api.get('/appointments/first-available', { params }),
+  holdSlot: (holdData) => api.post('/appointments/holds', holdData),
+  releaseHold: (holdId) => api.delete(`/appointments/holds/${holdId}`)
 };
 
 // Prescription API calls
@@ -88,6 +91,32 @@ export const prescriptionAPI = {
   update: (id, data) => api.put(`/prescriptions/${id}`, data)
 };
 
+// Server-Sent Events. EventSource cannot set headers, so the token goes in
+// the query string; the browser reconnects on its own and resumes from the
+// last event id.
+const openEventStream = (path, eventName, onEvent) => {
+  const token = localStorage.getItem('token');
+  const source = new EventSource(`${API_BASE_URL}${path}?jwt=${encodeURIComponent(token || '')}`);
+  source.addEventListener(eventName, (event) => onEvent(JSON.parse(event.data)));
+  return source;
+};
+
+// Notification API calls
+export const notificationAPI = {
+  getAll: (params = {}) => api.get('/notifications', { params }),
+  openStream: (onNotification) => openEventStream('/notifications/stream', 'notification', onNotification)
+};
+
+// Chat API calls
+export const chatAPI = {
+  getMessages: (appointmentId, params = {}) => api.get(`/chat/${appointmentId}/messages`, { params }),
+  send: (appointmentId, messageData) => api.post(`/chat/${appointmentId}/messages`, messageData),
+  markRead: (appointmentId, upToId) => api.post(`/chat/${appointmentId}/read`, upToId ? { up_to_id: upToId } : {}),
+  getUnreadCounts: (appointmentIds) =>
+    api.get('/chat/unread', { params: appointmentIds ? { appointment_ids: appointmentIds.join(',') } : {} }),
+  openStream: (appointmentId, onMessage) => openEventStream(`/chat/${appointmentId}/stream`, 'message', onMessage)
+};
+
 // File upload
 export const uploadAPI = {
   uploadFile: (file, type = 'document') => {
@@ -100,6 +129,39 @@ export const uploadAPI = {
         'Content-Type': 'multipart/form-data'
       }
     });
+  },
+
+  // Sends the file in pieces and resumes from the server's offset after a failure,
+  // so a dropped connection only costs the piece in flight. Resolves like uploadFile.
+  uploadFileResumable: async (file, { onProgress, maxRetries = 5 } = {}) => {
+    const { data: session } = await api.post('/upload/sessions', { filename: file.name, size: file.size });
+    let offset = session.offset;
+    let failures = 0;
+    while (true) {
+      const end = Math.min(offset + session.chunkSize, file.size);
+      try {
+        const response = await api.put(`/upload/sessions/${session.uploadId}`, file.slice(offset, end), {
+          headers: { 'Content-Type': 'application/octet-stream', 'Upload-Offset': String(offset) }
+        });
+        if (response.data.fileUrl) {
+          if (onProgress) onProgress(1);
+          return response;
+        }
+        offset = response.data.offset;
+        failures = 0;
+      } catch (error) {
+        const status = error.response?.status;
+        if (status && status !== 409 && status < 500) throw error;
+        if (++failures > maxRetries) throw error;
+        await new Promise((resolve) => setTimeout(resolve, Math.min(1000 * 2 ** failures, 15000)));
+        try {
+          ({ data: { offset } } = await api.get(`/upload/sessions/${session.uploadId}`));
+        } catch {
+          // Still offline: retry the same piece, a 409 tells us if the offset moved
+        }
+      }
+      if (onProgress) onProgress(offset / file.size);
+    }
   }
 };
 